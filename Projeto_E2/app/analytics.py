@@ -0,0 +1,190 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""API de análise (só leitura) sobre os cubos cubo_vendas e cubo_frota.
+
+Serve as análises do relatório (E2-report-62.ipynb, ponto 5) a partir dos
+agregados por rota e dia mantidos em aviacao.sql. Os cubos são atualizados no
+máximo a cada <intervalo> segundos por worker, antes de servir um pedido, e as
+respostas podem ser guardadas em cache pelo mesmo tempo (Cache-Control).
+Todas as listas são paginadas com ?pagina=N&por_pagina=M e indicam as páginas
+vizinhas no cabeçalho Link.
+"""
+import logging
+import threading
+import time
+from datetime import date
+
+from flask import Blueprint, jsonify, request, url_for
+from psycopg.rows import dict_row
+
+from consultas import CONSULTAS
+
+log = logging.getLogger(__name__)
+
+POR_PAGINA = 100
+POR_PAGINA_MAX = 1000
+
+ESPACOS = ("global", "pais", "cidade")
+TEMPOS = ("global", "ano", "mes", "dia")
+
+
+class PedidoInvalido(ValueError):
+    pass
+
+
+def _somar_meses(dia, meses):
+    """Primeiro dia do mês <meses> meses depois (ou antes) do de <dia>."""
+    n = dia.year * 12 + dia.month - 1 + meses
+    return date(n // 12, n % 12 + 1, 1)
+
+
+def _inteiro(nome):
+    valor = request.args.get(nome)
+    if valor is None:
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise PedidoInvalido(f"Parâmetro {nome} inválido.")
+
+
+def _nivel(nome, niveis, omissao):
+    valor = request.args.get(nome, omissao)
+    if valor not in niveis:
+        raise PedidoInvalido(f"Parâmetro {nome} deve ser um de: {', '.join(niveis)}.")
+    return valor
+
+
+def _periodo():
+    """Intervalo [desde, ate) dado por ?ano=&mes=&dia= (todo o histórico se omitido)."""
+    ano, mes, dia = _inteiro("ano"), _inteiro("mes"), _inteiro("dia")
+    if ano is None:
+        if mes is not None or dia is not None:
+            raise PedidoInvalido("Parâmetro mes ou dia sem ano.")
+        return date.min, date.max
+    try:
+        if mes is None:
+            if dia is not None:
+                raise PedidoInvalido("Parâmetro dia sem mes.")
+            return date(ano, 1, 1), date(ano + 1, 1, 1)
+        if dia is None:
+            inicio = date(ano, mes, 1)
+            return inicio, _somar_meses(inicio, 1)
+        inicio = date(ano, mes, dia)
+        return inicio, date.fromordinal(inicio.toordinal() + 1)
+    except (ValueError, OverflowError):
+        raise PedidoInvalido("Data inválida.")
+
+
+def _filtros_espaco(*nomes):
+    return {nome: request.args.get(nome) for nome in nomes}
+
+
+def criar_analytics(pool, intervalo=60, leituras=None):
+    """Blueprint /analytics com as análises servidas a partir dos cubos em <pool>,
+    lidos das ligações de <leituras> (ver leitura.py) se indicado."""
+    leituras = leituras or pool
+    bp = Blueprint("analytics", __name__, url_prefix="/analytics")
+    estado = {"atualizado_em": None}
+    lock = threading.Lock()
+
+    def atualizar_cubos():
+        agora = time.monotonic()
+        if estado["atualizado_em"] is not None and agora - estado["atualizado_em"] < intervalo:
+            return
+        # um só thread por worker atualiza; os restantes servem o cubo como está
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            with pool.connection() as conn:
+                dias = conn.execute(CONSULTAS["atualizar_cubos"]).fetchone().dias
+            estado["atualizado_em"] = agora
+            if dias:
+                log.debug(f"Refreshed {dias} days of the analytics cubes.")
+        finally:
+            lock.release()
+
+    def paginar(consulta, params):
+        """Executa a <consulta> para a página pedida; devolve a resposta com Link e Cache-Control."""
+        pagina = max(request.args.get("pagina", 1, type=int), 1)
+        por_pagina = min(max(request.args.get("por_pagina", POR_PAGINA, type=int), 1), POR_PAGINA_MAX)
+
+        atualizar_cubos()
+        with leituras.connection() as conn:
+            with conn.cursor(row_factory=dict_row) as cur:
+                linhas = cur.execute(
+                    CONSULTAS[consulta],
+                    {**params, "limite": por_pagina + 1, "deslocamento": (pagina - 1) * por_pagina},
+                ).fetchall()
+
+        resposta = jsonify(linhas[:por_pagina])
+        links = []
+        argumentos = request.args.to_dict()
+        if len(linhas) > por_pagina:
+            links.append(f'<{url_for(request.endpoint, **{**argumentos, "pagina": pagina + 1})}>; rel="next"')
+        if pagina > 1:
+            links.append(f'<{url_for(request.endpoint, **{**argumentos, "pagina": pagina - 1})}>; rel="prev"')
+        if links:
+            resposta.headers["Link"] = ", ".join(links)
+        resposta.cache_control.public = True
+        resposta.cache_control.max_age = intervalo
+        return resposta
+
+    @bp.errorhandler(PedidoInvalido)
+    def pedido_invalido(e):
+        return jsonify({"message": str(e), "status": "error"}), 400
+
+    @bp.route("/rotas", methods=("GET",))
+    def rotas():
+        """Rotas por taxa de ocupação média (passageiros / assentos), por omissão no último ano."""
+        desde, ate = _periodo()
+        if "ano" not in request.args:
+            hoje = date.today().toordinal()
+            desde, ate = date.fromordinal(hoje - 365), date.fromordinal(hoje + 1)
+        return paginar("analise_rotas", {"desde": desde, "ate": ate})
+
+    @bp.route("/frota", methods=("GET",))
+    def frota():
+        """Rotas em que voaram todos os aviões nos últimos ?meses= meses (3 por omissão), incluindo o atual."""
+        meses = _inteiro("meses")
+        meses = 3 if meses is None else meses
+        if meses < 0:
+            raise PedidoInvalido("Parâmetro meses inválido.")
+        inicio_mes = date.today().replace(day=1)
+        return paginar(
+            "analise_frota",
+            {"desde": _somar_meses(inicio_mes, -meses), "ate": _somar_meses(inicio_mes, 1)},
+        )
+
+    @bp.route("/vendas", methods=("GET",))
+    def vendas():
+        """Vendas globais e por classe em ?espaco=global|pais|cidade e ?tempo=global|ano|mes|dia,
+        filtradas por ?ano=&mes=&dia= e ?pais_partida=&cidade_partida=&pais_chegada=&cidade_chegada=."""
+        desde, ate = _periodo()
+        return paginar(
+            "analise_vendas",
+            {
+                "espaco": _nivel("espaco", ESPACOS, "global"),
+                "tempo": _nivel("tempo", TEMPOS, "global"),
+                "desde": desde,
+                "ate": ate,
+                **_filtros_espaco("pais_partida", "cidade_partida", "pais_chegada", "cidade_chegada"),
+            },
+        )
+
+    @bp.route("/classes", methods=("GET",))
+    def classes():
+        """Rácio entre passageiros de primeira e segunda classe por dia da semana,
+        em ?espaco=global|pais|cidade (da partida), filtrado por ?pais_partida=&cidade_partida=."""
+        desde, ate = _periodo()
+        return paginar(
+            "analise_classes",
+            {
+                "espaco": _nivel("espaco", ESPACOS, "global"),
+                "desde": desde,
+                "ate": ate,
+                **_filtros_espaco("pais_partida", "cidade_partida"),
+            },
+        )
+
+    return bp
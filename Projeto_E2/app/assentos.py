@@ -0,0 +1,195 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Mapas de assentos dos voos por partir em bitmaps, em memória, por worker.
+
+O mapa de um voo é a lista dos lugares do avião por fila e letra, que dá a
+ordem dos bits, e dois bitmaps com um bit por lugar: primeira classe e
+ocupado. É lido numa só consulta (mapa_assentos: um lugar está ocupado se não
+estiver em assento_livre) e guardado numa LRU durante <ttl> segundos. Um
+check-in feito neste worker marca logo o lugar no bitmap; os dos outros workers
+aparecem ao fim de <ttl> segundos, no máximo. O trigger em voo notifica o canal
+CANAL com o aeroporto de partida, cujos mapas são descartados.
+
+O check-in continua a reclamar o lugar de assento_livre (reclamar_lugar), com
+FOR UPDATE SKIP LOCKED: é partilhada por todos os workers, e um bitmap em
+memória não impede dois workers de darem o mesmo lugar.
+
+Formato binário (?formato=binario), para os quiosques, em big-endian:
+
+    >IH               id do voo e número de lugares n
+    ceil(n / 8) bytes primeira classe
+    ceil(n / 8) bytes ocupados
+
+com o lugar i no bit 7 - i % 8 do byte i // 8, pela ordem da lista "lugares"
+da resposta JSON (que só muda se o avião do voo mudar).
+"""
+import base64
+import hashlib
+import logging
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from consultas import CONSULTAS
+
+log = logging.getLogger(__name__)
+
+FORMATOS = ("json", "binario")
+
+# <versao> identifica o avião e os bitmaps; <validade> são os segundos até o mapa ser relido
+MapaAssentos = namedtuple("MapaAssentos", "versao voo no_serie lugares primeira ocupados validade")
+_Entrada = namedtuple("_Entrada", "versao no_serie partida lugares indice primeira ocupados carregado_em")
+
+
+def _versao(no_serie, primeira, ocupados):
+    return hashlib.blake2b(no_serie.encode() + primeira + ocupados, digest_size=8).hexdigest()
+
+
+def _marcar(bitmap, i):
+    bitmap[i >> 3] |= 0x80 >> (i & 7)
+
+
+class MapasAssentos:
+    """Mapas de assentos dos voos por partir, com LRU de até <tamanho_max> voos."""
+
+    CANAL = "voo_alterado"
+
+    def __init__(self, pool, ttl, tamanho_max, ouvinte=None):
+        self.pool = pool
+        self.ttl = ttl
+        self.tamanho_max = tamanho_max
+        self.ouvinte = ouvinte
+        self.hits = 0
+        self.misses = 0
+        self.checkins = 0
+        self._entradas = OrderedDict()
+        self._geracao = 0
+        self._lock = threading.Lock()
+        if ouvinte:
+            ouvinte.registar(self.CANAL, self.invalidar)
+
+    def invalidar(self, partida=None):
+        """Descarta os mapas dos voos que partem de <partida> (todos se vazio ou None)."""
+        with self._lock:
+            self._geracao += 1
+            if not partida:
+                self._entradas.clear()
+            else:
+                for voo in [v for v, e in self._entradas.items() if e.partida == partida]:
+                    del self._entradas[voo]
+
+    def _carregar(self, voo):
+        with self.pool.connection() as conn:
+            rows = conn.execute(CONSULTAS["mapa_assentos"], {"voo": voo}).fetchall()
+        if not rows:
+            return None
+        tamanho = (len(rows) + 7) // 8
+        primeira, ocupados = bytearray(tamanho), bytearray(tamanho)
+        for i, r in enumerate(rows):
+            if r.prim_classe:
+                _marcar(primeira, i)
+            if r.ocupado:
+                _marcar(ocupados, i)
+        lugares = tuple(r.lugar for r in rows)
+        primeira, ocupados = bytes(primeira), bytes(ocupados)
+        log.debug(f"Loaded the seat map of flight {voo} ({len(rows)} seats).")
+        return _Entrada(
+            _versao(rows[0].no_serie, primeira, ocupados),
+            rows[0].no_serie,
+            rows[0].partida,
+            lugares,
+            {lugar: i for i, lugar in enumerate(lugares)},
+            primeira,
+            ocupados,
+            time.monotonic(),
+        )
+
+    def mapa(self, voo):
+        """MapaAssentos do <voo>, ou None se não existir ou já tiver partido."""
+        with self._lock:
+            entrada = self._entradas.get(voo)
+            if entrada is not None and time.monotonic() - entrada.carregado_em < self.ttl:
+                self._entradas.move_to_end(voo)
+                self.hits += 1
+            else:
+                entrada = None
+            geracao = self._geracao
+
+        if entrada is None:
+            if self.ouvinte:
+                self.ouvinte.iniciar()
+            entrada = self._carregar(voo)
+            if entrada is None:
+                return None
+            with self._lock:
+                self.misses += 1
+                # uma invalidação durante o carregamento torna-o inválido para guardar
+                if geracao == self._geracao:
+                    self._entradas[voo] = entrada
+                    while len(self._entradas) > self.tamanho_max:
+                        self._entradas.popitem(last=False)
+
+        return MapaAssentos(
+            entrada.versao,
+            voo,
+            entrada.no_serie,
+            entrada.lugares,
+            entrada.primeira,
+            entrada.ocupados,
+            self.ttl - (time.monotonic() - entrada.carregado_em),
+        )
+
+    def ocupar(self, voo, lugar):
+        """Marca o <lugar> do <voo> como ocupado, se o mapa do voo estiver em memória
+        (depois do commit do check-in que o atribuiu)."""
+        with self._lock:
+            entrada = self._entradas.get(voo)
+            i = entrada.indice.get(lugar) if entrada is not None else None
+            if i is None:
+                return
+            ocupados = bytearray(entrada.ocupados)
+            _marcar(ocupados, i)
+            ocupados = bytes(ocupados)
+            self._entradas[voo] = entrada._replace(
+                versao=_versao(entrada.no_serie, entrada.primeira, ocupados), ocupados=ocupados
+            )
+            self.checkins += 1
+
+    def estatisticas(self):
+        pedidos = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / pedidos if pedidos else None,
+            "checkins": self.checkins,
+            "entradas": len(self._entradas),
+            "tamanho_max": self.tamanho_max,
+            "ttl": self.ttl,
+        }
+
+
+def ler_formato(args):
+    """O ?formato= do pedido, "json" por omissão; ValueError se não for conhecido."""
+    formato = args.get("formato", "json")
+    if formato not in FORMATOS:
+        raise ValueError(f"Parâmetro formato deve ser um de: {', '.join(FORMATOS)}.")
+    return formato
+
+
+def em_json(mapa):
+    """Resposta JSON do <mapa>: lugares pela ordem dos bits e os bitmaps em base64."""
+    livres = len(mapa.lugares) - int.from_bytes(mapa.ocupados, "big").bit_count()
+    return {
+        "voo": mapa.voo,
+        "no_serie": mapa.no_serie,
+        "lugares": mapa.lugares,
+        "primeira_classe": base64.b64encode(mapa.primeira).decode(),
+        "ocupados": base64.b64encode(mapa.ocupados).decode(),
+        "livres": livres,
+    }
+
+
+def empacotar(mapa):
+    """Resposta binária do <mapa> (ver o formato no início do módulo)."""
+    return struct.pack(">IH", mapa.voo, len(mapa.lugares)) + mapa.primeira + mapa.ocupados
@@ -0,0 +1,279 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Caches em memória, por worker, de dados que raramente mudam.
+
+Cada cache tem um TTL explícito e é também invalidada por LISTEN/NOTIFY: os
+triggers em aviacao.sql notificam um canal quando a tabela muda e o
+OuvinteNotificacoes (uma thread com uma ligação dedicada por worker) chama os
+callbacks registados para esse canal.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from datetime import timedelta
+
+import psycopg
+from psycopg import sql
+
+from consultas import CONSULTAS
+
+log = logging.getLogger(__name__)
+
+# <versao> identifica os dados de que a resposta é feita (ver versao_dados em aviacao.sql)
+_Aeroportos = namedtuple("_Aeroportos", "versao por_codigo lista")
+# <versao> identifica a lista de <voos> exata; <validade> são os segundos até a janela mudar
+Quadro = namedtuple("Quadro", "versao voos validade")
+
+
+class OuvinteNotificacoes:
+    """Thread que faz LISTEN nos canais registados e chama os respetivos callbacks.
+
+    Os canais têm de ser registados antes de iniciar(). A thread arranca no
+    processo que a usa (depois do fork dos workers do gunicorn) e, se a ligação
+    cair, volta a ligar-se e invalida todas as caches, porque pode ter perdido
+    notificações entretanto.
+    """
+
+    def __init__(self, conninfo, espera_religar=5):
+        self.conninfo = conninfo
+        self.espera_religar = espera_religar
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._a_escutar = threading.Event()
+
+    def registar(self, canal, callback):
+        """Chama callback(payload) a cada notificação em <canal>."""
+        self._callbacks.setdefault(canal, []).append(callback)
+
+    def iniciar(self):
+        """Arranca a thread deste processo, se ainda não estiver a correr."""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._correr, name="ouvinte-notificacoes", daemon=True)
+            self._thread.start()
+            # para não carregar uma cache antes de estarmos a escutar as suas alterações
+            self._a_escutar.wait(timeout=1)
+
+    @staticmethod
+    def _chamar(callback, payload):
+        # um callback que falhe não pode matar a thread (as caches deixavam de ser invalidadas)
+        try:
+            callback(payload)
+        except Exception:
+            log.exception(f"Notification callback {callback!r} failed.")
+
+    def _notificar_todos(self, payload=None):
+        for callbacks in self._callbacks.values():
+            for callback in callbacks:
+                self._chamar(callback, payload)
+
+    def _correr(self):
+        religar = False
+        while True:
+            try:
+                with psycopg.connect(self.conninfo, autocommit=True) as conn:
+                    for canal in self._callbacks:
+                        conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(canal)))
+                    if religar:
+                        self._notificar_todos()
+                    self._a_escutar.set()
+                    log.info(f"Listening on {', '.join(self._callbacks)}.")
+                    for notificacao in conn.notifies():
+                        for callback in self._callbacks.get(notificacao.channel, ()):
+                            self._chamar(callback, notificacao.payload)
+            except psycopg.Error as e:
+                log.warning(f"Notification listener disconnected: {e}")
+            self._a_escutar.clear()
+            religar = True
+            self._notificar_todos()
+            time.sleep(self.espera_religar)
+
+
+class CacheAeroportos:
+    """Tabela aeroporto em memória, usada na listagem e nas verificações de existência.
+
+    É recarregada ao fim de <ttl> segundos ou quando o trigger em aeroporto
+    notifica o canal CANAL. Uma invalidação recebida durante um carregamento
+    descarta esse carregamento, para não guardar dados já desatualizados.
+    """
+
+    CANAL = "aeroporto_alterado"
+
+    def __init__(self, pool, ttl, ouvinte=None):
+        self.pool = pool
+        self.ttl = ttl
+        self.ouvinte = ouvinte
+        self.hits = 0
+        self.misses = 0
+        self._aeroportos = None
+        self._carregado_em = 0.0
+        self._geracao = 0
+        self._lock = threading.Lock()
+        if ouvinte:
+            ouvinte.registar(self.CANAL, self.invalidar)
+
+    def invalidar(self, payload=None):
+        with self._lock:
+            self._geracao += 1
+            self._aeroportos = None
+
+    def _carregar(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute(CONSULTAS["aeroportos"]).fetchall()
+        aeroportos = [r for r in rows if r.codigo is not None]
+        return _Aeroportos(
+            rows[0].versao,
+            {r.codigo: r for r in aeroportos},
+            [(r.nome, r.cidade) for r in aeroportos],
+        )
+
+    def _obter(self):
+        aeroportos = self._aeroportos
+        if aeroportos is not None and time.monotonic() - self._carregado_em < self.ttl:
+            self.hits += 1
+            return aeroportos
+
+        if self.ouvinte:
+            self.ouvinte.iniciar()
+        with self._lock:
+            # outro thread pode ter carregado enquanto esperávamos
+            aeroportos = self._aeroportos
+            if aeroportos is not None and time.monotonic() - self._carregado_em < self.ttl:
+                self.hits += 1
+                return aeroportos
+
+            self.misses += 1
+            geracao = self._geracao
+            aeroportos = self._carregar()
+            if geracao == self._geracao:
+                self._aeroportos = aeroportos
+                self._carregado_em = time.monotonic()
+            log.debug(f"Loaded {len(aeroportos.lista)} airports.")
+            return aeroportos
+
+    def listar(self):
+        """Versão da tabela e lista de pares (nome, cidade) de todos os aeroportos, por código."""
+        aeroportos = self._obter()
+        return aeroportos.versao, aeroportos.lista
+
+    def existe(self, codigo):
+        return codigo in self._obter().por_codigo
+
+    def estatisticas(self):
+        pedidos = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / pedidos if pedidos else None,
+            "ttl": self.ttl,
+        }
+
+
+class CacheQuadroPartidas:
+    """Quadro de partidas (voos das próximas 12 horas) por aeroporto, com LRU.
+
+    A chave é (aeroporto, intervalo de <granularidade> segundos). Cada entrada
+    guarda os voos de [agora, agora + 12h + granularidade], com "agora" lido da
+    base de dados no carregamento, e ao servir é filtrada pela estimativa do
+    NOW() da base de dados, pelo que continua exata nos extremos da janela
+    durante todo o intervalo. O trigger em voo notifica o canal CANAL com o
+    aeroporto de partida afetado, cujas entradas são descartadas.
+
+    Como os voos estão por hora de partida, os da janela são uma fatia da
+    entrada, encontrada por bisseção; a versão dos voos do aeroporto, o
+    primeiro voo e o tamanho da fatia identificam a resposta (o ETag).
+    """
+
+    CANAL = "voo_alterado"
+    JANELA = timedelta(hours=12)
+
+    def __init__(self, pool, granularidade, tamanho_max, ouvinte=None):
+        self.pool = pool
+        self.granularidade = granularidade
+        self.tamanho_max = tamanho_max
+        self.ouvinte = ouvinte
+        self.hits = 0
+        self.misses = 0
+        self._entradas = OrderedDict()
+        self._geracao = 0
+        self._lock = threading.Lock()
+        if ouvinte:
+            ouvinte.registar(self.CANAL, self.invalidar)
+
+    def invalidar(self, partida=None):
+        """Descarta as entradas de <partida> (de todos os aeroportos se vazio ou None)."""
+        with self._lock:
+            self._geracao += 1
+            if not partida:
+                self._entradas.clear()
+            else:
+                for chave in [c for c in self._entradas if c[0] == partida]:
+                    del self._entradas[chave]
+
+    def _carregar(self, partida):
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                CONSULTAS["quadro_partidas"],
+                {"partida": partida, "margem": timedelta(seconds=self.granularidade)},
+            ).fetchall()
+        voos = [r for r in rows if r.id is not None]
+        return (
+            rows[0].agora,
+            time.monotonic(),
+            rows[0].versao,
+            [v.hora_partida for v in voos],
+            [v.id for v in voos],
+            [(v.no_serie, v.hora_partida, v.chegada) for v in voos],
+        )
+
+    def voos(self, partida):
+        """Quadro com os voos (no_serie, hora_partida, chegada) que partem de <partida> nas próximas 12 horas."""
+        chave = (partida, int(time.time() // self.granularidade))
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                self._entradas.move_to_end(chave)
+                self.hits += 1
+            geracao = self._geracao
+
+        if entrada is None:
+            if self.ouvinte:
+                self.ouvinte.iniciar()
+            entrada = self._carregar(partida)
+            with self._lock:
+                self.misses += 1
+                # uma invalidação durante o carregamento torna-o inválido para guardar
+                if geracao == self._geracao:
+                    self._entradas[chave] = entrada
+                    while len(self._entradas) > self.tamanho_max:
+                        self._entradas.popitem(last=False)
+
+        agora_bd, carregado_em, versao, horas, ids, voos = entrada
+        agora = agora_bd + timedelta(seconds=time.monotonic() - carregado_em)
+        fim = agora + self.JANELA
+        i = bisect_right(horas, agora)
+        j = bisect_left(horas, fim)
+        # a janela muda quando parte o primeiro voo ou entra o seguinte (no máximo no fim do que foi lido)
+        proximo = horas[j] if j < len(horas) else agora_bd + self.JANELA + timedelta(seconds=self.granularidade)
+        validade = min(proximo - fim, horas[i] - agora) if i < j else proximo - fim
+        return Quadro(f"{versao}-{ids[i] if i < j else 0}-{j - i}", voos[i:j], validade.total_seconds())
+
+    def estatisticas(self):
+        pedidos = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / pedidos if pedidos else None,
+            "entradas": len(self._entradas),
+            "tamanho_max": self.tamanho_max,
+            "granularidade": self.granularidade,
+        }
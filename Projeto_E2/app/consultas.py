@@ -0,0 +1,369 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Consultas SQL da aplicação, identificadas por nome.
+
+Estão todas aqui para que bench/planos.py possa verificar o plano de execução
+de cada uma (e para que as métricas e os prepared statements as possam
+identificar pelo nome).
+"""
+
+# check-in em lote; {coluna} é codigo_reserva ou voo_id. As condições sobre
+# b.hora_partida limitam o bilhete às partições dos meses por partir (ver aviacao.sql).
+# Os bilhetes pendentes são bloqueados antes de numerados (FOR UPDATE não admite
+# funções de janela): um check-in individual que faça commit entretanto tira o
+# seu bilhete da lista, em vez de o lugar ser reescrito aqui.
+_CHECKIN_LOTE = """
+WITH bloqueados AS (
+    SELECT b.id, b.hora_partida, b.voo_id, b.prim_classe,
+        (SELECT v.no_serie FROM voo v WHERE v.id = b.voo_id AND v.hora_partida = b.hora_partida) AS no_serie
+    FROM bilhete b
+    WHERE b.{coluna} = %(valor)s
+    AND b.lugar IS NULL
+    AND b.hora_partida > NOW()
+    FOR UPDATE OF b
+),
+pendentes AS (
+    SELECT p.*, ROW_NUMBER() OVER (PARTITION BY p.voo_id, p.prim_classe ORDER BY p.id) AS n
+    FROM bloqueados p
+),
+livres AS (
+    SELECT l.voo_id, l.lugar, l.prim_classe,
+        ROW_NUMBER() OVER (PARTITION BY l.voo_id, l.prim_classe ORDER BY l.lugar) AS n
+    FROM (
+        -- num array, para o plano não depender da estimativa de pendentes sobre as partições vazias
+        SELECT voo_id, lugar, prim_classe
+        FROM assento_livre
+        WHERE voo_id = ANY(ARRAY(SELECT DISTINCT voo_id FROM pendentes))
+        FOR UPDATE SKIP LOCKED
+    ) l
+),
+reclamados AS (
+    DELETE FROM assento_livre a
+    USING pendentes p
+    JOIN livres l USING (voo_id, prim_classe, n)
+    WHERE a.voo_id = l.voo_id
+    AND a.lugar = l.lugar
+    RETURNING p.id, p.hora_partida, a.lugar, p.no_serie
+),
+atribuidos AS (
+    UPDATE bilhete b
+    SET lugar = r.lugar,
+    no_serie = r.no_serie
+    FROM reclamados r
+    WHERE b.id = r.id
+    AND b.hora_partida = r.hora_partida
+    AND b.lugar IS NULL
+    RETURNING b.id, b.lugar
+)
+SELECT p.id, p.voo_id, a.lugar
+FROM pendentes p
+LEFT JOIN atribuidos a USING (id)
+ORDER BY p.id;
+"""
+
+CONSULTAS = {
+    # Todos os aeroportos e a versão da tabela em microssegundos (CacheAeroportos), por ordem de
+    # código para a mesma versão dar sempre a mesma resposta.
+    "aeroportos": """
+WITH versao AS (
+    SELECT COALESCE((
+        SELECT (EXTRACT(EPOCH FROM alterado_em) * 1000000)::BIGINT
+        FROM versao_dados
+        WHERE tabela = 'aeroporto' AND chave = ''
+    ), 0) AS versao
+)
+SELECT v.versao, a.codigo, a.nome, a.cidade
+FROM versao v
+LEFT JOIN aeroporto a ON TRUE
+ORDER BY a.codigo;
+""",
+    # Aeroportos por ordem de código a seguir a %(depois)s (listagem paginada ou em stream).
+    "aeroportos_pagina": """
+SELECT codigo, nome, cidade
+FROM aeroporto
+WHERE codigo > %(depois)s
+ORDER BY codigo
+LIMIT %(limite)s;
+""",
+    # Voos que partem de um aeroporto nas próximas 12 horas mais uma margem, e a versão dos voos
+    # desse aeroporto em microssegundos (CacheQuadroPartidas).
+    "quadro_partidas": """
+WITH agora AS (
+    SELECT LOCALTIMESTAMP AS agora, COALESCE((
+        SELECT (EXTRACT(EPOCH FROM alterado_em) * 1000000)::BIGINT
+        FROM versao_dados
+        WHERE tabela = 'voo' AND chave = %(partida)s
+    ), 0) AS versao
+)
+SELECT a.agora, a.versao, v.id, v.no_serie, v.hora_partida, v.chegada
+FROM agora a
+LEFT JOIN voo v
+ON v.partida = %(partida)s
+AND v.hora_partida > a.agora
+AND v.hora_partida < a.agora + INTERVAL '12 hours' + %(margem)s
+ORDER BY v.hora_partida, v.id;
+""",
+    # Voos que partem de um aeroporto na janela %(janela)s a seguir a (%(hora)s, %(id)s)
+    # (quadro de partidas paginado ou em stream).
+    "partidas_pagina": """
+SELECT v.id, v.no_serie, v.hora_partida, v.chegada
+FROM voo v
+WHERE v.partida = %(partida)s
+AND v.hora_partida > LOCALTIMESTAMP
+AND v.hora_partida < LOCALTIMESTAMP + %(janela)s
+AND (v.hora_partida, v.id) > (%(hora)s, %(id)s)
+ORDER BY v.hora_partida, v.id
+LIMIT %(limite)s;
+""",
+    # Próximos 3 voos com lugares livres entre dois aeroportos.
+    "voos_entre": """
+SELECT v.no_serie, v.hora_partida
+FROM voo v
+WHERE v.partida = %(partida)s
+AND v.chegada = %(chegada)s
+AND v.hora_partida > NOW()
+AND EXISTS (
+    SELECT 1 FROM lotacao_voo l
+    WHERE l.voo_id = v.id
+    AND l.vendidos < l.capacidade
+)
+ORDER BY v.hora_partida
+LIMIT 3;
+""",
+    # Voos que partem depois de %(desde)s (ou de agora) até agora + %(horizonte)s, com a
+    # hora da base de dados (grafo de horários de rotas.py: carga inicial e avanço da janela).
+    "grafo_voos": """
+WITH agora AS (SELECT LOCALTIMESTAMP AS agora)
+SELECT a.agora, v.id, v.no_serie, v.partida, v.chegada, v.hora_partida, v.hora_chegada
+FROM agora a
+LEFT JOIN voo v
+ON v.hora_partida > COALESCE(%(desde)s::TIMESTAMP, a.agora)
+AND v.hora_partida <= a.agora + %(horizonte)s
+ORDER BY v.hora_partida;
+""",
+    # Voos que partem dos aeroportos alterados entre agora e %(ate)s (grafo de horários).
+    "grafo_aeroportos": """
+WITH agora AS (SELECT LOCALTIMESTAMP AS agora)
+SELECT a.agora, v.id, v.no_serie, v.partida, v.chegada, v.hora_partida, v.hora_chegada
+FROM agora a
+LEFT JOIN voo v
+ON v.partida = ANY(%(aeroportos)s::CHAR(3)[])
+AND v.hora_partida > a.agora
+AND v.hora_partida <= %(ate)s
+ORDER BY v.hora_partida;
+""",
+    # Lugares livres por classe dos voos dos itinerários encontrados.
+    "lotacao_voos": """
+SELECT l.voo_id, l.prim_classe, l.capacidade - l.vendidos AS livres
+FROM lotacao_voo l
+WHERE l.voo_id = ANY(%(voos)s::INTEGER[]);
+""",
+    # Mapa de assentos de um voo por partir (assentos.py): os lugares do avião por fila e letra,
+    # ocupados se não estiverem em assento_livre. Sem linhas se o voo não existir ou já tiver partido.
+    "mapa_assentos": """
+SELECT v.no_serie, v.partida, a.lugar, a.prim_classe, l.lugar IS NULL AS ocupado
+FROM voo v
+JOIN assento a ON a.no_serie = v.no_serie
+LEFT JOIN assento_livre l ON l.voo_id = v.id AND l.lugar = a.lugar
+WHERE v.id = %(voo)s
+AND v.hora_partida > NOW()
+ORDER BY substring(a.lugar FROM '^[0-9]+')::INTEGER, a.lugar;
+""",
+    # Atraso da réplica de leitura em segundos (0 no primário): 0 se já aplicou todo o WAL
+    # recebido, senão o tempo desde a última transação aplicada (leitura.py).
+    "atraso_replica": """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+END::FLOAT8 AS atraso;
+""",
+    # Lugares livres por classe de um voo que ainda não partiu, e a sua hora de partida.
+    "lotacao_compra": """
+SELECT l.prim_classe, l.capacidade - l.vendidos AS livres, v.hora_partida
+FROM voo v
+JOIN lotacao_voo l ON l.voo_id = v.id
+WHERE v.id = %(voo)s
+AND v.hora_partida > NOW();
+""",
+    # Venda e respetivos bilhetes num único statement (%(hora_partida)s é a do voo, de lotacao_compra).
+    "inserir_venda": """
+WITH nova_venda AS (
+    INSERT INTO venda (nif_cliente, balcao, hora)
+    VALUES (%(nif)s, NULL, NOW())
+    RETURNING codigo_reserva
+)
+INSERT INTO bilhete (voo_id, hora_partida, codigo_reserva, nome_passageiro, preco, prim_classe)
+SELECT %(voo)s::INTEGER, %(hora_partida)s::TIMESTAMP, nv.codigo_reserva, p.nome, p.preco, p.prim_classe
+FROM nova_venda nv,
+    UNNEST(%(nomes)s::VARCHAR[], %(precos)s::NUMERIC[], %(classes)s::BOOLEAN[])
+        WITH ORDINALITY AS p(nome, preco, prim_classe, n)
+ORDER BY p.n
+RETURNING id, codigo_reserva, nome_passageiro;
+""",
+    # Serializa as compras do voo até ao fim da transação (COMPRA_MODO "bloqueio").
+    "bloquear_voo": """
+SELECT pg_advisory_xact_lock(hashtext('compra'), %(voo)s::INTEGER);
+""",
+    # Compra já feita com a mesma Idempotency-Key.
+    "compra_idempotente": """
+SELECT pedido, resposta
+FROM compra_idempotente
+WHERE chave = %(chave)s;
+""",
+    "guardar_compra": """
+INSERT INTO compra_idempotente (chave, pedido, codigo_reserva, resposta)
+VALUES (%(chave)s, %(pedido)s, %(codigo_reserva)s, %(resposta)s);
+""",
+    # Bilhete de um voo por partir a fazer check-in, bloqueado até ao fim da transação.
+    "bilhete_checkin": """
+SELECT b.voo_id, b.hora_partida, b.prim_classe,
+    -- em subconsulta, para só ler a partição de voo do bilhete (com um JOIN lê todas)
+    (SELECT v.no_serie FROM voo v WHERE v.id = b.voo_id AND v.hora_partida = b.hora_partida) AS no_serie
+FROM bilhete b
+WHERE b.id = %(bilhete)s
+AND b.hora_partida > NOW()
+FOR UPDATE OF b;
+""",
+    # Se o bilhete que bilhete_checkin não encontrou existe num voo que já partiu (ou arquivado).
+    "bilhete_partido": """
+SELECT EXISTS (SELECT 1 FROM bilhete WHERE id = %(bilhete)s AND hora_partida <= NOW())
+    OR EXISTS (SELECT 1 FROM arquivo.bilhete WHERE id = %(bilhete)s) AS partido;
+""",
+    # Retira um lugar livre da classe do bilhete, saltando os já reclamados.
+    "reclamar_lugar": """
+DELETE FROM assento_livre
+WHERE (voo_id, lugar) = (
+    SELECT voo_id, lugar
+    FROM assento_livre
+    WHERE voo_id = %(voo_id)s
+    AND prim_classe = %(classe)s
+    ORDER BY lugar
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING lugar;
+""",
+    # Atribui o lugar reclamado ao bilhete.
+    "atribuir_lugar": """
+UPDATE bilhete
+SET lugar = %(lugar)s,
+no_serie = %(no_serie)s
+WHERE id = %(bilhete)s
+AND hora_partida = %(hora_partida)s;
+""",
+    "checkin_reserva": _CHECKIN_LOTE.format(coluna="codigo_reserva"),
+    "checkin_voo": _CHECKIN_LOTE.format(coluna="voo_id"),
+    # Cria as partições mensais de voo e bilhete em falta até daqui a %(meses)s meses (flask particoes).
+    "criar_particoes": """
+SELECT criar_particoes(LOCALTIMESTAMP, LOCALTIMESTAMP + %(meses)s * INTERVAL '1 month') AS criadas;
+""",
+    # Recalcula os dias pendentes dos cubos de análise.
+    "atualizar_cubos": """
+SELECT atualizar_cubos() AS dias;
+""",
+    # Rotas (entre duas cidades, nos dois sentidos) por taxa média de ocupação.
+    "analise_rotas": """
+SELECT
+    LEAST(cidade_partida, cidade_chegada) AS cidade_a,
+    GREATEST(cidade_partida, cidade_chegada) AS cidade_b,
+    SUM(passageiros_1c + passageiros_2c)::BIGINT AS passageiros,
+    SUM(assentos_1c + assentos_2c)::BIGINT AS assentos,
+    (SUM(passageiros_1c + passageiros_2c)::NUMERIC
+        / NULLIF(SUM(assentos_1c + assentos_2c), 0))::FLOAT AS racio_ocupacao
+FROM cubo_vendas
+WHERE dia >= %(desde)s AND dia < %(ate)s
+GROUP BY 1, 2
+ORDER BY racio_ocupacao DESC NULLS LAST, cidade_a, cidade_b
+LIMIT %(limite)s OFFSET %(deslocamento)s;
+""",
+    # Rotas em que voaram todos os aviões da empresa nos meses indicados.
+    "analise_frota": """
+SELECT
+    LEAST(cidade_partida, cidade_chegada) AS cidade_a,
+    GREATEST(cidade_partida, cidade_chegada) AS cidade_b,
+    SUM(voos)::BIGINT AS voos
+FROM cubo_frota
+WHERE mes >= %(desde)s AND mes < %(ate)s
+GROUP BY 1, 2
+HAVING COUNT(DISTINCT no_serie) = (SELECT COUNT(*) FROM aviao)
+ORDER BY cidade_a, cidade_b
+LIMIT %(limite)s OFFSET %(deslocamento)s;
+""",
+    # Vendas por nível de espaço (global, pais, cidade) e de tempo (global, ano, mes, dia).
+    "analise_vendas": """
+SELECT
+    CASE WHEN %(espaco)s <> 'global' THEN pais_partida END AS pais_partida,
+    CASE WHEN %(espaco)s = 'cidade' THEN cidade_partida END AS cidade_partida,
+    CASE WHEN %(espaco)s <> 'global' THEN pais_chegada END AS pais_chegada,
+    CASE WHEN %(espaco)s = 'cidade' THEN cidade_chegada END AS cidade_chegada,
+    CASE WHEN %(tempo)s <> 'global' THEN EXTRACT(YEAR FROM dia)::INTEGER END AS ano,
+    CASE WHEN %(tempo)s IN ('mes', 'dia') THEN EXTRACT(MONTH FROM dia)::INTEGER END AS mes,
+    CASE WHEN %(tempo)s = 'dia' THEN EXTRACT(DAY FROM dia)::INTEGER END AS dia_do_mes,
+    SUM(vendas_1c)::FLOAT AS vendas_1c,
+    SUM(vendas_2c)::FLOAT AS vendas_2c,
+    SUM(vendas_1c + vendas_2c)::FLOAT AS vendas
+FROM cubo_vendas
+WHERE dia >= %(desde)s AND dia < %(ate)s
+AND (%(pais_partida)s::VARCHAR IS NULL OR pais_partida = %(pais_partida)s)
+AND (%(cidade_partida)s::VARCHAR IS NULL OR cidade_partida = %(cidade_partida)s)
+AND (%(pais_chegada)s::VARCHAR IS NULL OR pais_chegada = %(pais_chegada)s)
+AND (%(cidade_chegada)s::VARCHAR IS NULL OR cidade_chegada = %(cidade_chegada)s)
+GROUP BY 1, 2, 3, 4, 5, 6, 7
+ORDER BY 1, 2, 3, 4, 5, 6, 7
+LIMIT %(limite)s OFFSET %(deslocamento)s;
+""",
+    # Passageiros de primeira e segunda classe por dia da semana e nível de espaço (da partida).
+    "analise_classes": """
+SELECT
+    CASE WHEN %(espaco)s <> 'global' THEN pais_partida END AS pais,
+    CASE WHEN %(espaco)s = 'cidade' THEN cidade_partida END AS cidade,
+    TRIM(TO_CHAR(dia, 'Day')) AS dia_da_semana,
+    SUM(passageiros_1c)::BIGINT AS passageiros_1c,
+    SUM(passageiros_2c)::BIGINT AS passageiros_2c,
+    (SUM(passageiros_1c)::NUMERIC / NULLIF(SUM(passageiros_2c), 0))::FLOAT AS racio_1c_2c
+FROM cubo_vendas
+WHERE dia >= %(desde)s AND dia < %(ate)s
+AND (%(pais_partida)s::VARCHAR IS NULL OR pais_partida = %(pais_partida)s)
+AND (%(cidade_partida)s::VARCHAR IS NULL OR cidade_partida = %(cidade_partida)s)
+GROUP BY 1, 2, 3
+ORDER BY 1, 2, MIN(EXTRACT(ISODOW FROM dia))
+LIMIT %(limite)s OFFSET %(deslocamento)s;
+""",
+}
+
+# Consultas dos pedidos frequentes (voos, compra e check-in), executadas como
+# prepared statements: preparadas na primeira execução em cada ligação e
+# reutilizadas daí em diante. As restantes nunca são preparadas.
+PREPARADAS = frozenset(
+    {
+        "aeroportos_pagina",
+        "quadro_partidas",
+        "partidas_pagina",
+        "voos_entre",
+        "lotacao_voos",
+        "mapa_assentos",
+        "lotacao_compra",
+        "inserir_venda",
+        "bloquear_voo",
+        "compra_idempotente",
+        "guardar_compra",
+        "bilhete_checkin",
+        "reclamar_lugar",
+        "atribuir_lugar",
+    }
+)
+
+# o texto de cada consulta é o próprio objeto em CONSULTAS, logo a procura é barata
+NOMES = {consulta: nome for nome, consulta in CONSULTAS.items()}
+
+
+def nome_consulta(consulta):
+    """Nome de <consulta> em CONSULTAS, ou None se não estiver lá."""
+    return NOMES.get(consulta) if isinstance(consulta, str) else None
+
+
+def preparar(consulta):
+    """Argumento prepare do execute() do psycopg para <consulta>: True nas
+    consultas de PREPARADAS e False nas restantes (sem preparação automática)."""
+    return nome_consulta(consulta) in PREPARADAS
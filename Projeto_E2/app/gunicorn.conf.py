@@ -0,0 +1,47 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Configuração do gunicorn, lida do diretório atual ao arrancar.
+
+Prepara o diretório onde os workers escrevem as métricas que /metrics agrega
+(ver metricas.py): o de PROMETHEUS_MULTIPROC_DIR, limpo no arranque, ou um
+diretório temporário só deste servidor, apagado no fim. Sem
+RATELIMIT_STORAGE_URI, os limites de pedidos ficam num ficheiro temporário
+mapeado em memória, partilhado pelos workers (ver limites.py).
+"""
+import os
+import shutil
+import tempfile
+
+temporario = None
+limites = None
+
+
+def on_starting(server):
+    global temporario, limites
+    # herdadas pelos workers, criados depois deste hook
+    if "RATELIMIT_STORAGE_URI" not in os.environ:
+        fd, limites = tempfile.mkstemp(
+            prefix="airline-limites.", dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+        )
+        os.close(fd)
+        os.environ["RATELIMIT_STORAGE_URI"] = f"mmap://{limites}"
+    diretorio = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if diretorio is None:
+        temporario = os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+        return
+    # valores de execuções anteriores
+    shutil.rmtree(diretorio, ignore_errors=True)
+    os.makedirs(diretorio)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if temporario:
+        shutil.rmtree(temporario, ignore_errors=True)
+    if limites:
+        os.unlink(limites)
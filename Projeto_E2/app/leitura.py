@@ -0,0 +1,141 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Encaminhamento das leituras para uma réplica, com recurso ao primário.
+
+Os endpoints só de leitura usam um pool próprio, ligado a DATABASE_REPLICA_URL
+(uma réplica em streaming, que pode ser outro Postgres na mesma máquina), para
+não disputarem as ligações das compras e dos check-ins. A cada <intervalo>
+segundos por worker mede-se o atraso da réplica (atraso_replica em
+consultas.py); acima de <atraso_max> segundos, ou se a réplica não responder, as
+leituras passam para o pool do primário até o atraso voltar a baixar. Cada
+mudança fica no log, e o atraso e as leituras por destino nas métricas
+db_replica_lag_seconds e db_reads_total, servidas em /metrics.
+
+As caches que são invalidadas por NOTIFY (cache.py, rotas.py) leem sempre do
+primário: uma réplica atrasada ainda não teria a alteração notificada e a cache
+ficaria com os dados antigos.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import psycopg
+from prometheus_client import Counter, Gauge
+from psycopg_pool import PoolTimeout
+
+from consultas import CONSULTAS
+
+log = logging.getLogger(__name__)
+
+ATRASO = Gauge(
+    "db_replica_lag_seconds",
+    "Replication lag of the read replica at the last check (NaN if it did not answer).",
+    multiprocess_mode="livemax",
+)
+LEITURAS = Counter("db_reads", "Read-only requests by the database they were routed to.", ["target"])
+
+# espera máxima por uma ligação à réplica na verificação (s)
+ESPERA_VERIFICACAO = 1.0
+
+
+class _Encaminhador:
+    """Estado comum às versões síncrona e assíncrona."""
+
+    def __init__(self, pool_leitura, pool_primario, atraso_max, intervalo, replica=True):
+        self.pool_leitura = pool_leitura
+        self.pool_primario = pool_primario
+        self.atraso_max = atraso_max
+        self.intervalo = intervalo
+        # sem réplica, o pool de leitura liga ao primário e não há atraso a medir
+        self.replica = replica
+        self.atraso = None
+        # None até à primeira medição, com as leituras no primário
+        self._na_replica = None if replica else True
+        self._verificado_em = float("-inf")
+
+    def _decidir(self, atraso, erro=None):
+        """Guarda o <atraso> medido (None se a réplica falhou) e escolhe o destino das leituras."""
+        self.atraso = atraso
+        ATRASO.set(float("nan") if atraso is None else atraso)
+        na_replica = atraso is not None and atraso <= self.atraso_max
+        if na_replica != self._na_replica:
+            if na_replica:
+                log.info(f"Replica lag {atraso:.3f} s is under {self.atraso_max} s; reading from the replica.")
+            elif atraso is None:
+                log.warning(f"Replica check failed ({erro}); reading from the primary.")
+            else:
+                log.warning(f"Replica lag {atraso:.3f} s over {self.atraso_max} s; reading from the primary.")
+        self._na_replica = na_replica
+
+    def _escolher(self):
+        pool = self.pool_leitura if self._na_replica else self.pool_primario
+        LEITURAS.labels("replica" if self.replica and self._na_replica else "primary").inc()
+        return pool
+
+    def estatisticas(self):
+        return {
+            "replica": self.replica,
+            "atraso": self.atraso,
+            "atraso_max": self.atraso_max,
+            "destino": "replica" if self.replica and self._na_replica else "primary",
+        }
+
+
+class EncaminhadorLeituras(_Encaminhador):
+    """Pool das leituras: o da réplica enquanto o atraso for até <atraso_max>
+    segundos, o <pool_primario> caso contrário. O atraso é medido numa thread à
+    parte, lançada pelo pedido em que passam <intervalo> segundos desde a última
+    medição; esse pedido usa a decisão anterior, sem esperar pela réplica."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def _verificar(self):
+        try:
+            with self.pool_leitura.connection(timeout=ESPERA_VERIFICACAO) as conn:
+                self._decidir(conn.execute(CONSULTAS["atraso_replica"]).fetchone().atraso)
+        except (psycopg.Error, PoolTimeout) as e:
+            self._decidir(None, e)
+        finally:
+            self._lock.release()
+
+    def connection(self):
+        """Ligação (context manager) do pool escolhido para uma leitura."""
+        if (
+            self.replica
+            and time.monotonic() - self._verificado_em >= self.intervalo
+            and self._lock.acquire(blocking=False)
+        ):
+            self._verificado_em = time.monotonic()
+            threading.Thread(target=self._verificar, name="verificar-replica", daemon=True).start()
+        return self._escolher().connection()
+
+
+class EncaminhadorLeiturasAsync(_Encaminhador):
+    """EncaminhadorLeituras para pools assíncronos (asgi.py): a medição corre
+    numa tarefa à parte e o pedido que a lança usa a decisão anterior."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tarefa = None
+
+    async def _verificar(self):
+        try:
+            async with self.pool_leitura.connection(timeout=ESPERA_VERIFICACAO) as conn:
+                cur = await conn.execute(CONSULTAS["atraso_replica"])
+                self._decidir((await cur.fetchone()).atraso)
+        except (psycopg.Error, PoolTimeout) as e:
+            self._decidir(None, e)
+
+    def connection(self):
+        """Ligação (async context manager) do pool escolhido para uma leitura."""
+        if (
+            self.replica
+            and time.monotonic() - self._verificado_em >= self.intervalo
+            and (self._tarefa is None or self._tarefa.done())
+        ):
+            self._verificado_em = time.monotonic()
+            self._tarefa = asyncio.create_task(self._verificar())
+        return self._escolher().connection()
@@ -0,0 +1,214 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Armazenamento dos limites de pedidos partilhado pelos workers de uma máquina.
+
+Com "memory://" cada worker conta os seus pedidos, e os limites reais são os
+configurados vezes o número de workers; com Redis cada verificação é uma ida à
+rede. Aqui os contadores (janela fixa, a estratégia por omissão do
+flask-limiter) vivem numa tabela de dispersão num ficheiro mapeado em memória
+(mmap) por todos os processos, de preferência em /dev/shm:
+
+    RATELIMIT_STORAGE_URI=mmap:///dev/shm/airline-limites?entradas=65536
+
+Cada entrada tem o hash de 64 bits da chave, o fim da janela e o contador, e
+cada operação é feita sob um lock de registo (lockf) no ficheiro, que exclui
+os outros processos, e um threading.Lock, que exclui as outras threads do
+mesmo processo: os limites são exatos entre workers e uma verificação custa
+alguns microssegundos (ver bench/limites.py). As chaves colidem ao fim de
+SONDAGENS entradas ocupadas e ainda na janela; nesse caso a que expira
+primeiro é reutilizada, o que só pode aliviar um limite, nunca apertá-lo.
+
+Importar o módulo regista os esquemas mmap:// e async+mmap:// no limits.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from limits.aio.storage import Storage as StorageAsync
+from limits.errors import ConfigurationError
+from limits.storage import Storage
+
+MAGIA = b"AIRLIM01"
+# magia e número de entradas
+CABECALHO = struct.Struct("<8sQ")
+# hash da chave (0: entrada nunca usada), fim da janela (epoch) e contador
+ENTRADA = struct.Struct("<Qdq")
+INICIO = 64
+ENTRADAS = 65536
+SONDAGENS = 32
+
+
+def _hash(chave):
+    return int.from_bytes(hashlib.blake2b(chave.encode(), digest_size=8).digest(), "little") or 1
+
+
+class MmapStorage(Storage):
+    """Contadores de janela fixa num ficheiro mapeado em memória, partilhado pelos processos."""
+
+    STORAGE_SCHEME = ["mmap"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        partes = urlsplit(uri)
+        if not partes.path:
+            raise ConfigurationError(f"mmap storage needs a file path: {uri}")
+        self.caminho = partes.path
+        entradas = int(parse_qs(partes.query).get("entradas", [ENTRADAS])[0])
+        self.lock = threading.Lock()
+        self.fd = os.open(self.caminho, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._exclusivo():
+            magia, n = CABECALHO.unpack(os.pread(self.fd, CABECALHO.size, 0).ljust(CABECALHO.size, b"\0"))
+            if magia != MAGIA:
+                # ficheiro novo: a tabela começa a zeros
+                os.ftruncate(self.fd, INICIO + entradas * ENTRADA.size)
+                os.pwrite(self.fd, CABECALHO.pack(MAGIA, entradas), 0)
+                n = entradas
+            self.entradas = n
+            self.mapa = mmap.mmap(self.fd, INICIO + n * ENTRADA.size)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def _exclusivo(self):
+        return _Exclusivo(self)
+
+    def _procurar(self, h, agora, criar):
+        """Posição da entrada do hash <h>; com <criar>, a de uma entrada livre,
+        expirada ou a que expira primeiro se não existir. None se não existir."""
+        livre = None
+        mais_antiga = None
+        inicio = h % self.entradas
+        for i in range(min(SONDAGENS, self.entradas)):
+            pos = INICIO + (inicio + i) % self.entradas * ENTRADA.size
+            hash_, expira, _ = ENTRADA.unpack_from(self.mapa, pos)
+            if hash_ == h:
+                return pos
+            if not criar:
+                if hash_ == 0:
+                    return None
+                continue
+            if hash_ == 0:
+                # fim da cadeia: a chave não está mais à frente
+                return livre if livre is not None else pos
+            if livre is None and expira <= agora:
+                livre = pos
+            if mais_antiga is None or expira < mais_antiga[1]:
+                mais_antiga = (pos, expira)
+        if not criar:
+            return None
+        return livre if livre is not None else mais_antiga[0]
+
+    def incr(self, key, expiry, amount=1):
+        h = _hash(key)
+        with self._exclusivo():
+            agora = time.time()
+            pos = self._procurar(h, agora, criar=True)
+            hash_, expira, contador = ENTRADA.unpack_from(self.mapa, pos)
+            if hash_ != h or expira <= agora:
+                expira, contador = agora + expiry, 0
+            contador += amount
+            ENTRADA.pack_into(self.mapa, pos, h, expira, contador)
+            return contador
+
+    def get(self, key):
+        h = _hash(key)
+        with self._exclusivo():
+            agora = time.time()
+            pos = self._procurar(h, agora, criar=False)
+            if pos is None:
+                return 0
+            _, expira, contador = ENTRADA.unpack_from(self.mapa, pos)
+            return contador if expira > agora else 0
+
+    def get_expiry(self, key):
+        h = _hash(key)
+        with self._exclusivo():
+            agora = time.time()
+            pos = self._procurar(h, agora, criar=False)
+            if pos is None:
+                return agora
+            return max(ENTRADA.unpack_from(self.mapa, pos)[1], agora)
+
+    def clear(self, key):
+        h = _hash(key)
+        with self._exclusivo():
+            pos = self._procurar(h, time.time(), criar=False)
+            if pos is not None:
+                # mantém o hash, para não cortar as cadeias de outras chaves
+                ENTRADA.pack_into(self.mapa, pos, h, 0.0, 0)
+
+    def check(self):
+        return not self.mapa.closed
+
+    def reset(self):
+        with self._exclusivo():
+            agora = time.time()
+            ativas = sum(
+                1
+                for i in range(self.entradas)
+                if ENTRADA.unpack_from(self.mapa, INICIO + i * ENTRADA.size)[1] > agora
+            )
+            self.mapa[INICIO:] = bytes(self.entradas * ENTRADA.size)
+            return ativas
+
+
+class _Exclusivo:
+    """Lock da thread e lock de registo do ficheiro (byte 0), por esta ordem."""
+
+    __slots__ = ("storage",)
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage.lock.acquire()
+        try:
+            fcntl.lockf(self.storage.fd, fcntl.LOCK_EX, 1, 0)
+        except BaseException:
+            self.storage.lock.release()
+            raise
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.lockf(self.storage.fd, fcntl.LOCK_UN, 1, 0)
+        finally:
+            self.storage.lock.release()
+
+
+class MmapStorageAsync(StorageAsync):
+    """MmapStorage para o limits.aio (asgi.py): as operações não fazem I/O e
+    demoram microssegundos, por isso correm diretamente no event loop."""
+
+    STORAGE_SCHEME = ["async+mmap"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.sincrono = MmapStorage(uri.removeprefix("async+"), wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    async def incr(self, key, expiry, amount=1):
+        return self.sincrono.incr(key, expiry, amount)
+
+    async def get(self, key):
+        return self.sincrono.get(key)
+
+    async def get_expiry(self, key):
+        return self.sincrono.get_expiry(key)
+
+    async def check(self):
+        return self.sincrono.check()
+
+    async def reset(self):
+        return self.sincrono.reset()
+
+    async def clear(self, key):
+        return self.sincrono.clear(key)
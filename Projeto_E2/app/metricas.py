@@ -0,0 +1,156 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Métricas da API no formato de texto do Prometheus, servidas em /metrics.
+
+- latência de cada pedido, por endpoint, método e código HTTP (histograma);
+- latência de cada execução de SQL, pelo nome da consulta em CONSULTAS
+  (histograma; os percentis obtêm-se com histogram_quantile), e erros;
+- estatísticas de cada pool de ligações (pool.pop_stats()): tamanho, ligações
+  livres, pedidos à espera, tempo de espera e de uso, erros;
+- atraso da réplica de leitura e leituras por destino (definidas em leitura.py).
+
+Cada medição é um incremento em memória, barato o suficiente para ficar sempre
+ligado. Com vários workers (gunicorn), PROMETHEUS_MULTIPROC_DIR aponta para um
+diretório partilhado onde cada processo escreve os seus valores (ver
+gunicorn.conf.py) e /metrics agrega-os todos, seja qual for o worker que serve
+o pedido.
+"""
+import os
+import threading
+import time
+
+import psycopg
+from flask import Blueprint, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from consultas import nome_consulta
+
+# de 0.5 ms a 10 s: as consultas da API demoram tipicamente 1 ms ou menos
+BALDES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PEDIDOS = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by endpoint.",
+    ["endpoint", "method", "status"],
+    buckets=BALDES,
+)
+CONSULTAS_DURACAO = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution latency by query name (app/consultas.py).",
+    ["query"],
+    buckets=BALDES,
+)
+CONSULTAS_ERROS = Counter("db_query_errors", "SQL statements that raised an error, by query name.", ["query"])
+
+# valores instantâneos: somados pelos workers vivos
+POOL_MEDIDAS = {
+    "pool_min": "Minimum number of connections.",
+    "pool_max": "Maximum number of connections.",
+    "pool_size": "Connections currently managed by the pool (in use, available or being prepared).",
+    "pool_available": "Idle connections in the pool.",
+    "requests_waiting": "Clients currently waiting for a connection.",
+}
+# contadores; os que estão em ms são exportados em segundos
+POOL_CONTADORES = {
+    "requests_num": "Connection requests.",
+    "requests_queued": "Connection requests that had to wait for a connection.",
+    "requests_wait_ms": "Time spent waiting for a connection.",
+    "requests_errors": "Connection requests that failed (timeout or queue full).",
+    "usage_ms": "Time connections were in use by clients.",
+    "returns_bad": "Connections returned to the pool in a bad state.",
+    "connections_num": "Connection attempts to the server.",
+    "connections_ms": "Time spent establishing connections.",
+    "connections_errors": "Failed connection attempts.",
+    "connections_lost": "Connections found broken by the pool.",
+}
+
+
+def _nome_pool(chave):
+    if chave.endswith("_ms"):
+        return f"psycopg_{chave[:-3]}_seconds"
+    return f"psycopg_{chave}"
+
+
+POOL_GAUGES = {
+    chave: Gauge(_nome_pool(chave), descricao, ["pool"], multiprocess_mode="livesum")
+    for chave, descricao in POOL_MEDIDAS.items()
+}
+POOL_COUNTERS = {chave: Counter(_nome_pool(chave), descricao, ["pool"]) for chave, descricao in POOL_CONTADORES.items()}
+
+
+class CursorMedido(psycopg.Cursor):
+    """Cursor que mede cada execute() e o atribui ao nome da consulta em CONSULTAS
+    (as restantes, como as dos comandos flask, contam como "other")."""
+
+    def execute(self, query, params=None, **kwargs):
+        nome = nome_consulta(query) or "other"
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        except Exception:
+            CONSULTAS_ERROS.labels(nome).inc()
+            raise
+        finally:
+            CONSULTAS_DURACAO.labels(nome).observe(time.perf_counter() - inicio)
+
+
+def criar_metricas(*pools, intervalo_pool=1.0):
+    """Blueprint com /metrics e a medição da latência de todos os pedidos da app.
+
+    As estatísticas dos <pools> são recolhidas no fim de um pedido no máximo a
+    cada <intervalo_pool> segundos por worker, e sempre antes de servir /metrics.
+    """
+    bp = Blueprint("metricas", __name__)
+    estado = {"recolhido_em": 0.0}
+    lock = threading.Lock()
+
+    def recolher_pool():
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            estado["recolhido_em"] = time.monotonic()
+            for pool in pools:
+                for chave, valor in pool.pop_stats().items():
+                    if chave in POOL_GAUGES:
+                        POOL_GAUGES[chave].labels(pool.name).set(valor)
+                    elif chave in POOL_COUNTERS and valor:
+                        POOL_COUNTERS[chave].labels(pool.name).inc(valor / 1000 if chave.endswith("_ms") else valor)
+        finally:
+            lock.release()
+
+    @bp.before_app_request
+    def iniciar_pedido():
+        g.inicio_pedido = time.perf_counter()
+
+    @bp.after_app_request
+    def medir_pedido(resposta):
+        inicio = g.pop("inicio_pedido", None)
+        if inicio is not None:
+            PEDIDOS.labels(request.endpoint or "none", request.method, resposta.status_code).observe(
+                time.perf_counter() - inicio
+            )
+        if time.monotonic() - estado["recolhido_em"] >= intervalo_pool:
+            recolher_pool()
+        return resposta
+
+    @bp.route("/metrics", methods=("GET",))
+    def metrics():
+        """Todas as métricas, agregadas pelos workers se PROMETHEUS_MULTIPROC_DIR estiver definida."""
+        recolher_pool()
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            registo = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registo)
+        else:
+            registo = REGISTRY
+        return generate_latest(registo), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
+    return bp
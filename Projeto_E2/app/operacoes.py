@@ -0,0 +1,315 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Compra, check-in e procura de rotas, partilhados por app.py e asgi.py.
+
+Cada operação é um gerador que não faz E/S: entrega (yield) os passos, as
+consultas (Passo) e as chamadas bloqueantes (Chamada), e recebe o resultado de
+cada um. executar() corre-a numa ligação síncrona e executar_async() numa
+assíncrona, com as chamadas numa thread; a validação, o SQL e as respostas de
+erro ficam num só sítio, e app.py e asgi.py só abrem as transações e esperam
+entre tentativas, cada um à sua maneira.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+from collections import namedtuple
+from contextlib import nullcontext
+
+from psycopg.errors import CheckViolation, DeadlockDetected, SerializationFailure, UniqueViolation
+from psycopg.types.json import Jsonb
+
+from consultas import CONSULTAS
+from rotas import ESCALAS_MAX, TENTATIVAS, descrever, lugares_livres
+
+log = logging.getLogger(__name__)
+
+# <linhas>: TODAS (lista de linhas), UMA (a primeira linha ou None) ou None (nada)
+Passo = namedtuple("Passo", "sql params linhas")
+Chamada = namedtuple("Chamada", "funcao args")
+TODAS, UMA = "todas", "uma"
+
+
+def _todas(consulta, params):
+    return Passo(CONSULTAS[consulta], params, TODAS)
+
+
+def _uma(consulta, params):
+    return Passo(CONSULTAS[consulta], params, UMA)
+
+
+def executar(operacao, conn):
+    """Corre a <operacao> na ligação síncrona <conn> e devolve o seu resultado."""
+    resultado = None
+    while True:
+        try:
+            passo = operacao.send(resultado)
+        except StopIteration as fim:
+            return fim.value
+        if isinstance(passo, Chamada):
+            resultado = passo.funcao(*passo.args)
+            continue
+        cur = conn.execute(passo.sql, passo.params)
+        resultado = cur.fetchall() if passo.linhas == TODAS else cur.fetchone() if passo.linhas == UMA else None
+
+
+async def executar_async(operacao, conn):
+    """Corre a <operacao> na ligação assíncrona <conn>, com as chamadas numa thread."""
+    resultado = None
+    while True:
+        try:
+            passo = operacao.send(resultado)
+        except StopIteration as fim:
+            return fim.value
+        if isinstance(passo, Chamada):
+            resultado = await asyncio.to_thread(passo.funcao, *passo.args)
+            continue
+        cur = await conn.execute(passo.sql, passo.params)
+        if passo.linhas == TODAS:
+            resultado = await cur.fetchall()
+        elif passo.linhas == UMA:
+            resultado = await cur.fetchone()
+        else:
+            resultado = None
+
+
+def _erro(message, status):
+    return {"message": message, "status": "error"}, status
+
+
+# Procura de rotas
+
+
+def procurar_rotas(grafo, partida, chegada, desde=None, escalas=ESCALAS_MAX, n=3, classe=None):
+    """Até <n> itinerários (descritos) com lugares livres em todos os voos.
+
+    Os lugares dos voos encontrados são lidos de lotacao_voo; se algum estiver
+    esgotado, a procura é repetida sem ele, até TENTATIVAS vezes, e no fim
+    ficam só os itinerários com lugares em todos os voos. A procura no grafo é
+    uma Chamada (pode ter de o atualizar).
+    """
+    excluir = set()
+    for _ in range(TENTATIVAS):
+        itinerarios = yield Chamada(grafo.procurar, (partida, chegada, desde, escalas, n, frozenset(excluir)))
+        voos = list({v.id for itinerario in itinerarios for v in itinerario})
+        if not voos:
+            return []
+        livres = lugares_livres((yield _todas("lotacao_voos", {"voos": voos})), classe)
+        esgotados = {voo for voo in voos if livres.get(voo, 0) <= 0}
+        if not esgotados:
+            break
+        excluir |= esgotados
+    return [
+        descrever(itinerario, livres)
+        for itinerario in itinerarios
+        if all(livres.get(v.id, 0) > 0 for v in itinerario)
+    ]
+
+
+# Compras
+
+# Modo das compras (ver Compra): "bloqueio", "serializavel" ou "direto".
+COMPRA_MODO = os.environ.get("COMPRA_MODO", "bloqueio")
+# vezes que uma compra em conflito com outras é tentada, e espera máxima entre tentativas (s)
+COMPRA_TENTATIVAS = int(os.environ.get("COMPRA_TENTATIVAS", 5))
+COMPRA_ESPERA_MAX = 0.1
+# tamanho de bilhete.nome_passageiro
+NOME_MAX = 80
+
+
+def ler_compra(data, chave):
+    """(nif, passageiros, chave) do corpo JSON <data> e do cabeçalho Idempotency-Key
+    <chave> de um POST /compra; ValueError com a mensagem se forem inválidos."""
+    # o corpo e cada passageiro têm de ser objetos JSON ({"passageiros": ["x"]} não é)
+    if not isinstance(data, dict):
+        raise ValueError("NIF e lista de passageiros necessários.")
+    nif = data.get("nif")
+    passageiros = data.get("passageiros")
+
+    if not nif or not isinstance(passageiros, list) or not passageiros:
+        raise ValueError("NIF e lista de passageiros necessários.")
+
+    if not all(isinstance(passageiro, dict) for passageiro in passageiros):
+        raise ValueError("Cada passageiro deve ser um objeto com nome.")
+
+    # nif_cliente é CHAR(9)
+    if not isinstance(nif, str) or len(nif) != 9 or not nif.isdigit():
+        raise ValueError("NIF deve ter 9 algarismos.")
+
+    if not all(passageiro.get("nome") and isinstance(passageiro["nome"], str) for passageiro in passageiros):
+        raise ValueError("Nome de passageiro necessário.")
+
+    nomes = [passageiro["nome"] for passageiro in passageiros]
+    if any(len(nome) > NOME_MAX for nome in nomes):
+        raise ValueError(f"Nome de passageiro com mais de {NOME_MAX} caracteres.")
+
+    # o nome é único por venda e voo, e é por ele que _vender encontra o bilhete de cada passageiro
+    if len(set(nomes)) != len(nomes):
+        raise ValueError("Nomes de passageiros repetidos na mesma compra.")
+
+    # repetir o pedido com a mesma chave nunca compra duas vezes (ver Compra)
+    if chave is not None and not 0 < len(chave) <= 255:
+        raise ValueError("Idempotency-Key inválida.")
+    return nif, passageiros, chave
+
+
+def _vender(voo, nif, passageiros):
+    """Valida o voo e os lugares livres de cada classe e insere a venda com todos
+    os bilhetes num só comando. Devolve (resposta, código HTTP, código de reserva)."""
+    nomes = [passageiro.get("nome") for passageiro in passageiros]
+    classes = [bool(passageiro.get("classe")) for passageiro in passageiros]
+    precos = [random.randint(300, 600) if prim_classe else random.randint(100, 300) for prim_classe in classes]
+    num_1c = sum(classes)
+    num_2c = len(classes) - num_1c
+
+    # voo existe, ainda não partiu e lugares livres por classe (lotacao_voo)
+    lotacao = yield _todas("lotacao_compra", {"voo": voo})
+    livres = {r.prim_classe: r.livres for r in lotacao}
+    if not livres:
+        return (*_erro("Voo não encontrado ou já descolou.", 404), None)
+
+    if livres.get(True, 0) < num_1c:
+        return (*_erro("Não há assentos de primeira classe suficientes.", 400), None)
+
+    if livres.get(False, 0) < num_2c:
+        return (*_erro("Não há assentos de segunda classe suficientes", 400), None)
+
+    # venda e bilhetes num só comando; o nome do passageiro é único por venda e voo
+    inseridos = yield _todas(
+        "inserir_venda",
+        {
+            "voo": voo,
+            "hora_partida": lotacao[0].hora_partida,
+            "nif": nif,
+            "nomes": nomes,
+            "precos": precos,
+            "classes": classes,
+        },
+    )
+
+    bilhete_por_nome = {r.nome_passageiro: r.id for r in inseridos}
+    log.debug(f"Inserted sale with code {inseridos[0].codigo_reserva} and {len(inseridos)} tickets.")
+    resposta = {
+        "message": "Compra realizada com sucesso!",
+        "bilhetes": [bilhete_por_nome[nome] for nome in nomes],
+        "status": "success",
+    }
+    return resposta, 200, inseridos[0].codigo_reserva
+
+
+class Compra:
+    """Compra dos bilhetes de <passageiros> para o <voo>.
+
+    A validação dos lugares e a inserção da venda correm numa transação, que
+    conforme o <modo> (COMPRA_MODO por omissão):
+    - "bloqueio" começa por um advisory lock do voo, que serializa as compras
+      desse voo sem conflitos;
+    - "serializavel" corre em SERIALIZABLE e é repetida quando o Postgres a
+      aborta por conflito com uma compra concorrente;
+    - "direto" são dois comandos em autocommit, como antes: uma venda concorrente
+      que esgote a classe entretanto é travada pelo CHECK de lotacao_voo.
+    Em qualquer modo, uma compra que esbarre no CHECK responde 400 e os conflitos
+    (serialização, deadlock, a mesma <chave> em paralelo) repetem a transação
+    até COMPRA_TENTATIVAS vezes, com esperas aleatórias crescentes; esgotadas,
+    responde 503.
+
+    Com <chave> (Idempotency-Key), a resposta de uma compra feita é guardada
+    com a venda, e o mesmo pedido com a mesma chave devolve-a sem comprar de novo.
+
+    Quem a corre faz, em cada uma das COMPRA_TENTATIVAS tentativas:
+    espera(tentativa), a operação passos() dentro de transacao(conn) e, se
+    falhar com um erro do psycopg, falhou(erro, tentativa); no fim, ESGOTADA.
+    """
+
+    ESGOTADA = _erro("Conflito com compras em simultâneo, tente de novo.", 503)
+
+    def __init__(self, voo, nif, passageiros, chave=None, modo=None):
+        self.voo = voo
+        self.nif = nif
+        self.passageiros = passageiros
+        self.chave = chave
+        self.modo = modo or COMPRA_MODO
+        self.pedido = hashlib.sha256(json.dumps([str(voo), nif, passageiros], sort_keys=True).encode()).hexdigest()
+
+    def espera(self, tentativa):
+        """Segundos a esperar antes da <tentativa> (0 na primeira)."""
+        return random.uniform(0, min(COMPRA_ESPERA_MAX, 0.005 * 2**tentativa)) if tentativa else 0
+
+    def transacao(self, conn):
+        """A transação da tentativa, síncrona ou assíncrona como a <conn>; nenhuma no modo direto."""
+        if self.modo == "direto" and self.chave is None:
+            return nullcontext()
+        return conn.transaction()
+
+    def passos(self):
+        """Operação de uma tentativa; devolve o par (resposta, código HTTP)."""
+        if self.modo == "serializavel":
+            yield Passo("SET TRANSACTION ISOLATION LEVEL SERIALIZABLE;", None, None)
+        elif self.modo == "bloqueio":
+            yield Passo(CONSULTAS["bloquear_voo"], {"voo": self.voo}, None)
+        if self.chave is not None:
+            anterior = yield _uma("compra_idempotente", {"chave": self.chave})
+            if anterior is not None:
+                if anterior.pedido != self.pedido:
+                    return _erro("Idempotency-Key usada noutro pedido.", 422)
+                return anterior.resposta, 200
+        resposta, status, codigo_reserva = yield from _vender(self.voo, self.nif, self.passageiros)
+        if self.chave is not None and status == 200:
+            yield Passo(
+                CONSULTAS["guardar_compra"],
+                {
+                    "chave": self.chave,
+                    "pedido": self.pedido,
+                    "codigo_reserva": codigo_reserva,
+                    "resposta": Jsonb(resposta),
+                },
+                None,
+            )
+        return resposta, status
+
+    def falhou(self, erro, tentativa):
+        """Resposta à tentativa que falhou com <erro>, ou None para a repetir; volta a
+        lançar os erros que não são da lotação nem conflitos."""
+        if isinstance(erro, CheckViolation) and erro.diag.table_name == "lotacao_voo":
+            return _erro("Não há assentos suficientes.", 400)
+        if isinstance(erro, (SerializationFailure, DeadlockDetected)) or (
+            isinstance(erro, UniqueViolation) and erro.diag.table_name == "compra_idempotente"
+        ):
+            log.debug(f"Purchase for flight {self.voo} conflicted ({erro.sqlstate}), attempt {tentativa + 1}.")
+            return None
+        raise erro
+
+
+# Check-in
+
+
+def checkin_bilhete(bilhete):
+    """Atribui ao <bilhete> um lugar livre da sua classe no avião do voo, numa transação.
+
+    O lugar é reclamado de assento_livre com FOR UPDATE SKIP LOCKED: check-ins
+    concorrentes no mesmo voo saltam os lugares já reclamados por outras
+    transações em vez de escolherem o mesmo e falharem.
+    Devolve (resposta, código HTTP, (voo, lugar) atribuído ou None).
+    """
+    # bilhete e voo (o bilhete fica bloqueado até ao fim da transação)
+    row = yield _uma("bilhete_checkin", {"bilhete": bilhete})
+    if not row:
+        if (yield _uma("bilhete_partido", {"bilhete": bilhete})).partido:
+            return (*_erro("Voo não encontrado ou já descolou.", 404), None)
+        return (*_erro("Bilhete não encontrado.", 404), None)
+    voo_id, hora_partida, prim_classe, no_serie = row.voo_id, row.hora_partida, row.prim_classe, row.no_serie
+
+    # reclama um lugar livre da classe do bilhete
+    row = yield _uma("reclamar_lugar", {"voo_id": voo_id, "classe": prim_classe})
+    if not row:
+        return {"message": "Sem assentos livres.", "row": row, "status": "error"}, 404, None
+    lugar = row.lugar
+
+    yield Passo(
+        CONSULTAS["atribuir_lugar"],
+        {"lugar": lugar, "bilhete": bilhete, "hora_partida": hora_partida, "no_serie": no_serie},
+        None,
+    )
+    return {"message": "Check-in realizado com sucesso!", "lugar": lugar, "status": "success"}, 200, (voo_id, lugar)
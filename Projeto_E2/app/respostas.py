@@ -0,0 +1,63 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Respostas JSON com orjson e pedidos condicionais (ETag) dos endpoints de leitura.
+
+O orjson serializa várias vezes mais depressa do que o módulo json usado pelo
+Flask e pelo Quart (ver bench/respostas.py). As datas saem em ISO 8601
+(2026-10-17T14:05:00, o formato de ?desde= e dos tokens ?depois=), em vez do
+formato HTTP terminado em "GMT" que o Flask dava a horas locais sem fuso. As
+chaves continuam ordenadas, e os Decimal e as linhas do psycopg (namedtuple)
+saem como antes, em texto e em lista.
+
+As respostas servidas das caches (/ e /voos/<partida>) levam um ETag forte com
+a versão dos dados, lida de versao_dados (ver aviacao.sql) no mesmo comando que
+os carrega, e um Cache-Control. Um pedido cujo If-None-Match tem esse ETag
+recebe 304 sem consultar a base de dados nem serializar a lista.
+"""
+from decimal import Decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+
+OPCOES = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    # namedtuple (linhas do psycopg), que o orjson não serializa como tuplo
+    if isinstance(obj, tuple):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class JSONOrjson(JSONProvider):
+    """JSONProvider com orjson, para o Flask e para o Quart (que tem a mesma interface).
+
+    A saída é sempre compacta: o orjson não tem indent nem separators.
+    """
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=OPCOES).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=OPCOES | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype,
+        )
+
+
+def validadores(etag, max_age):
+    """Cabeçalhos ETag e Cache-Control de uma resposta na versão <etag>, fresca durante <max_age> segundos."""
+    return {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={max(int(max_age), 0)}"}
+
+
+def nao_modificado(pedido, etag):
+    """Se o If-None-Match do <pedido> (Flask ou Quart) inclui <etag>, com a comparação fraca do RFC 9110."""
+    return pedido.if_none_match.contains_weak(etag)
@@ -0,0 +1,297 @@
+# Copyright (c) BDist Development Team
+# Distributed under the terms of the Modified BSD License.
+"""Itinerários com escalas, procurados num grafo de horários em memória, por worker.
+
+Os voos que partem nas próximas <horizonte> horas ficam agrupados por
+aeroporto de partida e ordenados por hora de partida: as ligações a partir de
+uma chegada são uma procura binária e um corte da lista do aeroporto, em vez de
+uma autojunção de voo por pedido. O grafo é atualizado aos poucos: o trigger em
+voo notifica o canal CANAL com o aeroporto de partida alterado, cujos voos são
+relidos no pedido seguinte, e a cada <avanco> segundos a janela avança, lendo
+só os voos que entraram nela.
+
+Os lugares livres mudam a cada compra e não estão no grafo: são lidos de
+lotacao_voo, numa só consulta, para os voos dos itinerários encontrados; os
+itinerários com algum voo esgotado são trocados pelos seguintes.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+
+from consultas import CONSULTAS
+
+log = logging.getLogger(__name__)
+
+Voo = namedtuple("Voo", "id no_serie partida chegada hora_partida hora_chegada")
+
+ESCALAS_MAX = 2
+ITINERARIOS_MAX = 20
+# procuras repetidas sem os voos que se revelaram esgotados
+TENTATIVAS = 3
+
+
+Partidas = namedtuple("Partidas", "horas voos por_destino")
+Partidas.__doc__ = """Voos de um aeroporto por hora de partida (horas e voos pela mesma ordem)
+e, em por_destino, os mesmos por aeroporto de chegada: {chegada: (horas, voos)}."""
+
+
+def _partidas(voos):
+    """Partidas dos <voos> de um aeroporto, já ordenados por hora de partida."""
+    por_destino = {}
+    for v in voos:
+        horas, lista = por_destino.setdefault(v.chegada, ([], []))
+        horas.append(v.hora_partida)
+        lista.append(v)
+    return Partidas([v.hora_partida for v in voos], voos, por_destino)
+
+
+_VAZIO = Partidas((), (), {})
+
+
+class GrafoHorarios:
+    """Voos das próximas <horizonte> horas por aeroporto de partida, com
+    procura dos itinerários que chegam mais cedo (ver procurar)."""
+
+    CANAL = "voo_alterado"
+
+    def __init__(self, pool, horizonte, avanco, ligacao_min, ligacao_max, ouvinte=None):
+        self.pool = pool
+        self.horizonte = horizonte
+        self.avanco = avanco
+        self.ligacao_min = ligacao_min
+        self.ligacao_max = ligacao_max
+        self.ouvinte = ouvinte
+        self.cargas = 0
+        self.recargas = 0
+        self.avancos = 0
+        # aeroporto: Partidas
+        self._partidas = {}
+        self._agora = None
+        self._lido_em = 0.0
+        self._fim = None
+        self._avancado_em = 0.0
+        self._tudo = True
+        self._alterados = set()
+        self._lock = threading.Lock()
+        self._lock_carga = threading.Lock()
+        if ouvinte:
+            ouvinte.registar(self.CANAL, self.invalidar)
+
+    def invalidar(self, partida=None):
+        """Marca <partida> (todos os aeroportos se vazio ou None) para ser relido."""
+        with self._lock:
+            if not partida:
+                self._tudo = True
+            else:
+                self._alterados.add(partida)
+
+    def agora(self):
+        """Estimativa do LOCALTIMESTAMP da base de dados, a partir da última leitura."""
+        return self._agora + timedelta(seconds=time.monotonic() - self._lido_em)
+
+    def carregar(self, voos, agora, fim):
+        """Substitui o grafo pelos <voos>, lidos em <agora> até à partida <fim>,
+        sem ir à base de dados (usado pelo bench/itinerarios.py com horários sintéticos)."""
+        with self._lock:
+            self._tudo, self._alterados = False, set()
+        self._instalar(voos, agora, fim)
+
+    def _instalar(self, voos, agora, fim):
+        por_aeroporto = {}
+        for v in sorted(voos, key=lambda v: v.hora_partida):
+            por_aeroporto.setdefault(v.partida, []).append(v)
+        self._partidas = {a: _partidas(lista) for a, lista in por_aeroporto.items()}
+        self._agora, self._lido_em = agora, time.monotonic()
+        self._fim = fim
+        self._avancado_em = time.monotonic()
+
+    def _ler(self, consulta, params):
+        with self.pool.connection() as conn:
+            rows = conn.execute(CONSULTAS[consulta], params).fetchall()
+        self._agora, self._lido_em = rows[0].agora, time.monotonic()
+        return rows[0].agora, [Voo(*r[1:]) for r in rows if r.id is not None]
+
+    def _atualizar(self):
+        """Carrega o grafo, relê os aeroportos alterados e avança a janela, se for preciso."""
+        avancar = time.monotonic() - self._avancado_em >= self.avanco
+        if not (self._tudo or self._alterados or avancar):
+            return
+        if self.ouvinte:
+            self.ouvinte.iniciar()
+        with self._lock_carga:
+            with self._lock:
+                # o que for notificado a partir daqui fica para a próxima atualização
+                tudo, alterados = self._tudo, self._alterados
+                self._tudo, self._alterados = False, set()
+            # outra thread pode ter atualizado enquanto esperávamos
+            avancar = time.monotonic() - self._avancado_em >= self.avanco
+            if not (tudo or alterados or avancar):
+                return
+            try:
+                if tudo:
+                    agora, voos = self._ler("grafo_voos", {"desde": None, "horizonte": self.horizonte})
+                    self._instalar(voos, agora, agora + self.horizonte)
+                    self.cargas += 1
+                    log.debug(f"Loaded {len(voos)} flights into the schedule graph.")
+                    return
+                if alterados:
+                    _, voos = self._ler("grafo_aeroportos", {"aeroportos": list(alterados), "ate": self._fim})
+                    por_aeroporto = {a: [] for a in alterados}
+                    for v in voos:
+                        por_aeroporto[v.partida].append(v)
+                    # um dicionário novo: procurar() pode estar a percorrer o atual noutra thread
+                    self._partidas = {
+                        **self._partidas,
+                        **{a: _partidas(lista) for a, lista in por_aeroporto.items()},
+                    }
+                    self.recargas += len(alterados)
+                if avancar:
+                    self._avancar()
+            except BaseException:
+                with self._lock:
+                    self._tudo |= tudo
+                    self._alterados |= alterados
+                raise
+
+    def _avancar(self):
+        """Junta os voos que entraram na janela e descarta os que já partiram."""
+        agora, voos = self._ler("grafo_voos", {"desde": self._fim, "horizonte": self.horizonte})
+        novos = {}
+        for v in voos:
+            novos.setdefault(v.partida, []).append(v)
+        partidas = {}
+        for aeroporto in self._partidas.keys() | novos.keys():
+            atuais = self._partidas.get(aeroporto, _VAZIO)
+            partidas[aeroporto] = _partidas(
+                atuais.voos[bisect_right(atuais.horas, agora):] + novos.get(aeroporto, [])
+            )
+        self._partidas = partidas
+        self._fim = agora + self.horizonte
+        self._avancado_em = time.monotonic()
+        self.avancos += 1
+
+    def procurar(self, partida, chegada, desde=None, escalas=ESCALAS_MAX, n=3, excluir=frozenset()):
+        """Até <n> itinerários (tuplos de Voo) de <partida> para <chegada>, o
+        primeiro voo depois de <desde> (agora, por omissão), com até <escalas>
+        escalas de ligacao_min a ligacao_max cada e sem voos em <excluir>.
+
+        Por ordem de hora de chegada e, depois, de número de voos: é uma procura
+        do melhor primeiro (heap) pela hora de chegada. As ligações possíveis a
+        seguir a um voo só dependem dele (do aeroporto e da hora de chegada), por
+        isso cada voo é continuado no máximo <n> vezes com o mesmo número de voos
+        antes dele: os outros caminhos até ele não dariam itinerários melhores.
+        """
+        self._atualizar()
+        agora = self.agora()
+        desde = max(desde or agora, agora)
+        partidas = self._partidas
+        # aeroportos de onde há voos para o destino (as escalas possíveis antes do último voo)
+        para_destino = {a for a, p in partidas.items() if chegada in p.por_destino}
+        expandidos = Counter()
+        # horas de chegada (ordenadas) dos <n> primeiros itinerários completos já na heap:
+        # um caminho que chegue depois da n-ésima não pode entrar no resultado
+        melhores = []
+        resultado = []
+        ordem = 0
+        heap = [(desde, 0, ordem, partida, ())]
+        while heap and len(resultado) < n:
+            hora, num_voos, _, aeroporto, caminho = heapq.heappop(heap)
+            if aeroporto == chegada:
+                resultado.append(caminho)
+                continue
+            daqui = partidas.get(aeroporto, _VAZIO)
+            # o próximo voo é o último permitido: só os que vão para o destino
+            if num_voos == escalas:
+                horas, lista = daqui.por_destino.get(chegada, _VAZIO[:2])
+            else:
+                horas, lista = daqui.horas, daqui.voos
+            if caminho:
+                i, j = bisect_left(horas, hora + self.ligacao_min), bisect_right(horas, hora + self.ligacao_max)
+            else:
+                i, j = bisect_right(horas, hora), len(horas)
+            visitados = {partida, *(v.chegada for v in caminho)}
+            # depois do voo seguinte só falta o último: a escala tem de ter voos para o destino
+            penultimo = num_voos + 1 == escalas
+            for k in range(i, j):
+                v = lista[k]
+                if len(melhores) == n and v.hora_chegada > melhores[-1]:
+                    continue
+                if v.chegada == chegada:
+                    if v.id in excluir or expandidos[v.id, num_voos] >= n:
+                        continue
+                    insort(melhores, v.hora_chegada)
+                    del melhores[n:]
+                elif (
+                    v.chegada in visitados
+                    or penultimo and v.chegada not in para_destino
+                    or v.id in excluir
+                    or expandidos[v.id, num_voos] >= n
+                ):
+                    continue
+                expandidos[v.id, num_voos] += 1
+                ordem += 1
+                heapq.heappush(heap, (v.hora_chegada, num_voos + 1, ordem, v.chegada, caminho + (v,)))
+        return resultado
+
+    def estatisticas(self):
+        return {
+            "aeroportos": len(self._partidas),
+            "voos": sum(len(p.voos) for p in self._partidas.values()),
+            "fim": self._fim,
+            "cargas": self.cargas,
+            "aeroportos_relidos": self.recargas,
+            "avancos": self.avancos,
+        }
+
+
+def ler_parametros(args):
+    """Parâmetros da procura a partir de ?escalas=&n=&desde=&classe= (ValueError se inválidos)."""
+    try:
+        escalas = int(args.get("escalas", ESCALAS_MAX))
+        n = int(args.get("n", 3))
+        desde = datetime.fromisoformat(args["desde"]) if "desde" in args else None
+        classe = {"0": False, "1": True}[args["classe"]] if "classe" in args else None
+    except (ValueError, KeyError):
+        raise ValueError("Parâmetros escalas, n, desde ou classe inválidos.")
+    if desde is not None and desde.tzinfo is not None:
+        raise ValueError("Parâmetro desde deve ser uma hora local, sem fuso horário.")
+    if not 0 <= escalas <= ESCALAS_MAX:
+        raise ValueError(f"Parâmetro escalas deve estar entre 0 e {ESCALAS_MAX}.")
+    if not 1 <= n <= ITINERARIOS_MAX:
+        raise ValueError(f"Parâmetro n deve estar entre 1 e {ITINERARIOS_MAX}.")
+    return {"escalas": escalas, "n": n, "desde": desde, "classe": classe}
+
+
+def lugares_livres(rows, classe=None):
+    """{voo_id: lugares livres} das linhas de lotacao_voos, da <classe> ou das duas."""
+    livres = {}
+    for r in rows:
+        if classe is None or r.prim_classe == classe:
+            livres[r.voo_id] = livres.get(r.voo_id, 0) + r.livres
+    return livres
+
+
+def descrever(itinerario, livres):
+    """Elemento da resposta de /rotas para um itinerário com os <livres> de cada voo."""
+    return {
+        "partida": itinerario[0].hora_partida,
+        "chegada": itinerario[-1].hora_chegada,
+        "escalas": len(itinerario) - 1,
+        "duracao_minutos": int((itinerario[-1].hora_chegada - itinerario[0].hora_partida).total_seconds() // 60),
+        "voos": [
+            {
+                "id": v.id,
+                "no_serie": v.no_serie,
+                "partida": v.partida,
+                "chegada": v.chegada,
+                "hora_partida": v.hora_partida,
+                "hora_chegada": v.hora_chegada,
+                "lugares_livres": livres[v.id],
+            }
+            for v in itinerario
+        ],
+    }
@@ -0,0 +1,125 @@
+"""Custo do mapa de assentos de um voo: a lista de lugares de um JOIN entre
+assento e bilhete, contra os bitmaps de app/assentos.py lidos da base de dados
+e servidos da cache por GET /voos/<voo>/assentos, em JSON, binário e 304.
+
+    python bench/assentos.py --repeticoes 2000
+
+Com os voos por partir com bilhetes sem lugar (--voos), mede o p50/p99 e os
+bytes da resposta de:
+  - SQL por lugar: assento LEFT JOIN bilhete do voo, uma linha JSON por lugar;
+  - mapa_assentos: a consulta e os bitmaps, sem cache (MapasAssentos._carregar);
+  - GET json / binario: o endpoint com o mapa já em cache;
+  - GET 304: o endpoint com o ETag da resposta anterior.
+No fim faz o check-in de um bilhete e confirma que o lugar aparece ocupado no
+mapa em cache sem o reler (o bilhete fica com o lugar).
+"""
+import argparse
+import itertools
+import os
+import time
+
+import orjson
+
+from comum import importar_app, percentil
+
+SQL_POR_LUGAR = """
+SELECT a.lugar, a.prim_classe, b.id IS NOT NULL AS ocupado
+FROM voo v
+JOIN assento a ON a.no_serie = v.no_serie
+LEFT JOIN bilhete b ON b.voo_id = v.id AND b.hora_partida = v.hora_partida AND b.lugar = a.lugar
+WHERE v.id = %(voo)s
+AND v.hora_partida > NOW()
+ORDER BY a.lugar;
+"""
+
+
+def medir(funcao, repeticoes):
+    """Tempos (s) de <repeticoes> chamadas a <funcao> e o tamanho (bytes) do que devolve."""
+    tamanho = len(funcao())
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos, tamanho
+
+
+def ocupado(corpo, i):
+    return bool(corpo[i >> 3] & (0x80 >> (i & 7)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--voos", type=int, default=20, help="voos medidos (em ciclo)")
+    parser.add_argument("--repeticoes", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ["FLASK_RATELIMIT_ENABLED"] = "false"
+    app = importar_app()
+    cliente = app.app.test_client()
+    with app.pool.connection() as conn:
+        voos = [
+            r.voo_id
+            for r in conn.execute(
+                """
+                SELECT DISTINCT voo_id FROM bilhete
+                WHERE lugar IS NULL AND hora_partida > NOW() + INTERVAL '1 day'
+                LIMIT %(n)s;
+                """,
+                {"n": args.voos},
+            )
+        ]
+    assert voos, "sem voos por partir com bilhetes sem lugar"
+
+    def por_lugar(voo):
+        with app.pool.connection() as conn:
+            linhas = conn.execute(SQL_POR_LUGAR, {"voo": voo}).fetchall()
+        return orjson.dumps([linha._asdict() for linha in linhas])
+
+    def carregar(voo):
+        entrada = app.mapas_assentos._carregar(voo)
+        return entrada.primeira + entrada.ocupados
+
+    def pedido(voo, formato, etags=None):
+        headers = {"If-None-Match": etags[voo]} if etags else {}
+        resposta = cliente.get(f"/voos/{voo}/assentos?formato={formato}", headers=headers)
+        assert resposta.status_code == (304 if etags else 200), (voo, resposta.status_code)
+        return resposta.data
+
+    # mapas em cache durante as medições
+    app.mapas_assentos.ttl = 3600
+    etags = {voo: cliente.get(f"/voos/{voo}/assentos").headers["ETag"] for voo in voos}
+
+    casos = {
+        "SQL per seat": por_lugar,
+        "mapa_assentos": carregar,
+        "GET json": lambda voo: pedido(voo, "json"),
+        "GET binario": lambda voo: pedido(voo, "binario"),
+        "GET 304": lambda voo: pedido(voo, "json", etags),
+    }
+    print(f"{'case':<16}{'bytes':>8}{'p50 µs':>10}{'p99 µs':>10}")
+    for nome, funcao in casos.items():
+        ciclo = itertools.cycle(voos)
+        tempos, tamanho = medir(lambda: funcao(next(ciclo)), args.repeticoes)
+        print(f"{nome:<16}{tamanho:>8}{percentil(tempos, 50) * 1e6:>10.0f}{percentil(tempos, 99) * 1e6:>10.0f}")
+
+    # check-in de um bilhete de um voo em cache: o lugar fica ocupado no mapa sem o reler
+    with app.pool.connection() as conn:
+        bilhete = conn.execute(
+            "SELECT id, voo_id FROM bilhete WHERE lugar IS NULL AND voo_id = ANY(%(voos)s) LIMIT 1;", {"voos": voos}
+        ).fetchone()
+    misses = app.mapas_assentos.misses
+    mapa = cliente.get(f"/voos/{bilhete.voo_id}/assentos").get_json()
+    lugar = cliente.post(f"/checkin/{bilhete.id}").get_json()["lugar"]
+    depois = cliente.get(f"/voos/{bilhete.voo_id}/assentos", headers={"If-None-Match": etags[bilhete.voo_id]})
+    binario = cliente.get(f"/voos/{bilhete.voo_id}/assentos?formato=binario").data
+    n = len(mapa["lugares"])
+    i = mapa["lugares"].index(lugar)
+    assert depois.status_code == 200 and depois.get_json()["livres"] == mapa["livres"] - 1
+    assert ocupado(binario[6 + (n + 7) // 8 :], i)
+    assert app.mapas_assentos.misses == misses
+    print(f"\nCheck-in of ticket {bilhete.id}: seat {lugar} of flight {bilhete.voo_id} shown as taken, ETag changed")
+
+
+if __name__ == "__main__":
+    main()
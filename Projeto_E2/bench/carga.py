@@ -0,0 +1,80 @@
+"""Tempo de carga dos dados gerados: populate.sql com INSERT vs COPY, CSV e carga direta.
+
+    python bench/carga.py
+    python bench/carga.py --scale 10
+
+Gera os dados com data/gerador.py em cada formato (com a mesma semente, logo as
+mesmas linhas), recria o esquema com data/aviacao.sql antes de cada carga e mede
+a carga com o psql, que tem de estar no PATH. Para --carregar (COPY direto com
+psycopg) mede a execução completa do gerador e desconta o tempo de gerar o
+ficheiro no formato copy. Os dados carregados ficam na base de dados.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psycopg
+
+from comum import DATABASE_URL, GERADOR, carregar
+
+
+def cronometrar(comando, cwd=None):
+    """Segundos que demora o <comando> (falha se sair com erro)."""
+    inicio = time.perf_counter()
+    subprocess.run(comando, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - inicio
+
+
+def tamanho(caminho):
+    if os.path.isdir(caminho):
+        return sum(os.path.getsize(os.path.join(caminho, f)) for f in os.listdir(caminho))
+    return os.path.getsize(caminho)
+
+
+def recriar_esquema():
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        carregar(conn, [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=1.0, help="passado ao gerador")
+    args = parser.parse_args()
+
+    gerador = [sys.executable, GERADOR, "--scale", str(args.scale)]
+    psql = ["psql", "-q", "-v", "ON_ERROR_STOP=1", "-d", DATABASE_URL, "-f"]
+    resultados = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for formato in ("sql", "copy", "csv"):
+            saida = os.path.join(tmp, formato)
+            geracao = cronometrar([*gerador, "--formato", formato, "--output", saida])
+            recriar_esquema()
+            if formato == "csv":
+                carga = cronometrar([*psql, "populate.sql"], cwd=saida)
+            else:
+                carga = cronometrar([*psql, saida])
+            resultados.append((f"--formato {formato}", f"{tamanho(saida) / 2**20:.0f} MB", geracao, carga))
+            print(f"{formato}: generated in {geracao:.1f} s, loaded in {carga:.1f} s", flush=True)
+
+        recriar_esquema()
+        total = cronometrar([*gerador, "--carregar", DATABASE_URL])
+        geracao = resultados[1][2]
+        resultados.append(("--carregar", "-", geracao, total - geracao))
+
+    with psycopg.connect(DATABASE_URL) as conn:
+        linhas = conn.execute(
+            "SELECT (SELECT COUNT(*) FROM voo) + (SELECT COUNT(*) FROM venda) + (SELECT COUNT(*) FROM bilhete) "
+            "+ (SELECT COUNT(*) FROM assento);"
+        ).fetchone()[0]
+
+    print(f"\n{linhas} rows (assento, voo, venda, bilhete)")
+    print(f"{'mode':<18}{'size':>8}{'generate':>12}{'load':>12}{'rows/s':>12}")
+    for modo, tam, geracao, carga in resultados:
+        print(f"{modo:<18}{tam:>8}{geracao:>10.1f} s{carga:>10.1f} s{linhas / carga:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
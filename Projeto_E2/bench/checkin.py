@@ -0,0 +1,136 @@
+"""Teste de carga do check-in concorrente: vários threads fazem check-in dos
+bilhetes do mesmo voo em paralelo e no fim verifica-se que nenhum lugar foi
+atribuído duas vezes nem a um bilhete da classe errada.
+
+    python bench/checkin.py --threads 16
+
+Compara fazer_checkin (lugar reclamado de assento_livre com SKIP LOCKED) com a
+consulta antiga (primeiro lugar NOT IN bilhete), que colide sob concorrência.
+"""
+import argparse
+import queue
+import threading
+import time
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, apagar_vendas, criar_voo_temporario, importar_app
+
+
+def checkin_antigo(conn, bilhete):
+    """Escolha de lugar do checkin original: primeiro lugar da classe sem bilhete."""
+    with conn.transaction():
+        with conn.cursor() as cur:
+            row = cur.execute(
+                """
+                SELECT b.voo_id, b.prim_classe, v.no_serie
+                FROM bilhete b JOIN voo v ON v.id = b.voo_id
+                WHERE b.id = %(bilhete)s;
+                """,
+                {"bilhete": bilhete},
+            ).fetchone()
+            row = cur.execute(
+                """
+                SELECT lugar FROM assento
+                WHERE no_serie = %(no_serie)s AND prim_classe = %(classe)s
+                AND lugar NOT IN (
+                    SELECT lugar FROM bilhete WHERE voo_id = %(voo_id)s AND lugar IS NOT NULL
+                )
+                LIMIT 1;
+                """,
+                {"no_serie": row.no_serie, "classe": row.prim_classe, "voo_id": row.voo_id},
+            ).fetchone()
+            cur.execute(
+                "UPDATE bilhete SET lugar = %(lugar)s, no_serie = v.no_serie FROM voo v "
+                "WHERE v.id = bilhete.voo_id AND bilhete.id = %(bilhete)s;",
+                {"lugar": row.lugar, "bilhete": bilhete},
+            )
+    return {"status": "success"}, 200
+
+
+def correr(fazer, bilhetes, num_threads):
+    """Faz o check-in de todos os bilhetes com num_threads ligações; devolve (ok, falhas, segundos)."""
+    pendentes = queue.Queue()
+    for b in bilhetes:
+        pendentes.put(b)
+    contagem = {"ok": 0, "falhas": 0}
+    lock = threading.Lock()
+
+    def trabalhador():
+        with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+            while True:
+                try:
+                    bilhete = pendentes.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    _, status = fazer(conn, bilhete)
+                    resultado = "ok" if status == 200 else "falhas"
+                except psycopg.Error:
+                    resultado = "falhas"
+                with lock:
+                    contagem[resultado] += 1
+
+    threads = [threading.Thread(target=trabalhador) for _ in range(num_threads)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return contagem["ok"], contagem["falhas"], time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    app = importar_app()
+    conn = psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row)
+    voo = criar_voo_temporario(conn)
+    try:
+        # esgota o voo: um bilhete por assento
+        livres = conn.execute(
+            "SELECT prim_classe, capacidade FROM lotacao_voo WHERE voo_id = %(voo)s;", {"voo": voo}
+        ).fetchall()
+        bilhetes = []
+        for r in livres:
+            for inicio in range(0, r.capacidade, 50):
+                passageiros = [
+                    {"nome": f"Passageiro {r.prim_classe} {i}", "classe": r.prim_classe}
+                    for i in range(inicio, min(inicio + 50, r.capacidade))
+                ]
+                bilhetes += app.comprar_bilhetes(conn, voo, "123456789", passageiros)[0]["bilhetes"]
+
+        print(f"voo {voo}: {len(bilhetes)} bilhetes, {args.threads} threads")
+        print(f"{'caminho':>12} {'ok':>5} {'falhas':>7} {'repetidos':>10} {'classe errada':>14} {'check-ins/s':>12}")
+        for nome, fazer in (("skip locked", app.fazer_checkin), ("antigo", checkin_antigo)):
+            conn.execute("UPDATE bilhete SET lugar = NULL, no_serie = NULL WHERE voo_id = %(voo)s;", {"voo": voo})
+            ok, falhas, segundos = correr(fazer, bilhetes, args.threads)
+            repetidos = conn.execute(
+                """
+                SELECT COALESCE(SUM(n - 1), 0) AS repetidos FROM (
+                    SELECT COUNT(*) AS n FROM bilhete
+                    WHERE voo_id = %(voo)s AND lugar IS NOT NULL
+                    GROUP BY lugar
+                ) t;
+                """,
+                {"voo": voo},
+            ).fetchone().repetidos
+            classe_errada = conn.execute(
+                """
+                SELECT COUNT(*) AS n FROM bilhete b
+                JOIN assento a ON a.lugar = b.lugar AND a.no_serie = b.no_serie
+                WHERE b.voo_id = %(voo)s AND a.prim_classe <> b.prim_classe;
+                """,
+                {"voo": voo},
+            ).fetchone().n
+            print(f"{nome:>12} {ok:>5} {falhas:>7} {repetidos:>10} {classe_errada:>14} {ok / segundos:>12.1f}")
+    finally:
+        apagar_vendas(conn, voo, apagar_voo=True)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark da compra de bilhetes: caminho antigo (uma ida por verificação e por
+bilhete) contra comprar_bilhetes (duas idas: validação e um INSERT com todos os
+bilhetes), por tamanho do grupo. Com --rtt-ms > 0 simula latência de rede.
+
+    python bench/compra.py --tamanhos 1,2,4,9,20 --repeticoes 50 --rtt-ms 1
+
+Cria um voo temporário no avião com mais lugares e apaga-o no fim.
+"""
+import argparse
+import random
+import time
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, ProxyLatencia, apagar_vendas, criar_voo_temporario, importar_app, percentil
+
+
+def compra_antiga(conn, voo, nif, passageiros):
+    """Sequência de comandos do buy_ticket original (antes do lotacao_voo)."""
+    num_1c = sum(1 for p in passageiros if p["classe"])
+    num_2c = len(passageiros) - num_1c
+    with conn.transaction():
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM voo WHERE id = %(voo)s AND hora_partida > NOW();", {"voo": voo})
+            assert cur.fetchone()
+            for prim_classe, pedidos in ((True, num_1c), (False, num_2c)):
+                cur.execute(
+                    """
+                    SELECT COUNT(*) FROM assento
+                    WHERE no_serie = (SELECT no_serie FROM voo WHERE id = %(voo)s)
+                    AND prim_classe = %(classe)s
+                    AND lugar NOT IN (SELECT lugar FROM bilhete WHERE voo_id = %(voo)s);
+                    """,
+                    {"voo": voo, "classe": prim_classe},
+                )
+                assert cur.fetchone()[0] >= pedidos
+            cur.execute(
+                "INSERT INTO venda (nif_cliente, balcao, hora) VALUES (%(nif)s, NULL, NOW()) RETURNING codigo_reserva;",
+                {"nif": nif},
+            )
+            codigo_reserva = cur.fetchone().codigo_reserva
+            bilhetes = []
+            for p in passageiros:
+                cur.execute(
+                    """
+                    INSERT INTO bilhete (voo_id, hora_partida, codigo_reserva, nome_passageiro, preco, prim_classe)
+                    VALUES (%(voo)s, (SELECT hora_partida FROM voo WHERE id = %(voo)s), %(codigo_reserva)s, %(nome)s, %(preco)s, %(classe)s)
+                    RETURNING id;
+                    """,
+                    {
+                        "voo": voo,
+                        "codigo_reserva": codigo_reserva,
+                        "nome": p["nome"],
+                        "preco": random.randint(100, 600),
+                        "classe": p["classe"],
+                    },
+                )
+                bilhetes.append(cur.fetchone().id)
+    return bilhetes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", default="1,2,4,9,20", help="tamanhos de grupo, separados por vírgulas")
+    parser.add_argument("--repeticoes", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="latência de rede simulada (ida e volta)")
+    args = parser.parse_args()
+
+    app = importar_app()
+    proxy = ProxyLatencia(DATABASE_URL, args.rtt_ms)
+    conn = psycopg.connect(proxy.dsn, autocommit=True, row_factory=namedtuple_row)
+    voo = criar_voo_temporario(conn)
+    caminhos = {"antigo": compra_antiga, "lote": lambda *a: app.comprar_bilhetes(*a)[0]["bilhetes"]}
+
+    print(f"{'grupo':>5} {'caminho':>8} {'idas':>5} {'p50 ms':>8} {'p95 ms':>8} {'média ms':>9}")
+    try:
+        for tamanho in map(int, args.tamanhos.split(",")):
+            # um terço dos passageiros em primeira classe
+            passageiros = [{"nome": f"Passageiro {i}", "classe": i % 3 == 0} for i in range(tamanho)]
+            for nome, comprar in caminhos.items():
+                tempos = []
+                idas = 0
+                for _ in range(args.repeticoes):
+                    antes = proxy.idas
+                    inicio = time.perf_counter()
+                    bilhetes = comprar(conn, voo, "123456789", passageiros)
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+                    idas = proxy.idas - antes
+                    assert len(bilhetes) == tamanho
+                    apagar_vendas(conn, voo)
+                print(
+                    f"{tamanho:>5} {nome:>8} {idas:>5} {percentil(tempos, 50):>8.2f} "
+                    f"{percentil(tempos, 95):>8.2f} {sum(tempos) / len(tempos):>9.2f}"
+                )
+    finally:
+        apagar_vendas(conn, voo, apagar_voo=True)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
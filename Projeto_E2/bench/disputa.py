@@ -0,0 +1,181 @@
+"""Compras concorrentes no mesmo voo, por modo de comprar_bilhetes (COMPRA_MODO):
+"direto" (dois comandos em autocommit, o comportamento anterior), "bloqueio"
+(advisory lock por voo) e "serializavel" (SERIALIZABLE com repetição).
+
+    python bench/disputa.py --threads 16 --rondas 10
+
+Em cada ronda, --threads ligações compram bilhetes de segunda classe (1 a 3
+passageiros) num voo temporário até cada uma receber uma recusa por falta de
+lugares; mede-se as compras por segundo, a latência, as respostas por código
+HTTP, quantas recusas vieram do CHECK de lotacao_voo em vez da validação, os
+conflitos repetidos pela app e se algum voo ficou com bilhetes a mais. Depois,
+--threads ligações enviam ao mesmo tempo a mesma compra com a mesma
+Idempotency-Key, --chaves vezes, e conta-se as vendas a mais. O voo é apagado
+no fim.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, apagar_vendas, criar_voo_temporario, importar_app, percentil
+
+MODOS = ("direto", "bloqueio", "serializavel")
+NIF = "999999991"
+
+
+class Conflitos(logging.Handler):
+    """Conta as mensagens de conflito (repetição da transação) de comprar_bilhetes."""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.n = 0
+
+    def emit(self, record):
+        if "conflicted" in record.getMessage():
+            self.n += 1
+
+
+def ronda(app, voo, modo, num_threads):
+    """Esgota o voo com <num_threads> ligações; devolve (latências, códigos, recusas do CHECK, segundos)."""
+    latencias = []
+    codigos = {}
+    pelo_check = 0
+    lock = threading.Lock()
+    barreira = threading.Barrier(num_threads + 1)
+
+    def trabalhador(i):
+        nonlocal pelo_check
+        rng = random.Random(i)
+        with psycopg.connect(
+            DATABASE_URL, autocommit=True, row_factory=namedtuple_row, cursor_factory=app.Cursor
+        ) as conn:
+            barreira.wait()
+            for n in range(10**6):
+                passageiros = [{"nome": f"Passageiro {i}/{n}/{k}", "classe": False} for k in range(rng.randint(1, 3))]
+                inicio = time.perf_counter()
+                try:
+                    resposta, status = app.comprar_bilhetes(conn, voo, NIF, passageiros, modo=modo)
+                except psycopg.Error:
+                    resposta, status = {}, 500
+                with lock:
+                    latencias.append(time.perf_counter() - inicio)
+                    codigos[status] = codigos.get(status, 0) + 1
+                    pelo_check += resposta.get("message") == "Não há assentos suficientes."
+                if status in (400, 404):
+                    return
+
+    threads = [threading.Thread(target=trabalhador, args=(i,)) for i in range(num_threads)]
+    for t in threads:
+        t.start()
+    barreira.wait()
+    inicio = time.perf_counter()
+    for t in threads:
+        t.join()
+    return latencias, codigos, pelo_check, time.perf_counter() - inicio
+
+
+def idempotencia(app, voo, modo, num_threads, chaves):
+    """Vendas a mais e respostas diferentes quando <num_threads> enviam a mesma compra com a mesma chave."""
+    vendas_a_mais = diferentes = 0
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        ligacoes = [
+            psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row, cursor_factory=app.Cursor)
+            for _ in range(num_threads)
+        ]
+        try:
+            for k in range(chaves):
+                chave = f"disputa-{modo}-{k}-{random.random()}"
+                passageiros = [{"nome": f"Passageiro {k}", "classe": False}]
+                barreira = threading.Barrier(num_threads)
+                respostas = []
+
+                def trabalhador(c):
+                    barreira.wait()
+                    respostas.append(app.comprar_bilhetes(c, voo, NIF, passageiros, chave=chave, modo=modo))
+
+                threads = [threading.Thread(target=trabalhador, args=(c,)) for c in ligacoes]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                # o jsonb da resposta guardada reordena as chaves
+                diferentes += len({json.dumps(r, sort_keys=True) for r in respostas}) - 1
+            vendas = conn.execute(
+                "SELECT COUNT(DISTINCT codigo_reserva) AS n FROM bilhete WHERE voo_id = %(voo)s;", {"voo": voo}
+            ).fetchone().n
+            vendas_a_mais = vendas - chaves
+        finally:
+            for c in ligacoes:
+                c.close()
+    return vendas_a_mais, diferentes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--rondas", type=int, default=10)
+    parser.add_argument("--chaves", type=int, default=50)
+    parser.add_argument("--modos", default=",".join(MODOS))
+    args = parser.parse_args()
+
+    app = importar_app()
+    conflitos = Conflitos()
+    app.log.addHandler(conflitos)
+    app.log.setLevel(logging.DEBUG)
+    app.log.propagate = False
+
+    resultados = []
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        voo = criar_voo_temporario(conn)
+        capacidade = conn.execute(
+            "SELECT capacidade FROM lotacao_voo WHERE voo_id = %(voo)s AND NOT prim_classe;", {"voo": voo}
+        ).fetchone().capacidade
+        print(f"flight {voo}: {capacidade} second-class seats, {args.threads} threads", flush=True)
+        try:
+            for modo in args.modos.split(","):
+                latencias, codigos, pelo_check, segundos, a_mais = [], {}, 0, 0.0, 0
+                conflitos.n = 0
+                for _ in range(args.rondas):
+                    apagar_vendas(conn, voo)
+                    lat, cod, check, seg = ronda(app, voo, modo, args.threads)
+                    latencias += lat
+                    for status, n in cod.items():
+                        codigos[status] = codigos.get(status, 0) + n
+                    pelo_check += check
+                    segundos += seg
+                    vendidos = conn.execute(
+                        "SELECT COUNT(*) AS n FROM bilhete WHERE voo_id = %(voo)s AND NOT prim_classe;", {"voo": voo}
+                    ).fetchone().n
+                    a_mais += max(vendidos - capacidade, 0)
+                repetidas = conflitos.n
+                apagar_vendas(conn, voo)
+                vendas_a_mais, diferentes = idempotencia(app, voo, modo, args.threads, args.chaves)
+                apagar_vendas(conn, voo)
+                resultados.append(
+                    (modo, latencias, codigos, pelo_check, segundos, a_mais, repetidas, vendas_a_mais, diferentes)
+                )
+                print(f"{modo}: done", flush=True)
+        finally:
+            apagar_vendas(conn, voo, apagar_voo=True)
+
+    print(
+        f"\n{'mode':<14}{'buys/s':>8}{'p50 ms':>8}{'p99 ms':>8}{'200':>7}{'400':>6}{'by CHECK':>9}"
+        f"{'500':>6}{'503':>6}{'retries':>8}{'oversold':>9}{'dup sales':>10}{'diff resp':>10}"
+    )
+    for modo, latencias, codigos, pelo_check, segundos, a_mais, repetidas, vendas_a_mais, diferentes in resultados:
+        print(
+            f"{modo:<14}{codigos.get(200, 0) / segundos:>8.0f}{percentil(latencias, 50) * 1000:>8.2f}"
+            f"{percentil(latencias, 99) * 1000:>8.2f}{codigos.get(200, 0):>7}{codigos.get(400, 0):>6}{pelo_check:>9}"
+            f"{codigos.get(500, 0):>6}{codigos.get(503, 0):>6}{repetidas:>8}{a_mais:>9}{vendas_a_mais:>10}"
+            f"{diferentes:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Custo de manter estatisticas_voos: vista materializada antiga vs tabela incremental.
+
+    python bench/estatisticas.py
+    python bench/estatisticas.py --carregar data/populate.sql --timeout 600
+
+Mede, sobre os dados carregados:
+  - REFRESH da vista materializada original (dois LEFT JOIN a bilhete e dois a
+    assento por voo), interrompido ao fim de --timeout segundos;
+  - REFRESH de uma vista materializada com a definição sem multiplicação de
+    linhas (estatisticas_voos_esperada);
+  - recálculo completo da tabela com recalcular_estatisticas_voos();
+  - custo por bilhete vendido dos triggers que mantêm a tabela, comparando
+    inserções com e sem trg_estatisticas_bilhete.
+Tudo corre em transações desfeitas no fim, sem alterar a base de dados.
+Para o conjunto 10x, carregue um populate.sql gerado com mais bilhetes.
+"""
+import argparse
+import time
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, carregar, criar_voo_temporario
+
+# definição da vista materializada do relatório (E2-report-62.ipynb, antes da tabela incremental)
+VISTA_ANTIGA = """
+SELECT
+    v.no_serie,
+    v.hora_partida,
+    a1.cidade AS cidade_partida,
+    a1.pais AS pais_partida,
+    a2.cidade AS cidade_chegada,
+    a2.pais AS pais_chegada,
+    EXTRACT(YEAR FROM v.hora_partida) AS ano,
+    EXTRACT(MONTH FROM v.hora_partida) AS mes,
+    EXTRACT(DAY FROM v.hora_partida) AS dia_do_mes,
+    TRIM(TO_CHAR(v.hora_partida, 'Day')) AS dia_da_semana,
+    COUNT(DISTINCT b1.id) AS passageiros_1c,
+    COUNT(DISTINCT b2.id) AS passageiros_2c,
+    COUNT(DISTINCT s1.lugar) AS assentos_1c,
+    COUNT(DISTINCT s2.lugar) AS assentos_2c,
+    SUM(b1.preco) AS vendas_1c,
+    SUM(b2.preco) AS vendas_2c
+FROM voo v
+INNER JOIN aeroporto a1 ON a1.codigo = v.partida
+INNER JOIN aeroporto a2 ON a2.codigo = v.chegada
+LEFT JOIN bilhete b1 ON b1.voo_id = v.id AND b1.prim_classe
+LEFT JOIN bilhete b2 ON b2.voo_id = v.id AND NOT b2.prim_classe
+LEFT JOIN assento s1 ON s1.no_serie = v.no_serie AND s1.prim_classe
+LEFT JOIN assento s2 ON s2.no_serie = v.no_serie AND NOT s2.prim_classe
+GROUP BY
+    v.no_serie, v.hora_partida,
+    a1.cidade, a1.pais,
+    a2.cidade, a2.pais
+"""
+
+
+def cronometrar(conn, comandos, timeout=None):
+    """Segundos que demora o último comando (os anteriores preparam), ou None se exceder o timeout."""
+    try:
+        with conn.transaction(force_rollback=True):
+            if timeout:
+                conn.execute(f"SET LOCAL statement_timeout = '{int(timeout)}s';")
+            for comando in comandos[:-1]:
+                conn.execute(comando)
+            inicio = time.perf_counter()
+            conn.execute(comandos[-1])
+            return time.perf_counter() - inicio
+    except psycopg.errors.QueryCanceled:
+        return None
+
+
+def custo_por_bilhete(conn, com_trigger):
+    """Segundos por bilhete a inserir, um a um, os bilhetes de 2a classe de um voo novo."""
+    with conn.transaction(force_rollback=True):
+        if not com_trigger:
+            conn.execute("ALTER TABLE bilhete DISABLE TRIGGER trg_estatisticas_bilhete;")
+        voo = criar_voo_temporario(conn)
+        capacidade = conn.execute(
+            "SELECT capacidade FROM lotacao_voo WHERE voo_id = %(voo)s AND NOT prim_classe;",
+            {"voo": voo},
+        ).fetchone().capacidade
+        venda = conn.execute(
+            "INSERT INTO venda (nif_cliente, hora) VALUES ('123456789', NOW()) RETURNING codigo_reserva;"
+        ).fetchone().codigo_reserva
+        inicio = time.perf_counter()
+        for i in range(capacidade):
+            conn.execute(
+                "INSERT INTO bilhete (voo_id, hora_partida, codigo_reserva, nome_passageiro, preco, prim_classe) "
+                "VALUES (%(voo)s, (SELECT hora_partida FROM voo WHERE id = %(voo)s), %(venda)s, %(nome)s, 100, FALSE);",
+                {"voo": voo, "venda": venda, "nome": f"Passageiro {i}"},
+            )
+        return (time.perf_counter() - inicio) / max(capacidade, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carregar", nargs="*", metavar="FICHEIRO", help="recria o esquema e carrega estes ficheiros")
+    parser.add_argument("--timeout", type=float, default=300, help="segundos até desistir do REFRESH da vista antiga")
+    args = parser.parse_args()
+
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        if args.carregar is not None:
+            carregar(conn, args.carregar)
+        conn.execute("ANALYZE;")
+        volume = conn.execute("SELECT (SELECT COUNT(*) FROM voo) AS voos, (SELECT COUNT(*) FROM bilhete) AS bilhetes;").fetchone()
+        print(f"{volume.voos} flights, {volume.bilhetes} tickets")
+
+        antiga = cronometrar(
+            conn,
+            [
+                f"CREATE MATERIALIZED VIEW estatisticas_voos_antiga AS {VISTA_ANTIGA} WITH NO DATA;",
+                "REFRESH MATERIALIZED VIEW estatisticas_voos_antiga;",
+            ],
+            args.timeout,
+        )
+        sem_multiplicacao = cronometrar(
+            conn,
+            [
+                "CREATE MATERIALIZED VIEW estatisticas_voos_mv AS SELECT * FROM estatisticas_voos_esperada WITH NO DATA;",
+                "REFRESH MATERIALIZED VIEW estatisticas_voos_mv;",
+            ],
+        )
+        recalculo = cronometrar(conn, ["SELECT recalcular_estatisticas_voos();"])
+        com = custo_por_bilhete(conn, com_trigger=True)
+        sem = custo_por_bilhete(conn, com_trigger=False)
+
+    print(f"{'old materialized view refresh':<36}{f'> {args.timeout:.0f} s' if antiga is None else f'{antiga:.2f} s':>12}")
+    print(f"{'fan-out-free materialized view':<36}{sem_multiplicacao:>10.2f} s")
+    print(f"{'full recalcular_estatisticas_voos()':<36}{recalculo:>10.2f} s")
+    print(f"{'incremental, per ticket sold':<36}{(com - sem) * 1e6:>9.0f} us  ({sem * 1e6:.0f} -> {com * 1e6:.0f} us per insert)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""Restrições de integridade dos bilhetes: triggers por linha contra triggers
+por comando (tabelas de transição) em data/aviacao.sql.
+
+    python bench/integridade.py --bilhetes 100,1000,5000
+
+- linha: os triggers FOR EACH ROW das notas do esquema (trg_checkin_bilhete,
+  trg_limite_bilhetes_classe e trg_venda_hora, com os erros de sintaxe
+  corrigidos e a hora_partida do bilhete) e o trg_lotacao_bilhete anterior, um UPDATE de lotacao_voo por
+  bilhete;
+- comando: trg_ri_bilhete (RI-1 e RI-3) e trg_lotacao_bilhete (RI-2, pelo
+  CHECK de lotacao_voo), uma vez por comando.
+
+Primeiro confirma que as duas versões rejeitam as mesmas violações e aceitam os
+mesmos comandos válidos (sai com código 1 se não); depois mede um INSERT de
+--bilhetes bilhetes repartidos por voos futuros e o check-in de todos eles num
+UPDATE, e sai com código 1 se, no maior número de bilhetes, a versão por
+comando demorar mais do que --tolerancia vezes a por linha. Tudo corre em
+transações desfeitas no fim: a base de dados não muda.
+"""
+import argparse
+import sys
+import time
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, percentil
+
+# triggers por linha das notas no fim de aviacao.sql e o trg_lotacao_bilhete anterior
+LINHA = """
+DROP TRIGGER trg_lotacao_bilhete_insert ON bilhete;
+DROP TRIGGER trg_lotacao_bilhete_update ON bilhete;
+DROP TRIGGER trg_lotacao_bilhete_delete ON bilhete;
+DROP TRIGGER trg_ri_bilhete_insert ON bilhete;
+DROP TRIGGER trg_ri_bilhete_update ON bilhete;
+
+CREATE FUNCTION trg_lotacao_bilhete_linha() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.voo_id IS NOT DISTINCT FROM NEW.voo_id
+       AND OLD.prim_classe = NEW.prim_classe THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE lotacao_voo SET vendidos = vendidos - 1
+        WHERE voo_id = OLD.voo_id AND prim_classe = OLD.prim_classe;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE lotacao_voo SET vendidos = vendidos + 1
+        WHERE voo_id = NEW.voo_id AND prim_classe = NEW.prim_classe;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_lotacao_bilhete
+AFTER INSERT OR DELETE OR UPDATE OF voo_id, prim_classe ON bilhete
+FOR EACH ROW EXECUTE FUNCTION trg_lotacao_bilhete_linha();
+
+CREATE FUNCTION trg_checkin_bilhete() RETURNS TRIGGER AS $$
+DECLARE
+    v_assento assento%ROWTYPE;
+    v_voo_no_serie voo.no_serie%TYPE;
+BEGIN
+    IF NEW.lugar IS NOT NULL AND NEW.no_serie IS NOT NULL THEN
+        SELECT * INTO v_assento FROM assento WHERE lugar = NEW.lugar AND no_serie = NEW.no_serie;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Assento % no aviao % nao existe.', NEW.lugar, NEW.no_serie;
+        END IF;
+        SELECT no_serie INTO v_voo_no_serie FROM voo WHERE id = NEW.voo_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'Voo com id % nao foi encontrado.', NEW.voo_id;
+        END IF;
+        IF v_assento.prim_classe IS DISTINCT FROM NEW.prim_classe THEN
+            RAISE EXCEPTION 'Classe do bilhete NAO corresponde à classe do assento.';
+        END IF;
+        IF v_assento.no_serie IS DISTINCT FROM v_voo_no_serie THEN
+            RAISE EXCEPTION 'Aviao do assento NAO corresponde ao aviao do voo.';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_bilhete_checkin
+BEFORE INSERT OR UPDATE OF lugar, no_serie, prim_classe ON bilhete
+FOR EACH ROW EXECUTE FUNCTION trg_checkin_bilhete();
+
+CREATE FUNCTION trg_limite_bilhetes_classe() RETURNS TRIGGER AS $$
+DECLARE
+    v_capacidade INTEGER;
+    v_vendidos INTEGER;
+    v_no_serie VARCHAR(80);
+BEGIN
+    SELECT no_serie INTO v_no_serie FROM voo WHERE id = NEW.voo_id;
+    SELECT COUNT(*) INTO v_capacidade FROM assento
+    WHERE no_serie = v_no_serie AND prim_classe = NEW.prim_classe;
+    SELECT COUNT(*) INTO v_vendidos FROM bilhete
+    WHERE voo_id = NEW.voo_id AND prim_classe = NEW.prim_classe
+        AND (id <> NEW.id OR NEW.id IS NULL);
+    IF v_vendidos + 1 > v_capacidade THEN
+        RAISE EXCEPTION 'Capacidade de bilhetes para a classe % do voo % excedida.', NEW.prim_classe, NEW.voo_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_limite_bilhetes_classe
+BEFORE INSERT OR UPDATE OF prim_classe, voo_id ON bilhete
+FOR EACH ROW EXECUTE FUNCTION trg_limite_bilhetes_classe();
+
+CREATE FUNCTION trg_venda_hora() RETURNS TRIGGER AS $$
+DECLARE
+    v_hora_partida TIMESTAMP;
+    v_hora_venda TIMESTAMP;
+BEGIN
+    SELECT hora INTO v_hora_venda FROM venda WHERE codigo_reserva = NEW.codigo_reserva;
+    SELECT hora_partida INTO v_hora_partida FROM voo WHERE id = NEW.voo_id;
+    IF v_hora_venda >= v_hora_partida THEN
+        RAISE EXCEPTION 'Hora da venda (%) não pode ser posterior ou igual à hora de partida do voo (%).',
+            v_hora_venda, v_hora_partida;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_venda_hora
+BEFORE INSERT OR UPDATE OF codigo_reserva, voo_id, hora_partida ON bilhete
+FOR EACH ROW EXECUTE FUNCTION trg_venda_hora();
+"""
+
+VERSOES = {"linha": LINHA, "comando": ""}
+
+# voos futuros com lugares livres, pelos quais se repartem os bilhetes inseridos
+VOOS = """
+SELECT l.voo_id, l.capacidade - l.vendidos AS livres
+FROM lotacao_voo l JOIN voo v ON v.id = l.voo_id
+WHERE NOT l.prim_classe AND v.hora_partida > NOW() AND l.vendidos < l.capacidade
+ORDER BY v.hora_partida;
+"""
+
+# um bilhete de segunda classe por lugar livre de cada voo, até <n>, numa venda nova
+INSERIR = """
+WITH venda_nova AS (
+    INSERT INTO venda (nif_cliente, balcao, hora) VALUES ('999999992', NULL, NOW())
+    RETURNING codigo_reserva
+), lugares AS (
+    SELECT voo_id, n FROM UNNEST(%(voos)s::INTEGER[]) WITH ORDINALITY AS t(voo_id, ordem),
+        LATERAL generate_series(1, %(por_voo)s[ordem]) AS n
+)
+INSERT INTO bilhete (voo_id, hora_partida, codigo_reserva, nome_passageiro, preco, prim_classe)
+SELECT l.voo_id, vo.hora_partida, v.codigo_reserva, 'Integridade ' || l.n, 100, FALSE
+FROM lugares l JOIN voo vo ON vo.id = l.voo_id, venda_nova v
+RETURNING id;
+"""
+
+# check-in de todos os bilhetes inseridos: o k-ésimo bilhete de cada voo no k-ésimo lugar livre
+CHECKIN = """
+WITH b AS (
+    SELECT id, voo_id, ROW_NUMBER() OVER (PARTITION BY voo_id ORDER BY id) AS k
+    FROM bilhete WHERE id = ANY(%(bilhetes)s)
+), l AS (
+    SELECT al.voo_id, al.lugar, v.no_serie, ROW_NUMBER() OVER (PARTITION BY al.voo_id ORDER BY al.lugar) AS k
+    FROM assento_livre al JOIN voo v ON v.id = al.voo_id
+    WHERE al.voo_id IN (SELECT voo_id FROM b) AND NOT al.prim_classe
+)
+UPDATE bilhete SET lugar = l.lugar, no_serie = l.no_serie
+FROM b JOIN l USING (voo_id, k)
+WHERE bilhete.id = b.id;
+"""
+
+
+def casos(cur):
+    """Comandos de teste: (nome, SQL, parâmetros, deve ser rejeitado)."""
+    voo = cur.execute(VOOS).fetchone().voo_id
+    cheio = cur.execute(
+        """
+        SELECT l.voo_id, l.capacidade - l.vendidos AS livres FROM lotacao_voo l JOIN voo v ON v.id = l.voo_id
+        WHERE l.prim_classe AND v.hora_partida > NOW() ORDER BY v.hora_partida LIMIT 1;
+        """
+    ).fetchone()
+    bilhete = cur.execute(
+        """
+        SELECT b.id, b.voo_id, b.prim_classe, v.no_serie FROM bilhete b JOIN voo v ON v.id = b.voo_id
+        WHERE b.lugar IS NULL AND NOT b.prim_classe AND v.hora_partida > NOW() LIMIT 1;
+        """
+    ).fetchone()
+    # lugares do avião por ocupar no voo do bilhete (o check-in válido não pode dar um lugar já dado)
+    lugar = cur.execute(
+        """
+        SELECT a.lugar, a.prim_classe FROM assento a
+        WHERE a.no_serie = %(no_serie)s
+        AND NOT EXISTS (SELECT 1 FROM bilhete o WHERE o.voo_id = %(voo)s AND o.lugar = a.lugar)
+        ORDER BY a.prim_classe, a.lugar;
+        """,
+        {"no_serie": bilhete.no_serie, "voo": bilhete.voo_id},
+    ).fetchall()
+    segunda = next(a.lugar for a in lugar if not a.prim_classe)
+    primeira = next(a.lugar for a in lugar if a.prim_classe)
+    outro = cur.execute(
+        "SELECT lugar, no_serie FROM assento WHERE no_serie <> %(no_serie)s AND NOT prim_classe LIMIT 1;",
+        {"no_serie": bilhete.no_serie},
+    ).fetchone()
+    a_mover = cur.execute(
+        "SELECT COUNT(*) AS n FROM bilhete WHERE voo_id = %(voo)s AND NOT prim_classe AND lugar IS NULL;",
+        {"voo": cheio.voo_id},
+    ).fetchone().n
+    partida = cur.execute("SELECT hora_partida FROM voo WHERE id = %(voo)s;", {"voo": voo}).fetchone().hora_partida
+    venda_tardia = """
+        WITH v AS (
+            INSERT INTO venda (nif_cliente, balcao, hora) VALUES ('999999992', NULL, %(hora)s) RETURNING codigo_reserva
+        )
+        INSERT INTO bilhete (voo_id, hora_partida, codigo_reserva, nome_passageiro, preco, prim_classe)
+        SELECT %(voo)s, (SELECT hora_partida FROM voo WHERE id = %(voo)s), codigo_reserva, 'Tardio', 100, FALSE FROM v;
+    """
+    mudar_venda = """
+        WITH v AS (
+            INSERT INTO venda (nif_cliente, balcao, hora) VALUES ('999999992', NULL, %(hora)s) RETURNING codigo_reserva
+        )
+        UPDATE bilhete SET codigo_reserva = v.codigo_reserva FROM v WHERE bilhete.id = %(bilhete)s;
+    """
+    # o voo passa a partir à hora da sua última venda; a hora_partida dos bilhetes muda em cascata
+    antecipar_voo = """
+        UPDATE voo SET hora_partida = x.hora, hora_chegada = x.hora + INTERVAL '2 hours'
+        FROM (
+            SELECT MAX(ve.hora) AS hora FROM bilhete b JOIN venda ve USING (codigo_reserva) WHERE b.voo_id = %(voo)s
+        ) x
+        WHERE voo.id = %(voo)s;
+    """
+    checkin = "UPDATE bilhete SET lugar = %(lugar)s, no_serie = %(no_serie)s WHERE id = %(bilhete)s;"
+    return [
+        ("RI-1 valid check-in", checkin, {"lugar": segunda, "no_serie": bilhete.no_serie, "bilhete": bilhete.id}, False),
+        (
+            "RI-1 first-class seat, second-class ticket",
+            checkin,
+            {"lugar": primeira, "no_serie": bilhete.no_serie, "bilhete": bilhete.id},
+            True,
+        ),
+        (
+            "RI-1 seat of another aircraft",
+            checkin,
+            {"lugar": outro.lugar, "no_serie": outro.no_serie, "bilhete": bilhete.id},
+            True,
+        ),
+        (
+            "RI-2 fill first class",
+            INSERIR.replace("FALSE\nFROM", "TRUE\nFROM"),
+            {"voos": [cheio.voo_id], "por_voo": [cheio.livres]},
+            False,
+        ),
+        (
+            "RI-2 first class plus one",
+            INSERIR.replace("FALSE\nFROM", "TRUE\nFROM"),
+            {"voos": [cheio.voo_id], "por_voo": [cheio.livres + 1]},
+            True,
+        ),
+        (
+            "RI-2 move tickets to a full class",
+            "UPDATE bilhete SET prim_classe = TRUE WHERE voo_id = %(voo)s AND NOT prim_classe AND lugar IS NULL;",
+            {"voo": cheio.voo_id},
+            # a primeira classe ficou cheia com "RI-2 fill first class"; o bilhete do check-in já não conta
+            a_mover - (bilhete.voo_id == cheio.voo_id) > 0,
+        ),
+        ("RI-3 sale before departure", venda_tardia, {"voo": voo, "hora": partida.replace(year=partida.year - 1)}, False),
+        ("RI-3 sale at departure", venda_tardia, {"voo": voo, "hora": partida}, True),
+        (
+            "RI-3 move ticket to a sale at departure",
+            mudar_venda,
+            {"bilhete": bilhete.id, "hora": cur.execute(
+                "SELECT hora_partida FROM voo WHERE id = %(voo)s;", {"voo": bilhete.voo_id}
+            ).fetchone().hora_partida},
+            True,
+        ),
+        ("RI-3 move a flight to its last sale", antecipar_voo, {"voo": bilhete.voo_id}, True),
+    ]
+
+
+def verificar(conn):
+    """Corre os casos em cada versão; devolve a lista de (caso, versão, rejeitado, esperado)."""
+    resultados = []
+    for versao, ddl in VERSOES.items():
+        with conn.transaction(force_rollback=True):
+            if ddl:
+                conn.execute(ddl)
+            with conn.cursor() as cur:
+                for nome, sql, params, rejeitar in casos(cur):
+                    try:
+                        with conn.transaction():
+                            cur.execute(sql, params)
+                        rejeitado = False
+                    # os triggers das notas usam RAISE EXCEPTION simples, os novos check_violation
+                    except (psycopg.errors.RaiseException, psycopg.errors.IntegrityError):
+                        rejeitado = True
+                    resultados.append((nome, versao, rejeitado, rejeitar))
+    return resultados
+
+
+def medir(conn, ddl, n):
+    """Segundos do INSERT de <n> bilhetes e do check-in de todos eles."""
+    # as linhas das repetições anteriores, desfeitas, pesariam na seguinte
+    conn.execute("VACUUM bilhete, venda, lotacao_voo, assento_livre;")
+    with conn.transaction(force_rollback=True):
+        if ddl:
+            conn.execute(ddl)
+        voos, por_voo, falta = [], [], n
+        for r in conn.execute(VOOS):
+            if falta <= 0:
+                break
+            voos.append(r.voo_id)
+            por_voo.append(min(r.livres, falta))
+            falta -= por_voo[-1]
+        if falta > 0:
+            sys.exit(f"Not enough free second-class seats on future flights for {n} tickets.")
+        inicio = time.perf_counter()
+        bilhetes = [r.id for r in conn.execute(INSERIR, {"voos": voos, "por_voo": por_voo})]
+        insercao = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        conn.execute(CHECKIN, {"bilhetes": bilhetes})
+        return insercao, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bilhetes", default="100,1000,5000")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument(
+        "--tolerancia", type=float, default=1.25, help="razão máxima comando/linha dos tempos no maior --bilhetes"
+    )
+    args = parser.parse_args()
+
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        if conn.execute(VOOS).fetchone() is None:
+            sys.exit("No future flights with free seats; load data generated with gerador.py --inicio/--fim.")
+        resultados = verificar(conn)
+        print(f"{'case':<45}{'linha':>10}{'comando':>10}{'expected':>10}")
+        falhas = 0
+        for nome in dict.fromkeys(r[0] for r in resultados):
+            linha, comando = (
+                next(r for r in resultados if r[0] == nome and r[1] == versao) for versao in ("linha", "comando")
+            )
+            esperado = linha[3]
+            falhas += linha[2] != esperado or comando[2] != esperado
+
+            def texto(rejeitado):
+                return "rejected" if rejeitado else "accepted"
+
+            print(f"{nome:<45}{texto(linha[2]):>10}{texto(comando[2]):>10}{texto(esperado):>10}")
+        if falhas:
+            sys.exit(f"{falhas} case(s) differ from the expected result.")
+
+        print(f"\n{'tickets':>8}  {'version':<9}{'INSERT ms':>11}{'check-in ms':>13}")
+        for n in sorted(int(x) for x in args.bilhetes.split(",")):
+            tempos = {versao: ([], []) for versao in VERSOES}
+            # versões alternadas, para nenhuma ficar sempre com a base de dados mais fria ou mais quente
+            for _ in range(args.repeticoes):
+                for versao, ddl in VERSOES.items():
+                    insercao, checkin = medir(conn, ddl, n)
+                    tempos[versao][0].append(insercao)
+                    tempos[versao][1].append(checkin)
+            for versao, (insercoes, checkins) in tempos.items():
+                print(
+                    f"{n:>8}  {versao:<9}{percentil(insercoes, 50) * 1000:>11.1f}"
+                    f"{percentil(checkins, 50) * 1000:>13.1f}",
+                    flush=True,
+                )
+
+        # com poucos bilhetes pesa o custo fixo de cada comando; só o maior conta
+        lentos = [
+            f"{operacao} {percentil(comando, 50) * 1000:.1f} ms > "
+            f"{args.tolerancia} x {percentil(linha, 50) * 1000:.1f} ms"
+            for operacao, linha, comando in zip(("INSERT", "check-in"), tempos["linha"], tempos["comando"])
+            if percentil(comando, 50) > args.tolerancia * percentil(linha, 50)
+        ]
+        if lentos:
+            sys.exit(f"Statement-level triggers slower than row-level ones at {n} tickets: {'; '.join(lentos)}.")
+
+
+if __name__ == "__main__":
+    main()
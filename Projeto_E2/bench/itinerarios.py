@@ -0,0 +1,176 @@
+"""Procura de itinerários com escalas: o grafo de horários em memória de
+app/rotas.py contra autojunções de voo em SQL, à medida que crescem o número
+de aeroportos e de voos por dia.
+
+    python bench/itinerarios.py --aeroportos 10,50,200 --voos-dia 10,40,160
+    python bench/itinerarios.py --sem-sql
+
+Para cada combinação gera um horário sintético (--voos-dia partidas por dia de
+cada aeroporto para destinos aleatórios, durante --dias dias), carrega-o no
+GrafoHorarios e mede a latência de --procuras procuras entre pares de
+aeroportos aleatórios, com até 2 escalas e os 3 itinerários que chegam mais
+cedo. O mesmo horário vai para uma tabela temporária com os índices de voo,
+onde a mesma procura é uma consulta com autojunções (interrompida ao fim de
+--timeout segundos); conta-se também em quantas procuras os dois dão os mesmos
+itinerários. Não usa as tabelas da base de dados.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import APP_DIR, DATABASE_URL, percentil
+
+sys.path.insert(0, APP_DIR)
+from rotas import GrafoHorarios, Voo  # noqa: E402
+
+LIGACAO_MIN = timedelta(minutes=45)
+LIGACAO_MAX = timedelta(hours=12)
+N = 3
+
+TABELA = """
+CREATE TEMP TABLE voo_sintetico (
+    id INTEGER PRIMARY KEY,
+    partida CHAR(3),
+    chegada CHAR(3),
+    hora_partida TIMESTAMP,
+    hora_chegada TIMESTAMP
+);
+"""
+
+# diretos, uma e duas escalas, pelos mesmos critérios de GrafoHorarios.procurar
+SQL = """
+SELECT voos, chegada FROM (
+    SELECT ARRAY[v1.id] AS voos, v1.hora_chegada AS chegada
+    FROM voo_sintetico v1
+    WHERE v1.partida = %(partida)s AND v1.chegada = %(chegada)s AND v1.hora_partida > %(desde)s
+    UNION ALL
+    SELECT ARRAY[v1.id, v2.id], v2.hora_chegada
+    FROM voo_sintetico v1
+    JOIN voo_sintetico v2 ON v2.partida = v1.chegada
+        AND v2.hora_partida BETWEEN v1.hora_chegada + %(minimo)s AND v1.hora_chegada + %(maximo)s
+    WHERE v1.partida = %(partida)s AND v1.hora_partida > %(desde)s
+        AND v1.chegada <> %(chegada)s AND v2.chegada = %(chegada)s
+    UNION ALL
+    SELECT ARRAY[v1.id, v2.id, v3.id], v3.hora_chegada
+    FROM voo_sintetico v1
+    JOIN voo_sintetico v2 ON v2.partida = v1.chegada
+        AND v2.hora_partida BETWEEN v1.hora_chegada + %(minimo)s AND v1.hora_chegada + %(maximo)s
+    JOIN voo_sintetico v3 ON v3.partida = v2.chegada
+        AND v3.hora_partida BETWEEN v2.hora_chegada + %(minimo)s AND v2.hora_chegada + %(maximo)s
+    WHERE v1.partida = %(partida)s AND v1.hora_partida > %(desde)s
+        AND v1.chegada <> %(chegada)s AND v2.chegada NOT IN (%(partida)s, %(chegada)s)
+        AND v3.chegada = %(chegada)s
+) t
+ORDER BY chegada, cardinality(voos)
+LIMIT %(n)s;
+"""
+
+
+def horario(aeroportos, voos_dia, dias, rng):
+    """Voos sintéticos a partir de 2030-01-01 entre <aeroportos> códigos."""
+    codigos = [f"{chr(65 + i // 676)}{chr(65 + i // 26 % 26)}{chr(65 + i % 26)}" for i in range(aeroportos)]
+    inicio = datetime(2030, 1, 1)
+    voos = []
+    for partida in codigos:
+        for _ in range(voos_dia * dias):
+            chegada = rng.choice(codigos[:-1])
+            if chegada == partida:
+                chegada = codigos[-1]
+            hora = inicio + timedelta(minutes=rng.randrange(dias * 1440))
+            voos.append(Voo(len(voos) + 1, "SINT", partida, chegada, hora, hora + timedelta(minutes=rng.randint(45, 360))))
+    return codigos, voos, inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--aeroportos", default="10,50,200")
+    parser.add_argument("--voos-dia", default="10,40,160")
+    parser.add_argument("--dias", type=int, default=2)
+    parser.add_argument("--procuras", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--sem-sql", action="store_true", help="só o grafo, sem a base de dados")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    conn = None if args.sem_sql else psycopg.connect(DATABASE_URL, row_factory=namedtuple_row)
+    print(
+        f"{'airports':>8}{'flights/day':>12}{'flights':>9}{'load ms':>9}{'graph p50 ms':>13}{'graph p99 ms':>13}"
+        f"{'SQL p50 ms':>11}{'SQL p99 ms':>11}{'same':>6}"
+    )
+    try:
+        for aeroportos in (int(x) for x in args.aeroportos.split(",")):
+            for voos_dia in (int(x) for x in args.voos_dia.split(",")):
+                rng = random.Random(args.seed)
+                codigos, voos, inicio = horario(aeroportos, voos_dia, args.dias, rng)
+                grafo = GrafoHorarios(
+                    None, timedelta(days=args.dias), float("inf"), LIGACAO_MIN, LIGACAO_MAX
+                )
+                t = time.perf_counter()
+                grafo.carregar(voos, inicio, inicio + timedelta(days=args.dias))
+                carga = time.perf_counter() - t
+
+                pares = [rng.sample(codigos, 2) for _ in range(args.procuras)]
+                no_grafo, encontrados = [], []
+                for partida, chegada in pares:
+                    t = time.perf_counter()
+                    itinerarios = grafo.procurar(partida, chegada, inicio, 2, N)
+                    no_grafo.append(time.perf_counter() - t)
+                    encontrados.append([(it[-1].hora_chegada, len(it)) for it in itinerarios])
+
+                em_sql, iguais = [], 0
+                if conn is not None:
+                    with conn.transaction(force_rollback=True):
+                        conn.execute(TABELA)
+                        with conn.cursor().copy(
+                            "COPY voo_sintetico (id, partida, chegada, hora_partida, hora_chegada) FROM STDIN"
+                        ) as copia:
+                            for v in voos:
+                                copia.write_row((v.id, v.partida, v.chegada, v.hora_partida, v.hora_chegada))
+                        # os índices de voo usados pelas consultas de partidas e rotas
+                        conn.execute("CREATE INDEX ON voo_sintetico (partida, hora_partida);")
+                        conn.execute("CREATE INDEX ON voo_sintetico (partida, chegada, hora_partida);")
+                        conn.execute("ANALYZE voo_sintetico;")
+                        conn.execute(f"SET LOCAL statement_timeout = {int(args.timeout * 1000)};")
+                        for (partida, chegada), esperado in zip(pares, encontrados):
+                            t = time.perf_counter()
+                            try:
+                                with conn.transaction():
+                                    rows = conn.execute(
+                                        SQL,
+                                        {
+                                            "partida": partida,
+                                            "chegada": chegada,
+                                            "desde": inicio,
+                                            "minimo": LIGACAO_MIN,
+                                            "maximo": LIGACAO_MAX,
+                                            "n": N,
+                                        },
+                                    ).fetchall()
+                            except psycopg.errors.QueryCanceled:
+                                em_sql.append(float("inf"))
+                                continue
+                            em_sql.append(time.perf_counter() - t)
+                            iguais += [(r.chegada, len(r.voos)) for r in rows] == esperado
+
+                sql = (
+                    f"{percentil(em_sql, 50) * 1000:>11.2f}{percentil(em_sql, 99) * 1000:>11.2f}{iguais:>6}"
+                    if em_sql
+                    else f"{'-':>11}{'-':>11}{'-':>6}"
+                )
+                print(
+                    f"{aeroportos:>8}{voos_dia:>12}{len(voos):>9}{carga * 1000:>9.1f}"
+                    f"{percentil(no_grafo, 50) * 1000:>13.3f}{percentil(no_grafo, 99) * 1000:>13.3f}{sql}",
+                    flush=True,
+                )
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
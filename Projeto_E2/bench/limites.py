@@ -0,0 +1,116 @@
+"""Armazenamento dos limites de pedidos: custo de cada verificação e exatidão
+entre processos, memory:// (um contador por processo) contra mmap:// (um
+ficheiro partilhado, app/limites.py) e, com --redis, um servidor Redis.
+
+    python bench/limites.py
+    python bench/limites.py --processos 4 --redis redis://localhost:6379
+
+O custo é o de FixedWindowRateLimiter.hit(), o que o flask-limiter faz em
+cada pedido por cada limite, com chaves de --chaves clientes distintos. Na
+exatidão, --processos processos fazem hit() sem parar no mesmo limite de
+--limite pedidos por janela de 10 s durante --duracao segundos; o número de
+pedidos aceites devia ser --limite.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from comum import APP_DIR, percentil
+
+sys.path.insert(0, APP_DIR)
+import limites  # noqa: E402,F401 (regista mmap://)
+
+
+def custo(uri, chaves, pedidos):
+    """Latências (s) de cada hit() de "1 per second" numa de <chaves> chaves."""
+    limitador = FixedWindowRateLimiter(storage_from_string(uri))
+    item = parse("1 per second")
+    latencias = []
+    for i in range(pedidos):
+        cliente = f"10.0.{i % chaves // 256}.{i % 256}"
+        inicio = time.perf_counter()
+        limitador.hit(item, "voos_aeroporto", cliente)
+        latencias.append(time.perf_counter() - inicio)
+    return latencias
+
+
+def martelar(uri, limite, fim, aceites):
+    limitador = FixedWindowRateLimiter(storage_from_string(uri))
+    item = parse(f"{limite} per 10 seconds")
+    n = 0
+    while time.time() < fim:
+        n += limitador.hit(item, "voos_aeroporto", "127.0.0.1")
+    aceites.put(n)
+
+
+def exatidao(uri, processos, limite, duracao):
+    """Pedidos aceites no total por <processos> processos no mesmo limite."""
+    contexto = multiprocessing.get_context("fork")
+    aceites = contexto.Queue()
+    # a janela (10 s) começa no primeiro hit e cobre a medição toda
+    fim = time.time() + duracao
+    trabalhadores = [contexto.Process(target=martelar, args=(uri, limite, fim, aceites)) for _ in range(processos)]
+    for t in trabalhadores:
+        t.start()
+    total = sum(aceites.get() for _ in trabalhadores)
+    for t in trabalhadores:
+        t.join()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pedidos", type=int, default=200000)
+    parser.add_argument("--chaves", type=int, default=1000)
+    parser.add_argument("--processos", type=int, default=2)
+    parser.add_argument("--limite", type=int, default=1000)
+    parser.add_argument("--duracao", type=float, default=2.0)
+    parser.add_argument("--redis", help="URI de um servidor Redis a incluir")
+    args = parser.parse_args()
+
+    diretorio = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    ficheiros = []
+    armazenamentos = {"memory": lambda: "memory://"}
+
+    def mmap_novo():
+        fd, caminho = tempfile.mkstemp(prefix="bench-limites.", dir=diretorio)
+        os.close(fd)
+        ficheiros.append(caminho)
+        return f"mmap://{caminho}"
+
+    armazenamentos["mmap"] = mmap_novo
+    if args.redis:
+        armazenamentos["redis"] = lambda: args.redis
+
+    resultados = []
+    try:
+        for nome, uri in armazenamentos.items():
+            latencias = custo(uri(), args.chaves, args.pedidos)
+            if nome == "redis":
+                storage_from_string(args.redis).reset()
+            aceites = exatidao(uri(), args.processos, args.limite, args.duracao)
+            if nome == "redis":
+                storage_from_string(args.redis).reset()
+            resultados.append((nome, latencias, aceites))
+            print(f"{nome}: done", flush=True)
+    finally:
+        for caminho in ficheiros:
+            os.unlink(caminho)
+
+    print(f"\n{'storage':<10}{'hit() p50 us':>14}{'hit() p99 us':>14}{'accepted':>10}{'limit':>8}")
+    for nome, latencias, aceites in resultados:
+        print(
+            f"{nome:<10}{percentil(latencias, 50) * 1e6:>14.2f}{percentil(latencias, 99) * 1e6:>14.2f}"
+            f"{aceites:>10}{args.limite:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
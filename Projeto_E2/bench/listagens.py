@@ -0,0 +1,110 @@
+"""Memória e tempo até ao primeiro byte das listagens, por número de linhas:
+resposta completa (GET /, jsonify de toda a lista em cache) contra uma página
+keyset (?por_pagina=) e o stream a partir de um cursor do servidor (?stream=1).
+
+    python bench/listagens.py --linhas 1000,5000,17000
+
+Acrescenta aeroportos temporários até cada número de linhas (há no máximo
+17576 códigos de três letras) e apaga-os no fim. Os pedidos correm no cliente
+de teste do Flask, neste processo; o pico de memória é o do tracemalloc
+durante o pedido, com a cache já carregada, e o corpo em stream é lido e
+descartado bloco a bloco, como faria o servidor ao escrevê-lo no socket.
+"""
+import argparse
+import itertools
+import os
+import string
+import time
+import tracemalloc
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, importar_app, percentil
+
+MODOS = {
+    "full": "/",
+    "page": "/?por_pagina=1000",
+    "stream": "/?stream=1",
+}
+
+
+def pedir(cliente, url):
+    """Faz o pedido e lê o corpo bloco a bloco; devolve (segundos até ao primeiro bloco, total, bytes)."""
+    inicio = time.perf_counter()
+    resposta = cliente.get(url, buffered=False)
+    primeiro = None
+    tamanho = 0
+    for bloco in resposta.response:
+        if primeiro is None:
+            primeiro = time.perf_counter() - inicio
+        tamanho += len(bloco)
+    resposta.close()
+    assert resposta.status_code == 200, resposta.status_code
+    return primeiro, time.perf_counter() - inicio, tamanho
+
+
+def pico(cliente, url):
+    """Pico de memória (bytes) alocada pelo pedido, segundo o tracemalloc."""
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    pedir(cliente, url)
+    _, maximo = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return maximo - base
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", default="1000,5000,17000")
+    parser.add_argument("--repeticoes", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["FLASK_RATELIMIT_ENABLED"] = "false"
+    app = importar_app()
+    cliente = app.app.test_client()
+
+    resultados = []
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        existentes = {r.codigo for r in conn.execute("SELECT codigo FROM aeroporto;")}
+        livres = (
+            "".join(c) for c in itertools.product(string.ascii_uppercase, repeat=3) if "".join(c) not in existentes
+        )
+        temporarios = []
+        try:
+            for linhas in sorted(int(n) for n in args.linhas.split(",")):
+                novos = list(itertools.islice(livres, max(linhas - len(existentes) - len(temporarios), 0)))
+                with conn.cursor().copy("COPY aeroporto (codigo, nome, cidade, pais) FROM STDIN") as copy:
+                    for codigo in novos:
+                        copy.write_row((codigo, f"Aeroporto {codigo}", f"Cidade {codigo}", "Bench"))
+                temporarios += novos
+                # a invalidação da cache chega por NOTIFY
+                time.sleep(0.5)
+                total = len(existentes) + len(temporarios)
+                for modo, url in MODOS.items():
+                    pedir(cliente, url)
+                    tempos = [pedir(cliente, url) for _ in range(args.repeticoes)]
+                    resultados.append(
+                        (
+                            total,
+                            modo,
+                            pico(cliente, url),
+                            percentil([t[0] for t in tempos], 50),
+                            percentil([t[1] for t in tempos], 50),
+                            tempos[0][2],
+                        )
+                    )
+                print(f"{total} rows: done", flush=True)
+        finally:
+            conn.execute("DELETE FROM aeroporto WHERE codigo = ANY(%(codigos)s);", {"codigos": temporarios})
+
+    print(f"\n{'rows':>6}  {'mode':<8}{'peak KiB':>10}{'TTFB ms':>10}{'total ms':>10}{'body KiB':>10}")
+    for total, modo, memoria, primeiro, tempo, tamanho in resultados:
+        print(
+            f"{total:>6}  {modo:<8}{memoria / 1024:>10.0f}{primeiro * 1000:>10.2f}"
+            f"{tempo * 1000:>10.2f}{tamanho / 1024:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
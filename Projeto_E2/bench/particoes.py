@@ -0,0 +1,154 @@
+"""Latência dos endpoints com o histórico de voos e bilhetes a crescer, com as
+partições mensais todas ligadas e depois de arquivar os meses já terminados.
+
+    python bench/particoes.py
+    python bench/particoes.py --anos 1,2,5 --repeticoes 500
+
+Para cada número de anos de histórico, recria a base de dados em DATABASE_URL
+com data/aviacao.sql e gerador.py --carregar, com voos de há <anos> anos até
+daqui a --futuro dias e o mesmo número de bilhetes por dia (--bilhetes-dia),
+e mede no cliente de teste do Flask o p50/p99 de GET /voos/<partida>/<chegada>/,
+POST /compra/<voo>/ (um passageiro) e POST /checkin/<bilhete>. Depois arquiva os
+meses anteriores ao atual com arquivar_particoes() e volta a medir. Com a
+exclusão de partições, as consultas aos voos por partir não devem depender do
+histórico. A base de dados fica com os dados do último cenário.
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, GERADOR, carregar, importar_app, percentil
+
+
+def recriar(anos, futuro, bilhetes_dia):
+    """Recria a base de dados com <anos> anos de histórico e <futuro> dias de voos por partir."""
+    inicio = date.today() - timedelta(days=round(365 * anos))
+    fim = date.today() + timedelta(days=futuro)
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        carregar(conn, [])
+    comeco = time.perf_counter()
+    subprocess.run(
+        [
+            sys.executable, GERADOR,
+            "--inicio", inicio.isoformat(),
+            "--fim", fim.isoformat(),
+            "--bilhetes", str(bilhetes_dia * ((fim - inicio).days + 1)),
+            "--carregar", DATABASE_URL,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    print(f"Loaded {inicio} to {fim} in {time.perf_counter() - comeco:.1f} s")
+    # sem o autovacuum e as hint bits das linhas acabadas de carregar a meio das medições
+    with psycopg.connect(DATABASE_URL, autocommit=True) as conn:
+        conn.execute("VACUUM ANALYZE;")
+
+
+def amostras(conn, n):
+    """Rotas, voos com lugares de segunda classe livres e bilhetes sem lugar, todos por partir."""
+    rotas = conn.execute(
+        "SELECT DISTINCT partida, chegada FROM voo WHERE hora_partida > NOW() LIMIT %(n)s;", {"n": n}
+    ).fetchall()
+    voos = [
+        r.voo_id
+        for r in conn.execute(
+            """
+            SELECT l.voo_id FROM lotacao_voo l JOIN voo v ON v.id = l.voo_id
+            WHERE NOT l.prim_classe AND l.capacidade - l.vendidos > 10 AND v.hora_partida > NOW() + INTERVAL '1 day'
+            LIMIT %(n)s;
+            """,
+            {"n": n},
+        )
+    ]
+    bilhetes = [
+        r.id
+        for r in conn.execute(
+            "SELECT id FROM bilhete WHERE lugar IS NULL AND hora_partida > NOW() + INTERVAL '1 day' LIMIT %(n)s;",
+            {"n": n},
+        )
+    ]
+    return rotas, voos, bilhetes
+
+
+def medir(cliente, pedidos):
+    """Tempos (s) de cada pedido (método, url, json); falha se algum não der 200."""
+    tempos = []
+    for metodo, url, corpo in pedidos:
+        inicio = time.perf_counter()
+        resposta = cliente.open(url, method=metodo, json=corpo)
+        tempos.append(time.perf_counter() - inicio)
+        assert resposta.status_code == 200, (url, resposta.status_code, resposta.get_json())
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--anos", default="1,5", help="anos de histórico de cada cenário")
+    parser.add_argument("--futuro", type=int, default=60, help="dias de voos por partir")
+    parser.add_argument("--bilhetes-dia", type=int, default=190, help="bilhetes por dia de voos (~40k em 7 meses)")
+    parser.add_argument("--repeticoes", type=int, default=300)
+    parser.add_argument("--aquecimento", type=int, default=50, help="pedidos não medidos de cada tipo")
+    args = parser.parse_args()
+
+    os.environ["FLASK_RATELIMIT_ENABLED"] = "false"
+    resultados = []
+    app = None
+    for anos in [float(a) for a in args.anos.split(",")]:
+        recriar(anos, args.futuro, args.bilhetes_dia)
+        if app is None:
+            app = importar_app()
+        cliente = app.app.test_client()
+        with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+            for estado in ("attached", "archived"):
+                if estado == "archived":
+                    arquivadas = conn.execute(
+                        "SELECT arquivar_particoes(date_trunc('month', LOCALTIMESTAMP)) AS n;"
+                    ).fetchone().n
+                    print(f"Archived {arquivadas} months")
+                # ligações novas: as antigas têm os prepared statements do esquema anterior, e o
+                # custo dos seus planos próprios decide se o Postgres passa ao plano genérico
+                app.pool.drain()
+                app.pool_leitura.drain()
+                particoes = conn.execute(
+                    "SELECT COUNT(*) AS n FROM pg_inherits WHERE inhparent = 'voo'::regclass;"
+                ).fetchone().n
+                historico = conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM voo) AS voos, (SELECT COUNT(*) FROM bilhete) AS bilhetes;"
+                ).fetchone()
+                n = args.aquecimento + args.repeticoes
+                rotas, voos, bilhetes = amostras(conn, n)
+                pedidos = {
+                    "GET /voos/<p>/<c>/": [
+                        ("GET", f"/voos/{r.partida}/{r.chegada}/", None)
+                        for r in itertools.islice(itertools.cycle(rotas), n)
+                    ],
+                    "POST /compra/<voo>/": [
+                        ("POST", f"/compra/{voo}/", {"nif": "123456789", "passageiros": [{"nome": "Bench", "classe": False}]})
+                        for voo in itertools.islice(itertools.cycle(voos), n)
+                    ],
+                    "POST /checkin/<id>": [("POST", f"/checkin/{b}", None) for b in bilhetes],
+                }
+                for nome, lista in pedidos.items():
+                    # aquecimento: caches e, em cada ligação do pool, os 5 planos próprios que o
+                    # Postgres faz antes do plano genérico de cada prepared statement (ver README)
+                    medir(cliente, lista[: args.aquecimento])
+                    tempos = medir(cliente, lista[args.aquecimento :])
+                    resultados.append((anos, estado, particoes, historico, nome, tempos))
+
+    print(f"\n{'years':>5}  {'state':<9}{'parts':>6}{'flights':>9}{'tickets':>9}  {'request':<22}{'p50 ms':>8}{'p99 ms':>8}")
+    for anos, estado, particoes, historico, nome, tempos in resultados:
+        print(
+            f"{anos:>5g}  {estado:<9}{particoes:>6}{historico.voos:>9}{historico.bilhetes:>9}  {nome:<22}"
+            f"{percentil(tempos, 50) * 1e3:>8.2f}{percentil(tempos, 99) * 1e3:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Verificação dos planos de execução das consultas da aplicação.
+
+Corre EXPLAIN (ANALYZE, BUFFERS) sobre cada consulta de app/consultas.py com
+parâmetros tirados da própria base de dados e falha (código de saída 1) se
+algum plano fizer Seq Scan numa tabela grande ou ler mais blocos do que o
+orçamento dessa consulta (ORCAMENTOS). As consultas que alteram dados correm
+dentro de uma transação que é sempre desfeita.
+
+    python bench/planos.py --carregar data/populate.sql
+    python bench/planos.py --fator 2
+
+Com --carregar, a base de dados é recriada com data/aviacao.sql e os ficheiros
+indicados antes da verificação. Os planos só são representativos com o volume
+de dados do gerador.py, por isso a verificação recusa-se a correr com poucos
+bilhetes (--min-bilhetes).
+"""
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+
+import psycopg
+from psycopg.rows import namedtuple_row
+from psycopg.types.json import Jsonb
+
+from comum import APP_DIR, DATABASE_URL, carregar
+
+sys.path.insert(0, APP_DIR)
+from consultas import CONSULTAS  # noqa: E402
+
+# tabelas até este número de páginas (8 kB) em que um Seq Scan é aceitável
+PAGINAS_SEQ_SCAN = 50
+
+# blocos (hit + read) por consulta; os check-ins em lote atualizam um bilhete e
+# um lugar por passageiro, criar_particoes procura no catálogo as partições de
+# 12 meses, as restantes tocam num punhado de linhas
+ORCAMENTOS = {
+    "aeroportos": 50,
+    "aeroportos_pagina": 50,
+    "quadro_partidas": 100,
+    "partidas_pagina": 100,
+    "voos_entre": 500,
+    "grafo_voos": 500,
+    "grafo_aeroportos": 200,
+    "lotacao_voos": 50,
+    "mapa_assentos": 300,
+    "atraso_replica": 10,
+    "lotacao_compra": 50,
+    "inserir_venda": 200,
+    "bloquear_voo": 10,
+    "compra_idempotente": 50,
+    "guardar_compra": 100,
+    "bilhete_checkin": 50,
+    "bilhete_partido": 500,
+    "reclamar_lugar": 50,
+    "atribuir_lugar": 100,
+    "checkin_reserva": 500,
+    "checkin_voo": 5000,
+    "criar_particoes": 300,
+    "atualizar_cubos": 5000,
+    "analise_rotas": 200,
+    "analise_frota": 200,
+    "analise_vendas": 200,
+    "analise_classes": 200,
+}
+
+
+def parametros(conn):
+    """Parâmetros de exemplo para cada consulta, escolhidos entre os voos futuros."""
+    with conn.cursor() as cur:
+        partida = cur.execute(
+            """
+            SELECT partida FROM voo
+            WHERE hora_partida > NOW()
+            GROUP BY partida
+            ORDER BY COUNT(*) FILTER (WHERE hora_partida < NOW() + INTERVAL '12 hours') DESC
+            LIMIT 1;
+            """
+        ).fetchone()
+        if partida is None:
+            sys.exit("No future flights in the database; load a populate.sql generated recently.")
+        rota = cur.execute(
+            """
+            SELECT partida, chegada FROM voo
+            WHERE partida = %(partida)s AND hora_partida > NOW()
+            ORDER BY hora_partida
+            LIMIT 1;
+            """,
+            {"partida": partida.partida},
+        ).fetchone()
+        voo = cur.execute(
+            """
+            SELECT l.voo_id, v.hora_partida FROM lotacao_voo l JOIN voo v ON v.id = l.voo_id
+            WHERE NOT l.prim_classe AND l.vendidos < l.capacidade AND v.hora_partida > NOW()
+            ORDER BY v.hora_partida
+            LIMIT 1;
+            """
+        ).fetchone()
+        # bilhete ainda sem lugar num voo futuro (ou, na falta dele, um qualquer desse voo)
+        bilhete = cur.execute(
+            """
+            SELECT b.id, b.voo_id, b.hora_partida, b.prim_classe, b.codigo_reserva, v.no_serie
+            FROM bilhete b JOIN voo v ON v.id = b.voo_id AND v.hora_partida = b.hora_partida
+            WHERE v.hora_partida > NOW()
+            ORDER BY b.lugar IS NULL DESC, v.hora_partida
+            LIMIT 1;
+            """
+        ).fetchone()
+        if voo is None or bilhete is None:
+            sys.exit("No future flight with tickets and free seats to sample parameters from.")
+        lugar = cur.execute(
+            "SELECT lugar FROM assento_livre WHERE voo_id = %(voo)s AND prim_classe = %(classe)s LIMIT 1;",
+            {"voo": bilhete.voo_id, "classe": bilhete.prim_classe},
+        ).fetchone()
+
+    # análises do mês atual, primeira página
+    hoje = date.today()
+    mes = {"desde": hoje.replace(day=1), "ate": (hoje.replace(day=1) + timedelta(days=32)).replace(day=1)}
+    pagina = {"limite": 101, "deslocamento": 0}
+
+    return {
+        "aeroportos": {},
+        "aeroportos_pagina": {"depois": "", "limite": 101},
+        "quadro_partidas": {"partida": partida.partida, "margem": timedelta(seconds=60)},
+        "partidas_pagina": {
+            "partida": partida.partida,
+            "janela": timedelta(hours=12),
+            "hora": datetime.min,
+            "id": 0,
+            "limite": 101,
+        },
+        "voos_entre": {"partida": rota.partida, "chegada": rota.chegada},
+        "grafo_voos": {"desde": None, "horizonte": timedelta(hours=48)},
+        "grafo_aeroportos": {"aeroportos": [partida.partida, rota.chegada], "ate": datetime.now() + timedelta(hours=48)},
+        "lotacao_voos": {"voos": [voo.voo_id, bilhete.voo_id]},
+        "mapa_assentos": {"voo": voo.voo_id},
+        "atraso_replica": {},
+        "lotacao_compra": {"voo": voo.voo_id},
+        "inserir_venda": {
+            "voo": voo.voo_id,
+            "hora_partida": voo.hora_partida,
+            "nif": "123456789",
+            "nomes": ["Plano Explain"],
+            "precos": [100],
+            "classes": [False],
+        },
+        "bloquear_voo": {"voo": voo.voo_id},
+        "compra_idempotente": {"chave": "plano-explain"},
+        "guardar_compra": {
+            "chave": "plano-explain",
+            "pedido": "0" * 64,
+            "codigo_reserva": bilhete.codigo_reserva,
+            "resposta": Jsonb({}),
+        },
+        "bilhete_checkin": {"bilhete": bilhete.id},
+        "bilhete_partido": {"bilhete": bilhete.id},
+        "reclamar_lugar": {"voo_id": bilhete.voo_id, "classe": bilhete.prim_classe},
+        "atribuir_lugar": {
+            "lugar": lugar.lugar if lugar else None,
+            "no_serie": bilhete.no_serie,
+            "bilhete": bilhete.id,
+            "hora_partida": bilhete.hora_partida,
+        },
+        "checkin_reserva": {"valor": bilhete.codigo_reserva},
+        "checkin_voo": {"valor": bilhete.voo_id},
+        "criar_particoes": {"meses": 12},
+        "atualizar_cubos": {},
+        "analise_rotas": {**mes, **pagina},
+        "analise_frota": {**mes, **pagina},
+        "analise_vendas": {
+            "espaco": "cidade",
+            "tempo": "dia",
+            "pais_partida": None,
+            "cidade_partida": None,
+            "pais_chegada": None,
+            "cidade_chegada": None,
+            **mes,
+            **pagina,
+        },
+        "analise_classes": {"espaco": "cidade", "pais_partida": None, "cidade_partida": None, **mes, **pagina},
+    }
+
+
+def nos(plano):
+    """Todos os nós de um plano (em profundidade)."""
+    yield plano
+    for filho in plano.get("Plans", ()):
+        yield from nos(filho)
+
+
+def explicar(conn, consulta, params):
+    """Corre EXPLAIN (ANALYZE, BUFFERS) dentro de uma transação desfeita no fim; devolve o plano."""
+    with conn.transaction(force_rollback=True):
+        resultado = conn.execute(
+            "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + consulta.strip().rstrip(";"), params
+        ).fetchone()
+    return resultado[0][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carregar", nargs="*", metavar="FICHEIRO", help="recria o esquema e carrega estes ficheiros")
+    parser.add_argument("--fator", type=float, default=1.0, help="multiplica o orçamento de blocos de cada consulta")
+    parser.add_argument("--min-bilhetes", type=int, default=10000, help="mínimo de bilhetes para os planos serem representativos")
+    parser.add_argument("--verbose", action="store_true", help="mostra o plano de cada consulta")
+    args = parser.parse_args()
+
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        if args.carregar is not None:
+            carregar(conn, args.carregar)
+        conn.execute("ANALYZE;")
+        # os cubos de análise ficam em dia, como após o primeiro pedido à API
+        conn.execute("SELECT atualizar_cubos();")
+
+        num_bilhetes = conn.execute("SELECT COUNT(*) AS n FROM bilhete;").fetchone().n
+        if num_bilhetes < args.min_bilhetes:
+            sys.exit(
+                f"Only {num_bilhetes} tickets in the database (--min-bilhetes {args.min_bilhetes}); "
+                "plans on tiny tables are not representative, load the generated populate.sql."
+            )
+
+        exemplos = parametros(conn)
+        paginas = {
+            r.relname: r.relpages
+            for r in conn.execute("SELECT relname, relpages FROM pg_class WHERE relkind = 'r';").fetchall()
+        }
+        falhas = 0
+        print(f"{'consulta':<18}{'ms':>9}{'blocos':>9}  resultado")
+        for nome, consulta in CONSULTAS.items():
+            plano = explicar(conn, consulta, exemplos[nome])
+            raiz = plano["Plan"]
+            blocos = raiz["Shared Hit Blocks"] + raiz["Shared Read Blocks"]
+            problemas = [
+                f"Seq Scan on {n['Relation Name']}"
+                for n in nos(raiz)
+                if n["Node Type"] == "Seq Scan" and paginas.get(n["Relation Name"], 0) > PAGINAS_SEQ_SCAN
+            ]
+            orcamento = int(ORCAMENTOS[nome] * args.fator)
+            if blocos > orcamento:
+                problemas.append(f"{blocos} blocks > {orcamento}")
+            falhas += bool(problemas)
+            print(f"{nome:<18}{plano['Execution Time']:>9.2f}{blocos:>9}  {'; '.join(problemas) or 'ok'}")
+            if args.verbose:
+                texto = conn.execute(
+                    "EXPLAIN " + consulta.strip().rstrip(";"), exemplos[nome]
+                ).fetchall()
+                print("\n".join("    " + r[0] for r in texto))
+
+    if falhas:
+        sys.exit(f"{falhas} of {len(CONSULTAS)} queries regressed.")
+
+
+if __name__ == "__main__":
+    main()
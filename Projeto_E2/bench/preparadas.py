@@ -0,0 +1,146 @@
+"""Prepared statements nos pedidos frequentes: CPU do backend do Postgres e
+latência por pedido, com quatro configurações da ligação:
+
+- sem: nada é preparado (cada execução envia, analisa e planeia o SQL);
+- auto: a preparação automática do psycopg (ao fim de 5 execuções de cada consulta);
+- registo: só as consultas de PREPARADAS, preparadas na primeira execução;
+- app: o cursor da app, que faz o mesmo que registo e mede cada consulta (metricas.py).
+
+    python bench/preparadas.py --pedidos 3000
+
+Cada pedido repete o trabalho do endpoint na base de dados: quadro_partidas
+(GET /voos/<partida> sem cache), voos_entre (GET /voos/<partida>/<chegada>/),
+comprar_bilhetes de um passageiro (POST /compra) e fazer_checkin desse bilhete
+(POST /checkin). A CPU do backend lê-se de /proc, logo o Postgres tem de correr
+nesta máquina. Cria um voo temporário, que é apagado no fim.
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, apagar_vendas, criar_voo_temporario, importar_app, percentil
+
+app = importar_app()
+from consultas import preparar  # noqa: E402
+
+TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class CursorRegisto(psycopg.Cursor):
+    """app.Cursor sem as métricas."""
+
+    def execute(self, query, params=None, *, prepare=None, **kwargs):
+        if prepare is None:
+            prepare = preparar(query)
+        return super().execute(query, params, prepare=prepare, **kwargs)
+
+
+def cpu_backend(conn):
+    """Segundos de CPU (utilizador + sistema) do processo do backend da ligação."""
+    with open(f"/proc/{conn.info.backend_pid}/stat") as f:
+        campos = f.read().rsplit(")", 1)[1].split()
+    return (int(campos[11]) + int(campos[12])) / TICKS
+
+
+class Medidor:
+    """Latências e CPU do backend acumuladas por tipo de pedido."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.latencias = {}
+        self.cpu = {}
+
+    def medir(self, tipo, pedidos):
+        """Corre cada pedido (uma função sem argumentos) e devolve os resultados."""
+        latencias = self.latencias.setdefault(tipo, [])
+        resultados = []
+        cpu = cpu_backend(self.conn)
+        for pedido in pedidos:
+            inicio = time.perf_counter()
+            resultados.append(pedido())
+            latencias.append(time.perf_counter() - inicio)
+        self.cpu[tipo] = self.cpu.get(tipo, 0.0) + cpu_backend(self.conn) - cpu
+        return resultados
+
+
+def correr(conn, voo, rotas, pedidos):
+    """Faz <pedidos> pedidos de cada tipo com a ligação <conn>."""
+    consultas = app.CONSULTAS
+    medidor = Medidor(conn)
+
+    def quadro(partida):
+        return lambda: conn.execute(
+            consultas["quadro_partidas"], {"partida": partida, "margem": timedelta(seconds=60)}
+        ).fetchall()
+
+    def entre(partida, chegada):
+        return lambda: conn.execute(consultas["voos_entre"], {"partida": partida, "chegada": chegada}).fetchall()
+
+    medidor.medir("voos", [quadro(rotas[i % len(rotas)][0]) for i in range(pedidos)])
+    medidor.medir("voos_entre", [entre(*rotas[i % len(rotas)]) for i in range(pedidos)])
+
+    # compras e check-ins em rondas, até esgotar os lugares do voo
+    lugares = conn.execute("SELECT SUM(capacidade) AS n FROM lotacao_voo WHERE voo_id = %(voo)s;", {"voo": voo})
+    lugares = lugares.fetchone().n
+    feitos = 0
+    while feitos < pedidos:
+        n = min(lugares, pedidos - feitos)
+
+        def compra(i):
+            passageiros = [{"nome": f"Passageiro {i}", "classe": i % 5 == 0}]
+            return lambda: app.comprar_bilhetes(conn, str(voo), "123456789", passageiros)
+
+        compras = medidor.medir("compra", [compra(i) for i in range(n)])
+        bilhetes = [resposta["bilhetes"][0] for resposta, status in compras if status == 200]
+        checkins = medidor.medir("checkin", [lambda b=b: app.fazer_checkin(conn, str(b)) for b in bilhetes])
+        assert all(status == 200 for _, status in checkins), checkins[:3]
+        apagar_vendas(conn, voo)
+        feitos += n
+    return medidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pedidos", type=int, default=3000, help="pedidos de cada tipo por configuração")
+    args = parser.parse_args()
+
+    configuracoes = {
+        "sem": {"prepare_threshold": None},
+        "auto": {},
+        "registo": {"cursor_factory": CursorRegisto},
+        "app": {"cursor_factory": app.Cursor},
+    }
+
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        voo = criar_voo_temporario(conn)
+        rotas = [
+            (r.partida, r.chegada)
+            for r in conn.execute(
+                "SELECT partida, chegada FROM voo GROUP BY partida, chegada ORDER BY COUNT(*) DESC LIMIT 50;"
+            )
+        ]
+        try:
+            resultados = {}
+            for nome, kwargs in configuracoes.items():
+                with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row, **kwargs) as c:
+                    resultados[nome] = correr(c, voo, rotas, args.pedidos)
+                print(f"{nome}: done", flush=True)
+        finally:
+            apagar_vendas(conn, voo, apagar_voo=True)
+
+    print(f"\n{'request':<12}{'mode':<10}{'backend CPU us':>16}{'p50 ms':>10}{'p99 ms':>10}")
+    for tipo in ("voos", "voos_entre", "compra", "checkin"):
+        for nome, medidor in resultados.items():
+            latencias = medidor.latencias[tipo]
+            print(
+                f"{tipo:<12}{nome:<10}{medidor.cpu[tipo] / len(latencias) * 1e6:>16.0f}"
+                f"{percentil(latencias, 50) * 1000:>10.3f}{percentil(latencias, 99) * 1000:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Custo das respostas dos endpoints de leitura: serialização com o json do Flask
+contra o orjson (app/respostas.py), e pedidos completos contra pedidos
+condicionais (If-None-Match) que recebem 304.
+
+    python bench/respostas.py --linhas 100,1000,10000
+
+A serialização é medida sobre listas sintéticas de <linhas> elementos com a
+forma das respostas de / (pares de texto) e de /voos/<partida> (número de
+série, hora de partida e aeroporto), com cada JSONProvider a construir a
+resposta, como faz o jsonify. Depois, no cliente de teste do Flask e com as
+caches já carregadas, GET / e GET /voos/<partida> (o aeroporto com mais voos
+nas próximas 12 horas) sem e com o ETag da resposta anterior; --aeroportos N
+acrescenta aeroportos temporários até N, apagados no fim.
+"""
+import argparse
+import itertools
+import os
+import string
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask.json.provider import DefaultJSONProvider
+
+from comum import importar_app, percentil
+
+
+def medir(funcao, repeticoes):
+    """Tempos (s) de <repeticoes> chamadas a <funcao>, depois de uma de aquecimento."""
+    funcao()
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return tempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", default="100,1000,10000")
+    parser.add_argument("--repeticoes", type=int, default=200)
+    parser.add_argument("--aeroportos", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["FLASK_RATELIMIT_ENABLED"] = "false"
+    app = importar_app()
+    fornecedores = {"json": DefaultJSONProvider(app.app), "orjson": app.app.json}
+
+    agora = datetime.now().replace(microsecond=0)
+    serializacao = []
+    for linhas in sorted(int(n) for n in args.linhas.split(",")):
+        formas = {
+            "airports": [(f"Aeroporto {i}", f"Cidade {i}") for i in range(linhas)],
+            "departures": [(str(uuid.uuid4()), agora + timedelta(minutes=i), "LIS") for i in range(linhas)],
+        }
+        for forma, dados in formas.items():
+            with app.app.app_context():
+                tempos = {
+                    nome: medir(lambda f=f: f.response(dados), args.repeticoes) for nome, f in fornecedores.items()
+                }
+            serializacao.append((linhas, forma, tempos))
+
+    cliente = app.app.test_client()
+    pedidos = []
+    with app.pool.connection() as conn:
+        partida = conn.execute(
+            "SELECT partida FROM voo WHERE hora_partida BETWEEN LOCALTIMESTAMP AND LOCALTIMESTAMP + INTERVAL '12 hours' "
+            "GROUP BY partida ORDER BY COUNT(*) DESC LIMIT 1;"
+        ).fetchone()
+        existentes = {r.codigo for r in conn.execute("SELECT codigo FROM aeroporto;")}
+        livres = (c for c in map("".join, itertools.product(string.ascii_uppercase, repeat=3)) if c not in existentes)
+        temporarios = list(itertools.islice(livres, max(args.aeroportos - len(existentes), 0)))
+        with conn.cursor().copy("COPY aeroporto (codigo, nome, cidade, pais) FROM STDIN") as copy:
+            for codigo in temporarios:
+                copy.write_row((codigo, f"Aeroporto {codigo}", f"Cidade {codigo}", "Bench"))
+        try:
+            # a invalidação da cache chega por NOTIFY
+            time.sleep(0.5)
+            for url in ["/", f"/voos/{partida.partida}" if partida else None]:
+                if url is None:
+                    continue
+                resposta = cliente.get(url)
+                etag = resposta.headers["ETag"]
+                completo = medir(lambda: cliente.get(url), args.repeticoes)
+                condicional = medir(lambda: cliente.get(url, headers={"If-None-Match": etag}), args.repeticoes)
+                assert cliente.get(url, headers={"If-None-Match": etag}).status_code == 304
+                pedidos.append((url, len(resposta.data), completo, condicional))
+        finally:
+            conn.execute("DELETE FROM aeroporto WHERE codigo = ANY(%(codigos)s);", {"codigos": temporarios})
+
+    print(f"\n{'rows':>6}  {'shape':<12}{'json µs':>10}{'orjson µs':>11}{'speedup':>9}")
+    for linhas, forma, tempos in serializacao:
+        json_, orjson_ = (percentil(tempos[n], 50) * 1e6 for n in ("json", "orjson"))
+        print(f"{linhas:>6}  {forma:<12}{json_:>10.0f}{orjson_:>11.0f}{json_ / orjson_:>8.1f}x")
+
+    print(f"\n{'request':<16}{'body B':>8}{'200 p50 µs':>12}{'304 p50 µs':>12}{'200 p99 µs':>12}{'304 p99 µs':>12}")
+    for url, tamanho, completo, condicional in pedidos:
+        print(
+            f"{url:<16}{tamanho:>8}{percentil(completo, 50) * 1e6:>12.0f}{percentil(condicional, 50) * 1e6:>12.0f}"
+            f"{percentil(completo, 99) * 1e6:>12.0f}{percentil(condicional, 99) * 1e6:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Modo síncrono (gunicorn wsgi:app) contra modo assíncrono (hypercorn asgi:app):
+pedidos por segundo e latência p50/p99 por número de clientes concorrentes.
+
+    python bench/servidores.py
+    python bench/servidores.py --clientes 50,200,1000 --duracao 10 --rtt-ms 2
+
+Arranca cada servidor com 2 workers (como em start e no Procfile) numa porta
+local, com os limites de pedidos desligados, e mede clientes HTTP/1.1 com
+keep-alive que repetem GET /voos/<partida>/<chegada>/ na rota com mais voos
+(uma consulta à base de dados por pedido) ou o --caminho indicado. Os primeiros
+--aquecimento segundos de cada medição não contam. Com --rtt-ms > 0 os
+servidores ligam-se à base de dados através de um proxy que simula latência de
+rede. Os clientes correm neste processo, na mesma máquina que os servidores.
+"""
+import argparse
+import asyncio
+import resource
+import sys
+import time
+
+import psycopg
+
+from comum import DATABASE_URL, SERVIDORES, Cliente, ProxyLatencia, arrancar, parar, percentil
+
+
+async def medir(porta, caminho, clientes, duracao, aquecimento, timeout):
+    """Latências (s) dos pedidos com sucesso e número de erros, com <clientes> em paralelo."""
+    latencias = []
+    erros = 0
+    inicio_medicao = time.perf_counter() + aquecimento
+    fim = inicio_medicao + duracao
+
+    async def cliente():
+        nonlocal erros
+        c = Cliente(porta)
+        while (inicio := time.perf_counter()) < fim:
+            try:
+                status = await asyncio.wait_for(c.get(caminho), timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                c.fechar()
+                status = None
+            if inicio < inicio_medicao:
+                continue
+            if status == 200:
+                latencias.append(time.perf_counter() - inicio)
+            else:
+                erros += 1
+        c.fechar()
+
+    await asyncio.gather(*(cliente() for _ in range(clientes)))
+    return latencias, erros
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", default="50,200,1000")
+    parser.add_argument("--duracao", type=float, default=10.0, help="segundos medidos por nível de clientes")
+    parser.add_argument("--aquecimento", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="segundos até um pedido contar como erro")
+    parser.add_argument("--rtt-ms", type=float, default=0.0)
+    parser.add_argument("--caminho", help="pedido a repetir (por omissão a rota com mais voos)")
+    parser.add_argument("--porta", type=int, default=8099)
+    args = parser.parse_args()
+    niveis = [int(n) for n in args.clientes.split(",")]
+
+    # um descritor por cliente e outro do lado do servidor
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+    if 2 * max(niveis) + 100 > maximo:
+        sys.exit(f"Open file limit {maximo} too low for {max(niveis)} clients.")
+
+    caminho = args.caminho
+    if caminho is None:
+        with psycopg.connect(DATABASE_URL) as conn:
+            partida, chegada = conn.execute(
+                "SELECT partida, chegada FROM voo GROUP BY partida, chegada ORDER BY COUNT(*) DESC LIMIT 1;"
+            ).fetchone()
+        caminho = f"/voos/{partida}/{chegada}/"
+    dsn = ProxyLatencia(DATABASE_URL, args.rtt_ms).dsn if args.rtt_ms > 0 else DATABASE_URL
+    print(f"GET {caminho}, {args.duracao:.0f} s per level, rtt {args.rtt_ms} ms")
+
+    resultados = []
+    for servidor in SERVIDORES:
+        processo = arrancar(servidor, args.porta, dsn)
+        try:
+            for clientes in niveis:
+                latencias, erros = asyncio.run(
+                    medir(args.porta, caminho, clientes, args.duracao, args.aquecimento, args.timeout)
+                )
+                resultados.append((servidor, clientes, latencias, erros))
+                print(f"{servidor} {clientes} clients: {len(latencias)} requests, {erros} errors", flush=True)
+        finally:
+            parar(processo)
+
+    print(f"\n{'server':<8}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for servidor, clientes, latencias, erros in resultados:
+        print(
+            f"{servidor:<8}{clientes:>8}{len(latencias) / args.duracao:>10.0f}"
+            f"{percentil(latencias, 50) * 1000:>10.1f}{percentil(latencias, 99) * 1000:>10.1f}{erros:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
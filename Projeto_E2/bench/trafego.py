@@ -0,0 +1,329 @@
+"""Teste de carga da API com uma mistura de leituras e escritas: listagem de
+aeroportos (GET /), quadro de partidas (GET /voos/<partida>), pesquisa de rota
+(GET /voos/<partida>/<chegada>/), compra (POST /compra/<voo>/) e check-in
+(POST /checkin/<bilhete>), nas proporções de --mistura.
+
+    python bench/trafego.py
+    python bench/trafego.py --mistura aeroportos=1,partidas=4,rota=4,compra=1 --clientes 20 --duracao 60
+    python bench/trafego.py --servidor asgi --json resultados.json
+    python bench/trafego.py --url http://127.0.0.1:8080 --json -
+
+Arranca o --servidor (gunicorn wsgi:app ou hypercorn asgi:app, 2 workers) numa
+porta local com os limites de pedidos desligados (--limites mantém-nos, com os
+valores de RATELIMIT_DEFAULT e RATELIMIT_ENDPOINT do ambiente), ou usa o
+servidor já a correr em --url. Cada cliente HTTP/1.1 com keep-alive repete
+pedidos sem pausas, escolhidos com o seu próprio gerador aleatório (semente
+--seed e número do cliente), sobre os aeroportos, rotas e voos futuros da base
+de dados: é preciso ter voos depois de agora, p. ex. de
+`python data/gerador.py --inicio <hoje> --fim <daqui a um mês> --carregar`.
+Cada compra é de 1 a 4 passageiros e cada check-in é de um bilhete comprado
+antes pelo mesmo cliente (sem nenhum por fazer, o cliente faz uma compra). As
+vendas do teste ficam com o NIF --nif e são apagadas no fim, salvo com --manter.
+
+Escreve por tipo de pedido e no total os pedidos por segundo, a latência
+p50/p95/p99 das respostas 2xx e a taxa de erros (respostas não 2xx, ligações
+falhadas e pedidos acima de --timeout), com os códigos HTTP; e, se o servidor
+tiver /metrics (só o WSGI), o tempo de espera por uma ligação do pool, da
+diferença dos contadores psycopg_requests_* no início e no fim da medição.
+Com --json, o mesmo resultado em JSON num ficheiro ou, com "-", no stdout.
+"""
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+from urllib.parse import urlsplit
+
+import psycopg
+from psycopg.rows import namedtuple_row
+
+from comum import DATABASE_URL, SERVIDORES, Cliente, arrancar, parar, percentil
+
+OPERACOES = ("aeroportos", "partidas", "rota", "compra", "checkin")
+MISTURA = "aeroportos=1,partidas=3,rota=3,compra=2,checkin=1"
+# contadores do pool em /metrics (ver app/metricas.py)
+CONTADORES_POOL = ("psycopg_requests_num_total", "psycopg_requests_queued_total", "psycopg_requests_wait_seconds_total")
+
+
+def ler_mistura(texto):
+    """"aeroportos=1,compra=2" -> {operação: peso}."""
+    mistura = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome not in OPERACOES:
+            raise argparse.ArgumentTypeError(f"unknown operation {nome!r}, expected one of {', '.join(OPERACOES)}")
+        mistura[nome] = float(peso or 1)
+    if sum(mistura.values()) <= 0:
+        raise argparse.ArgumentTypeError("the weights must add up to more than zero")
+    return mistura
+
+
+def alvos(conn):
+    """Aeroportos, rotas com voos futuros e voos futuros com lugares livres."""
+    aeroportos = [r.codigo for r in conn.execute("SELECT codigo FROM aeroporto ORDER BY codigo;")]
+    rotas = [
+        (r.partida, r.chegada)
+        for r in conn.execute(
+            """
+            SELECT DISTINCT partida, chegada FROM voo
+            WHERE hora_partida > LOCALTIMESTAMP
+            ORDER BY partida, chegada;
+            """
+        )
+    ]
+    # margem para os voos não descolarem durante o teste
+    voos = [
+        r.voo_id
+        for r in conn.execute(
+            """
+            SELECT l.voo_id FROM lotacao_voo l JOIN voo v ON v.id = l.voo_id
+            WHERE v.hora_partida > LOCALTIMESTAMP + INTERVAL '1 hour'
+            GROUP BY l.voo_id HAVING SUM(l.capacidade - l.vendidos) >= 4
+            ORDER BY l.voo_id;
+            """
+        )
+    ]
+    return aeroportos, rotas, voos
+
+
+async def ler_metricas(porta, host, tentativas=1):
+    """Soma dos CONTADORES_POOL em /metrics, ou None sem /metrics.
+
+    Cada worker só junta as estatísticas do seu pool quando serve /metrics ou
+    um pedido (no máximo uma vez por segundo); com <tentativas> > 1 o pedido é
+    repetido em ligações novas, para passar por todos os workers.
+    """
+    valores = None
+    for _ in range(tentativas):
+        cliente = Cliente(porta, host)
+        try:
+            status, corpo = await cliente.pedido("GET", "/metrics")
+        finally:
+            cliente.fechar()
+        if status != 200:
+            return None
+        valores = dict.fromkeys(CONTADORES_POOL, 0.0)
+        for linha in corpo.decode().splitlines():
+            nome, _, valor = linha.partition("{")
+            if nome in valores:
+                valores[nome] += float(valor.rsplit(" ", 1)[1])
+    return valores
+
+
+class Carga:
+    """Estado partilhado pelos clientes e resultados por operação."""
+
+    def __init__(self, args, aeroportos, rotas, voos):
+        self.args = args
+        self.aeroportos = aeroportos
+        self.rotas = rotas
+        self.voos = voos
+        self.operacoes = list(args.mistura)
+        self.pesos = list(args.mistura.values())
+        self.latencias = {op: [] for op in OPERACOES}
+        self.status = {op: {} for op in OPERACOES}
+
+    def pedido(self, op, rng, bilhetes):
+        """(operação, método, caminho, corpo) do próximo pedido de um cliente."""
+        if op == "checkin" and not bilhetes:
+            op = "compra"
+        if op == "aeroportos":
+            return op, "GET", "/", None
+        if op == "partidas":
+            return op, "GET", f"/voos/{rng.choice(self.aeroportos)}", None
+        if op == "rota":
+            return op, "GET", "/voos/{}/{}/".format(*rng.choice(self.rotas)), None
+        if op == "checkin":
+            return op, "POST", f"/checkin/{bilhetes.pop(rng.randrange(len(bilhetes)))}", None
+        passageiros = [
+            {"nome": f"Passageiro {i}", "classe": rng.random() < self.args.primeira} for i in range(rng.randint(1, 4))
+        ]
+        return op, "POST", f"/compra/{rng.choice(self.voos)}/", {"nif": self.args.nif, "passageiros": passageiros}
+
+    async def cliente(self, i, inicio_medicao, fim):
+        rng = random.Random(f"{self.args.seed}/{i}")
+        bilhetes = []
+        c = Cliente(self.args.porta, self.args.host)
+        while (inicio := time.perf_counter()) < fim:
+            op, metodo, caminho, corpo = self.pedido(rng.choices(self.operacoes, self.pesos)[0], rng, bilhetes)
+            try:
+                status, resposta = await asyncio.wait_for(c.pedido(metodo, caminho, corpo), self.args.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                c.fechar()
+                status = None
+            if op == "compra" and status == 200:
+                bilhetes.extend(json.loads(resposta)["bilhetes"])
+            if inicio < inicio_medicao:
+                continue
+            chave = str(status) if status else "error"
+            self.status[op][chave] = self.status[op].get(chave, 0) + 1
+            if status is not None and 200 <= status < 300:
+                self.latencias[op].append(time.perf_counter() - inicio)
+        c.fechar()
+
+    async def correr(self):
+        """Corre os clientes; devolve os contadores do pool no início e no fim da medição."""
+        args = self.args
+        inicio_medicao = time.perf_counter() + args.aquecimento
+        fim = inicio_medicao + args.duracao
+        clientes = asyncio.gather(*(self.cliente(i, inicio_medicao, fim) for i in range(args.clientes)))
+        await asyncio.sleep(args.aquecimento)
+        antes = await ler_metricas(args.porta, args.host)
+        await clientes
+        depois = None
+        if antes is not None:
+            await asyncio.sleep(1.1)
+            depois = await ler_metricas(args.porta, args.host, tentativas=4 * args.workers)
+        return antes, depois
+
+
+def resumo(latencias, status, duracao):
+    pedidos = sum(status.values())
+    erros = pedidos - len(latencias)
+    return {
+        "requests": pedidos,
+        "throughput_rps": round(pedidos / duracao, 1),
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2) if latencias else None,
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2) if latencias else None,
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2) if latencias else None,
+        "errors": erros,
+        "error_rate": round(erros / pedidos, 4) if pedidos else None,
+        "status": dict(sorted(status.items())),
+    }
+
+
+def resultado(carga, antes, depois):
+    args = carga.args
+    operacoes = {
+        op: resumo(carga.latencias[op], carga.status[op], args.duracao) for op in OPERACOES if carga.status[op]
+    }
+    total_status = {}
+    for status in carga.status.values():
+        for chave, n in status.items():
+            total_status[chave] = total_status.get(chave, 0) + n
+    pool = None
+    if antes is not None and depois is not None:
+        num, fila, espera = (depois[c] - antes[c] for c in CONTADORES_POOL)
+        pool = {
+            "requests": int(num),
+            "queued": int(fila),
+            "wait_seconds_total": round(espera, 3),
+            "wait_ms_mean": round(espera / num * 1000, 3) if num else None,
+        }
+    return {
+        "config": {
+            "server": args.url or args.servidor,
+            "clients": args.clientes,
+            "duration_s": args.duracao,
+            "warmup_s": args.aquecimento,
+            "mix": args.mistura,
+            "seed": args.seed,
+            "rate_limits": args.limites,
+        },
+        "operations": operacoes,
+        "total": resumo([t for op in OPERACOES for t in carga.latencias[op]], total_status, args.duracao),
+        "pool": pool,
+    }
+
+
+def imprimir(res, saida):
+    print(
+        f"\n{'operation':<12}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}  status",
+        file=saida,
+    )
+
+    def ms(valor):
+        return "-" if valor is None else f"{valor:.1f}"
+
+    for nome, r in [*res["operations"].items(), ("total", res["total"])]:
+        status = " ".join(f"{k}:{v}" for k, v in r["status"].items())
+        print(
+            f"{nome:<12}{r['throughput_rps']:>9.1f}{ms(r['p50_ms']):>9}{ms(r['p95_ms']):>9}{ms(r['p99_ms']):>9}"
+            f"{r['error_rate']:>9.2%}  {status}",
+            file=saida,
+        )
+    pool = res["pool"]
+    if pool is None:
+        print("\npool wait: n/a (no /metrics)", file=saida)
+    else:
+        print(
+            f"\npool: {pool['requests']} connection requests, {pool['queued']} queued, "
+            f"{pool['wait_seconds_total']:.3f} s waiting ({ms(pool['wait_ms_mean'])} ms mean)",
+            file=saida,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mistura", type=ler_mistura, default=MISTURA, help=f"pesos das operações ({MISTURA})")
+    parser.add_argument("--clientes", type=int, default=20)
+    parser.add_argument("--duracao", type=float, default=30.0, help="segundos medidos")
+    parser.add_argument("--aquecimento", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="segundos até um pedido contar como erro")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--primeira", type=float, default=0.1, help="fração de passageiros em primeira classe")
+    parser.add_argument("--nif", default="999999990", help="NIF das vendas do teste")
+    parser.add_argument("--manter", action="store_true", help="não apagar as vendas do teste")
+    parser.add_argument("--servidor", choices=SERVIDORES, default="wsgi")
+    parser.add_argument("--url", help="servidor já a correr, em vez de arrancar --servidor")
+    parser.add_argument("--workers", type=int, default=2, help="workers do servidor em --url")
+    parser.add_argument("--porta", type=int, default=8099)
+    parser.add_argument("--limites", action="store_true", help="manter os limites de pedidos")
+    parser.add_argument("--json", metavar="FICHEIRO", help='resultado em JSON ("-" para o stdout)')
+    args = parser.parse_args()
+    args.host = "127.0.0.1"
+    if args.url:
+        url = urlsplit(args.url)
+        args.host, args.porta = url.hostname, url.port or 80
+    saida = sys.stderr if args.json == "-" else sys.stdout
+
+    _, maximo = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (maximo, maximo))
+
+    with psycopg.connect(DATABASE_URL, autocommit=True, row_factory=namedtuple_row) as conn:
+        aeroportos, rotas, voos = alvos(conn)
+        if not rotas or not voos:
+            sys.exit(
+                "No future flights with free seats: generate some with "
+                "python data/gerador.py --inicio <today> --fim <next month> --carregar"
+            )
+        print(
+            f"{len(aeroportos)} airports, {len(rotas)} routes, {len(voos)} flights; "
+            f"{args.clientes} clients for {args.duracao:.0f} s",
+            file=saida,
+            flush=True,
+        )
+        processo = None if args.url else arrancar(args.servidor, args.porta, DATABASE_URL, args.limites)
+        carga = Carga(args, aeroportos, rotas, voos)
+        try:
+            antes, depois = asyncio.run(carga.correr())
+        finally:
+            if processo is not None:
+                parar(processo)
+            if not args.manter:
+                conn.execute(
+                    """
+                    WITH apagados AS (
+                        DELETE FROM bilhete
+                        WHERE codigo_reserva IN (SELECT codigo_reserva FROM venda WHERE nif_cliente = %(nif)s)
+                        RETURNING codigo_reserva
+                    )
+                    DELETE FROM venda WHERE codigo_reserva IN (SELECT codigo_reserva FROM apagados);
+                    """,
+                    {"nif": args.nif},
+                )
+
+    res = resultado(carga, antes, depois)
+    imprimir(res, saida)
+    if args.json == "-":
+        json.dump(res, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
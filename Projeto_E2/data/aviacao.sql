@@ -1,9 +1,18 @@
+DROP SCHEMA IF EXISTS arquivo CASCADE;
 DROP TABLE IF EXISTS aeroporto CASCADE;
 DROP TABLE IF EXISTS aviao CASCADE;
 DROP TABLE IF EXISTS assento CASCADE;
 DROP TABLE IF EXISTS voo CASCADE;
 DROP TABLE IF EXISTS venda CASCADE;
 DROP TABLE IF EXISTS bilhete CASCADE;
+DROP TABLE IF EXISTS compra_idempotente CASCADE;
+DROP TABLE IF EXISTS lotacao_voo CASCADE;
+DROP TABLE IF EXISTS assento_livre CASCADE;
+DROP TABLE IF EXISTS estatisticas_voos CASCADE;
+DROP TABLE IF EXISTS cubo_vendas CASCADE;
+DROP TABLE IF EXISTS cubo_frota CASCADE;
+DROP TABLE IF EXISTS cubo_pendente CASCADE;
+DROP TABLE IF EXISTS versao_dados CASCADE;
 
 CREATE TABLE aeroporto(
 	codigo CHAR(3) PRIMARY KEY CHECK (codigo ~ '^[A-Z]{3}$'),
@@ -25,20 +34,26 @@ CREATE TABLE assento (
 	PRIMARY KEY (lugar, no_serie)
 );
 
+/*
+voo e bilhete estão particionados por mês de partida (ver "Partições" abaixo).
+Uma chave primária ou UNIQUE de uma tabela particionada tem de incluir a chave
+de partição: o id passa a (id, hora_partida), e o id e os UNIQUE com
+hora_chegada ficam na tabela chave_voo. O bilhete guarda a hora_partida do
+seu voo, garantida pela chave estrangeira (voo_id, hora_partida).
+*/
 CREATE TABLE voo (
-	id SERIAL PRIMARY KEY,
+	id SERIAL,
 	no_serie VARCHAR(80) REFERENCES aviao,
 	hora_partida TIMESTAMP,
 	hora_chegada TIMESTAMP, 
 	partida CHAR(3) REFERENCES aeroporto(codigo),
 	chegada CHAR(3) REFERENCES aeroporto(codigo),
+	PRIMARY KEY (id, hora_partida),
 	UNIQUE (no_serie, hora_partida),
-	UNIQUE (no_serie, hora_chegada),
 	UNIQUE (hora_partida, partida, chegada),
-	UNIQUE (hora_chegada, partida, chegada),
 	CHECK (partida!=chegada),
 	CHECK (hora_partida<=hora_chegada)
-);
+) PARTITION BY RANGE (hora_partida);
 
 CREATE TABLE venda (
 	codigo_reserva SERIAL PRIMARY KEY, 
@@ -48,18 +63,1138 @@ CREATE TABLE venda (
 );
 
 CREATE TABLE bilhete (
-	id SERIAL PRIMARY KEY,
-	voo_id INTEGER REFERENCES voo,
+	id SERIAL,
+	voo_id INTEGER,
+	hora_partida TIMESTAMP,
 	codigo_reserva INTEGER REFERENCES venda,
 	nome_passageiro VARCHAR(80),
 	preco NUMERIC(7,2) NOT NULL,
 	prim_classe BOOLEAN NOT NULL DEFAULT FALSE,
 	lugar VARCHAR(3),
 	no_serie VARCHAR(80),
-	UNIQUE (voo_id, codigo_reserva, nome_passageiro),
+	PRIMARY KEY (id, hora_partida),
+	UNIQUE (voo_id, hora_partida, codigo_reserva, nome_passageiro),
+	UNIQUE (voo_id, hora_partida, lugar),
+	-- a hora do voo muda com ele (e o bilhete de partição, se mudar de mês)
+	FOREIGN KEY (voo_id, hora_partida) REFERENCES voo (id, hora_partida) ON UPDATE CASCADE,
 	FOREIGN KEY (lugar, no_serie) REFERENCES assento
+) PARTITION BY RANGE (hora_partida);
+
+/*
+Voos e bilhetes de meses arquivados (arquivar_particoes): as partições
+desligadas de voo e bilhete passam para estas tabelas, com os mesmos nomes.
+Não são lidas pela aplicação; as estatísticas desses voos ficam em
+estatisticas_voos e nos cubos.
+*/
+CREATE SCHEMA arquivo;
+CREATE TABLE arquivo.voo (LIKE voo) PARTITION BY RANGE (hora_partida);
+CREATE TABLE arquivo.bilhete (LIKE bilhete) PARTITION BY RANGE (hora_partida);
+
+/*
+Compras feitas com o cabeçalho Idempotency-Key (POST /compra): a chave, o hash
+do pedido e a resposta, guardados na mesma transação que a venda. Um pedido
+repetido com a mesma chave recebe a resposta guardada em vez de comprar outra
+vez. As chaves são apagadas com a venda.
+*/
+CREATE TABLE compra_idempotente (
+	chave VARCHAR(255) PRIMARY KEY,
+	pedido CHAR(64) NOT NULL,
+	codigo_reserva INTEGER NOT NULL REFERENCES venda ON DELETE CASCADE,
+	resposta JSONB NOT NULL
+);
+
+CREATE INDEX idx_compra_idempotente_venda ON compra_idempotente (codigo_reserva);
+
+/*
+Inventário de lugares por voo e classe.
+
+lotacao_voo guarda a capacidade (assentos do avião) e o número de bilhetes
+vendidos de cada classe para cada voo, mantidos pelos triggers abaixo na mesma
+transação que altera voo, assento ou bilhete. Os endpoints leem a
+disponibilidade daqui com um acesso por chave primária, em vez de contarem
+assento e bilhete a cada pedido. O CHECK vendidos <= capacidade garante também
+a RI-2.
+*/
+CREATE TABLE lotacao_voo (
+	voo_id INTEGER,
+	prim_classe BOOLEAN,
+	capacidade INTEGER NOT NULL,
+	vendidos INTEGER NOT NULL DEFAULT 0,
+	PRIMARY KEY (voo_id, prim_classe),
+	CHECK (vendidos >= 0),
+	CHECK (vendidos <= capacidade)
+);
+
+-- Contagens de assentos por avião e classe (usado pelos triggers de lotacao_voo).
+CREATE INDEX idx_assento_no_serie ON assento (no_serie, prim_classe);
+
+-- Lotação calculada a partir das tabelas base (usada para verificar/reconstruir lotacao_voo).
+CREATE OR REPLACE VIEW lotacao_voo_esperada AS
+SELECT
+	v.id AS voo_id,
+	c.prim_classe,
+	COALESCE(a.n, 0)::INTEGER AS capacidade,
+	COALESCE(b.n, 0)::INTEGER AS vendidos
+FROM voo v
+CROSS JOIN (VALUES (TRUE), (FALSE)) AS c(prim_classe)
+LEFT JOIN (
+	SELECT no_serie, prim_classe, COUNT(*) AS n
+	FROM assento
+	GROUP BY no_serie, prim_classe
+) a ON a.no_serie = v.no_serie AND a.prim_classe = c.prim_classe
+LEFT JOIN (
+	SELECT voo_id, prim_classe, COUNT(*) AS n
+	FROM bilhete
+	GROUP BY voo_id, prim_classe
+) b ON b.voo_id = v.id AND b.prim_classe = c.prim_classe;
+
+CREATE OR REPLACE FUNCTION trg_lotacao_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    -- Novo voo ou troca de avião: recalcula as duas classes deste voo.
+    INSERT INTO lotacao_voo (voo_id, prim_classe, capacidade, vendidos)
+    SELECT
+        NEW.id,
+        c.prim_classe,
+        (SELECT COUNT(*) FROM assento a
+          WHERE a.no_serie = NEW.no_serie AND a.prim_classe = c.prim_classe),
+        (SELECT COUNT(*) FROM bilhete b
+          WHERE b.voo_id = NEW.id AND b.prim_classe = c.prim_classe)
+    FROM (VALUES (TRUE), (FALSE)) AS c(prim_classe)
+    ON CONFLICT (voo_id, prim_classe) DO UPDATE
+    SET capacidade = EXCLUDED.capacidade,
+        vendidos = EXCLUDED.vendidos;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_lotacao_voo
+AFTER INSERT OR UPDATE OF no_serie ON voo
+FOR EACH ROW
+EXECUTE FUNCTION trg_lotacao_voo();
+
+CREATE OR REPLACE FUNCTION trg_lotacao_assento()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE lotacao_voo l
+        SET capacidade = capacidade - 1
+        FROM voo v
+        WHERE v.id = l.voo_id
+          AND v.no_serie = OLD.no_serie
+          AND l.prim_classe = OLD.prim_classe;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE lotacao_voo l
+        SET capacidade = capacidade + 1
+        FROM voo v
+        WHERE v.id = l.voo_id
+          AND v.no_serie = NEW.no_serie
+          AND l.prim_classe = NEW.prim_classe;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_lotacao_assento
+AFTER INSERT OR DELETE OR UPDATE OF no_serie, prim_classe ON assento
+FOR EACH ROW
+EXECUTE FUNCTION trg_lotacao_assento();
+
+-- Bilhetes: um UPDATE por voo e classe afetados em cada comando (tabelas de
+-- transição), em vez de um por bilhete; o CHECK de lotacao_voo verifica a RI-2.
+CREATE OR REPLACE FUNCTION trg_lotacao_bilhete()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE lotacao_voo l
+        SET vendidos = l.vendidos + d.n
+        FROM (SELECT voo_id, prim_classe, COUNT(*) AS n FROM novos GROUP BY voo_id, prim_classe) d
+        WHERE l.voo_id = d.voo_id AND l.prim_classe = d.prim_classe;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE lotacao_voo l
+        SET vendidos = l.vendidos - d.n
+        FROM (SELECT voo_id, prim_classe, COUNT(*) AS n FROM antigos GROUP BY voo_id, prim_classe) d
+        WHERE l.voo_id = d.voo_id AND l.prim_classe = d.prim_classe;
+    ELSE
+        -- só os voos e classes cujo número de bilhetes mudou (o check-in não muda nenhum)
+        UPDATE lotacao_voo l
+        SET vendidos = l.vendidos + d.n
+        FROM (
+            SELECT voo_id, prim_classe, SUM(n) AS n
+            FROM (
+                SELECT voo_id, prim_classe, 1 AS n FROM novos
+                UNION ALL
+                SELECT voo_id, prim_classe, -1 AS n FROM antigos
+            ) t
+            GROUP BY voo_id, prim_classe
+            HAVING SUM(n) <> 0
+        ) d
+        WHERE l.voo_id = d.voo_id AND l.prim_classe = d.prim_classe;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Uma tabela de transição só pode ter um evento e nenhuma lista de colunas.
+CREATE TRIGGER trg_lotacao_bilhete_insert
+AFTER INSERT ON bilhete
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_lotacao_bilhete();
+
+CREATE TRIGGER trg_lotacao_bilhete_update
+AFTER UPDATE ON bilhete
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_lotacao_bilhete();
+
+CREATE TRIGGER trg_lotacao_bilhete_delete
+AFTER DELETE ON bilhete
+REFERENCING OLD TABLE AS antigos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_lotacao_bilhete();
+
+CREATE OR REPLACE FUNCTION trg_lotacao_bilhete_truncate()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    UPDATE lotacao_voo SET vendidos = 0 WHERE vendidos <> 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_lotacao_bilhete_truncate
+AFTER TRUNCATE ON bilhete
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_lotacao_bilhete_truncate();
+
+/*
+Restrições de integridade dos bilhetes, verificadas uma vez por comando sobre
+todas as linhas inseridas ou alteradas (tabelas de transição), com uma junção
+em vez de várias consultas por linha:
+
+RI-1 No check-in (lugar definido) a classe do bilhete tem de corresponder à do
+     assento, e o avião do assento ao avião do voo.
+RI-3 A hora da venda tem de ser anterior à hora de partida de todos os voos dos
+     seus bilhetes.
+
+A RI-2 (bilhetes vendidos por classe até à capacidade do avião) é o CHECK de
+lotacao_voo. As violações são check_violation na tabela bilhete, com o nome
+da restrição em CONSTRAINT.
+*/
+CREATE OR REPLACE FUNCTION trg_ri_bilhete()
+RETURNS TRIGGER AS
+$$
+DECLARE
+    r RECORD;
+BEGIN
+    SELECT n.id, n.lugar, n.no_serie, n.prim_classe,
+        a.prim_classe AS classe_assento, v.no_serie AS aviao_voo
+    INTO r
+    FROM novos n
+    JOIN voo v ON v.id = n.voo_id AND v.hora_partida = n.hora_partida
+    LEFT JOIN assento a ON a.lugar = n.lugar AND a.no_serie = n.no_serie
+    WHERE n.lugar IS NOT NULL AND n.no_serie IS NOT NULL
+      AND (a.prim_classe IS DISTINCT FROM n.prim_classe OR n.no_serie IS DISTINCT FROM v.no_serie)
+    LIMIT 1;
+    IF FOUND THEN
+        IF r.no_serie IS DISTINCT FROM r.aviao_voo THEN
+            RAISE EXCEPTION 'Aviao do assento (%) NAO corresponde ao aviao do voo (%) no bilhete %.',
+                r.no_serie, r.aviao_voo, r.id
+                USING ERRCODE = 'check_violation', TABLE = 'bilhete', CONSTRAINT = 'ri_1';
+        END IF;
+        RAISE EXCEPTION 'Classe do bilhete % (prim_classe = %) NAO corresponde à classe do assento % (prim_classe = %).',
+            r.id, r.prim_classe, r.lugar, r.classe_assento
+            USING ERRCODE = 'check_violation', TABLE = 'bilhete', CONSTRAINT = 'ri_1';
+    END IF;
+
+    -- a hora_partida do bilhete é a do voo (chave estrangeira)
+    IF TG_OP = 'INSERT' THEN
+        SELECT n.id, ve.hora AS hora_venda, n.hora_partida
+        INTO r
+        FROM novos n
+        JOIN venda ve ON ve.codigo_reserva = n.codigo_reserva
+        WHERE ve.hora >= n.hora_partida
+        LIMIT 1;
+    ELSE
+        -- só os bilhetes que mudaram de venda, de voo ou de hora de partida (com o voo, por
+        -- ON UPDATE CASCADE); o check-in não muda nenhum
+        SELECT n.id, ve.hora AS hora_venda, n.hora_partida
+        INTO r
+        FROM novos n
+        JOIN antigos o ON o.id = n.id
+        JOIN venda ve ON ve.codigo_reserva = n.codigo_reserva
+        WHERE (n.codigo_reserva, n.voo_id, n.hora_partida) IS DISTINCT FROM (o.codigo_reserva, o.voo_id, o.hora_partida)
+          AND ve.hora >= n.hora_partida
+        LIMIT 1;
+    END IF;
+    IF FOUND THEN
+        RAISE EXCEPTION 'Hora da venda (%) não pode ser posterior ou igual à hora de partida do voo (%) no bilhete %.',
+            r.hora_venda, r.hora_partida, r.id
+            USING ERRCODE = 'check_violation', TABLE = 'bilhete', CONSTRAINT = 'ri_3';
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_ri_bilhete_insert
+AFTER INSERT ON bilhete
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_ri_bilhete();
+
+CREATE TRIGGER trg_ri_bilhete_update
+AFTER UPDATE ON bilhete
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_ri_bilhete();
+
+/*
+Lugares livres por voo, para o check-in.
+
+assento_livre tem uma linha por assento do avião ainda sem bilhete em cada voo.
+O check-in reclama um lugar com DELETE ... FOR UPDATE SKIP LOCKED, pelo que
+check-ins concorrentes no mesmo voo recebem lugares diferentes sem esperarem
+uns pelos outros. Os triggers abaixo mantêm a tabela quando se atribui ou liberta
+um lugar em bilhete (incluindo inserções diretas, como as do populate.sql).
+*/
+CREATE TABLE assento_livre (
+	voo_id INTEGER,
+	lugar VARCHAR(3),
+	prim_classe BOOLEAN NOT NULL,
+	PRIMARY KEY (voo_id, lugar)
+);
+
+CREATE INDEX idx_assento_livre_classe ON assento_livre (voo_id, prim_classe, lugar);
+
+-- Lugares livres calculados a partir das tabelas base (usada para verificar/reconstruir assento_livre).
+CREATE OR REPLACE VIEW assento_livre_esperado AS
+SELECT v.id AS voo_id, a.lugar, a.prim_classe
+FROM voo v
+JOIN assento a ON a.no_serie = v.no_serie
+WHERE NOT EXISTS (
+	SELECT 1 FROM bilhete b
+	WHERE b.voo_id = v.id AND b.lugar = a.lugar
+);
+
+CREATE OR REPLACE FUNCTION trg_assento_livre_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    -- Novo voo ou troca de avião: todos os assentos do avião ainda sem bilhete.
+    DELETE FROM assento_livre WHERE voo_id = NEW.id;
+
+    INSERT INTO assento_livre (voo_id, lugar, prim_classe)
+    SELECT NEW.id, a.lugar, a.prim_classe
+    FROM assento a
+    WHERE a.no_serie = NEW.no_serie
+      AND NOT EXISTS (
+        SELECT 1 FROM bilhete b
+        WHERE b.voo_id = NEW.id AND b.lugar = a.lugar
+      );
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_assento_livre_voo
+AFTER INSERT OR UPDATE OF no_serie ON voo
+FOR EACH ROW
+EXECUTE FUNCTION trg_assento_livre_voo();
+
+CREATE OR REPLACE FUNCTION trg_assento_livre_assento()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM assento_livre l
+        USING voo v
+        WHERE v.id = l.voo_id
+          AND v.no_serie = OLD.no_serie
+          AND l.lugar = OLD.lugar;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO assento_livre (voo_id, lugar, prim_classe)
+        SELECT v.id, NEW.lugar, NEW.prim_classe
+        FROM voo v
+        WHERE v.no_serie = NEW.no_serie
+          AND NOT EXISTS (
+            SELECT 1 FROM bilhete b
+            WHERE b.voo_id = v.id AND b.lugar = NEW.lugar
+          );
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_assento_livre_assento
+AFTER INSERT OR DELETE OR UPDATE OF lugar, no_serie, prim_classe ON assento
+FOR EACH ROW
+EXECUTE FUNCTION trg_assento_livre_assento();
+
+CREATE OR REPLACE FUNCTION trg_assento_livre_bilhete()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.voo_id IS NOT DISTINCT FROM NEW.voo_id
+       AND OLD.lugar IS NOT DISTINCT FROM NEW.lugar THEN
+        RETURN NULL;
+    END IF;
+
+    -- O lugar antigo volta a ficar livre.
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.lugar IS NOT NULL THEN
+        INSERT INTO assento_livre (voo_id, lugar, prim_classe)
+        SELECT OLD.voo_id, a.lugar, a.prim_classe
+        FROM voo v
+        JOIN assento a ON a.no_serie = v.no_serie AND a.lugar = OLD.lugar
+        WHERE v.id = OLD.voo_id AND v.hora_partida = OLD.hora_partida
+        ON CONFLICT (voo_id, lugar) DO NOTHING;
+    END IF;
+
+    -- O lugar novo deixa de estar livre (o check-in já o retirou ao reclamá-lo).
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.lugar IS NOT NULL THEN
+        DELETE FROM assento_livre
+        WHERE voo_id = NEW.voo_id AND lugar = NEW.lugar;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_assento_livre_bilhete
+AFTER INSERT OR DELETE OR UPDATE OF voo_id, lugar ON bilhete
+FOR EACH ROW
+EXECUTE FUNCTION trg_assento_livre_bilhete();
+
+CREATE OR REPLACE FUNCTION trg_assento_livre_bilhete_truncate()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    INSERT INTO assento_livre (voo_id, lugar, prim_classe)
+    SELECT v.id, a.lugar, a.prim_classe
+    FROM voo v
+    JOIN assento a ON a.no_serie = v.no_serie
+    ON CONFLICT (voo_id, lugar) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_assento_livre_bilhete_truncate
+AFTER TRUNCATE ON bilhete
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_assento_livre_bilhete_truncate();
+
+/*
+Estatísticas por voo (ponto 4 do relatório).
+
+estatisticas_voos tem o esquema da antiga vista materializada, mais o voo_id
+como chave, e é mantida pelos triggers abaixo à medida que se vendem bilhetes,
+em vez de ser recalculada por inteiro a cada REFRESH. Os bilhetes e os assentos
+são contados em subconsultas separadas por voo: a vista materializada juntava
+bilhete e assento duas vezes cada, o que multiplicava as linhas (e os preços
+somados) antes do COUNT(DISTINCT).
+*/
+CREATE TABLE estatisticas_voos (
+	voo_id INTEGER PRIMARY KEY,
+	no_serie VARCHAR(80),
+	hora_partida TIMESTAMP,
+	cidade_partida VARCHAR(255),
+	pais_partida VARCHAR(255),
+	cidade_chegada VARCHAR(255),
+	pais_chegada VARCHAR(255),
+	ano NUMERIC,
+	mes NUMERIC,
+	dia_do_mes NUMERIC,
+	dia_da_semana TEXT,
+	passageiros_1c BIGINT NOT NULL DEFAULT 0,
+	passageiros_2c BIGINT NOT NULL DEFAULT 0,
+	assentos_1c BIGINT NOT NULL DEFAULT 0,
+	assentos_2c BIGINT NOT NULL DEFAULT 0,
+	vendas_1c NUMERIC NOT NULL DEFAULT 0,
+	vendas_2c NUMERIC NOT NULL DEFAULT 0
+);
+
+-- Estatísticas calculadas a partir das tabelas base (usada para verificar/reconstruir estatisticas_voos).
+CREATE OR REPLACE VIEW estatisticas_voos_esperada AS
+SELECT
+	v.id AS voo_id,
+	v.no_serie,
+	v.hora_partida,
+	a1.cidade AS cidade_partida,
+	a1.pais AS pais_partida,
+	a2.cidade AS cidade_chegada,
+	a2.pais AS pais_chegada,
+	EXTRACT(YEAR FROM v.hora_partida) AS ano,
+	EXTRACT(MONTH FROM v.hora_partida) AS mes,
+	EXTRACT(DAY FROM v.hora_partida) AS dia_do_mes,
+	TRIM(TO_CHAR(v.hora_partida, 'Day')) AS dia_da_semana,
+	b.passageiros_1c,
+	b.passageiros_2c,
+	s.assentos_1c,
+	s.assentos_2c,
+	b.vendas_1c,
+	b.vendas_2c
+FROM voo v
+JOIN aeroporto a1 ON a1.codigo = v.partida
+JOIN aeroporto a2 ON a2.codigo = v.chegada
+CROSS JOIN LATERAL (
+	SELECT
+		COUNT(*) FILTER (WHERE prim_classe) AS passageiros_1c,
+		COUNT(*) FILTER (WHERE NOT prim_classe) AS passageiros_2c,
+		COALESCE(SUM(preco) FILTER (WHERE prim_classe), 0) AS vendas_1c,
+		COALESCE(SUM(preco) FILTER (WHERE NOT prim_classe), 0) AS vendas_2c
+	FROM bilhete
+	WHERE voo_id = v.id
+) b
+CROSS JOIN LATERAL (
+	SELECT
+		COUNT(*) FILTER (WHERE prim_classe) AS assentos_1c,
+		COUNT(*) FILTER (WHERE NOT prim_classe) AS assentos_2c
+	FROM assento
+	WHERE no_serie = v.no_serie
+) s;
+
+-- Recalcula as estatísticas dos voos indicados (de todos se NULL) a partir das tabelas base.
+CREATE OR REPLACE FUNCTION recalcular_estatisticas_voos(p_voos INTEGER[] DEFAULT NULL)
+RETURNS INTEGER AS
+$$
+DECLARE
+    v_linhas INTEGER;
+BEGIN
+    -- as dos voos arquivados ficam como estavam (ver arquivar_particoes)
+    DELETE FROM estatisticas_voos e
+    WHERE (p_voos IS NULL OR e.voo_id = ANY(p_voos))
+      AND NOT EXISTS (
+        SELECT 1 FROM estatisticas_voos_esperada x WHERE x.voo_id = e.voo_id
+      )
+      AND NOT EXISTS (
+        SELECT 1 FROM arquivo.voo a WHERE a.id = e.voo_id
+      );
+
+    INSERT INTO estatisticas_voos
+    SELECT * FROM estatisticas_voos_esperada
+    WHERE p_voos IS NULL OR voo_id = ANY(p_voos)
+    ON CONFLICT (voo_id) DO UPDATE
+    SET no_serie = EXCLUDED.no_serie,
+        hora_partida = EXCLUDED.hora_partida,
+        cidade_partida = EXCLUDED.cidade_partida,
+        pais_partida = EXCLUDED.pais_partida,
+        cidade_chegada = EXCLUDED.cidade_chegada,
+        pais_chegada = EXCLUDED.pais_chegada,
+        ano = EXCLUDED.ano,
+        mes = EXCLUDED.mes,
+        dia_do_mes = EXCLUDED.dia_do_mes,
+        dia_da_semana = EXCLUDED.dia_da_semana,
+        passageiros_1c = EXCLUDED.passageiros_1c,
+        passageiros_2c = EXCLUDED.passageiros_2c,
+        assentos_1c = EXCLUDED.assentos_1c,
+        assentos_2c = EXCLUDED.assentos_2c,
+        vendas_1c = EXCLUDED.vendas_1c,
+        vendas_2c = EXCLUDED.vendas_2c;
+    GET DIAGNOSTICS v_linhas = ROW_COUNT;
+
+    RETURN v_linhas;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_estatisticas_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    -- Novo voo ou alteração de avião, hora ou aeroportos: recalcula a linha deste voo.
+    PERFORM recalcular_estatisticas_voos(ARRAY[NEW.id]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estatisticas_voo
+AFTER INSERT OR UPDATE OF no_serie, hora_partida, partida, chegada ON voo
+FOR EACH ROW
+EXECUTE FUNCTION trg_estatisticas_voo();
+
+CREATE OR REPLACE FUNCTION trg_estatisticas_aeroporto()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    UPDATE estatisticas_voos e
+    SET cidade_partida = NEW.cidade, pais_partida = NEW.pais
+    FROM voo v
+    WHERE v.id = e.voo_id AND v.partida = NEW.codigo;
+
+    UPDATE estatisticas_voos e
+    SET cidade_chegada = NEW.cidade, pais_chegada = NEW.pais
+    FROM voo v
+    WHERE v.id = e.voo_id AND v.chegada = NEW.codigo;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estatisticas_aeroporto
+AFTER UPDATE OF cidade, pais ON aeroporto
+FOR EACH ROW
+EXECUTE FUNCTION trg_estatisticas_aeroporto();
+
+CREATE OR REPLACE FUNCTION trg_estatisticas_assento()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE estatisticas_voos e
+        SET assentos_1c = assentos_1c - (OLD.prim_classe)::INTEGER,
+            assentos_2c = assentos_2c - (NOT OLD.prim_classe)::INTEGER
+        FROM voo v
+        WHERE v.id = e.voo_id AND v.no_serie = OLD.no_serie;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE estatisticas_voos e
+        SET assentos_1c = assentos_1c + (NEW.prim_classe)::INTEGER,
+            assentos_2c = assentos_2c + (NOT NEW.prim_classe)::INTEGER
+        FROM voo v
+        WHERE v.id = e.voo_id AND v.no_serie = NEW.no_serie;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estatisticas_assento
+AFTER INSERT OR DELETE OR UPDATE OF no_serie, prim_classe ON assento
+FOR EACH ROW
+EXECUTE FUNCTION trg_estatisticas_assento();
+
+CREATE OR REPLACE FUNCTION trg_estatisticas_bilhete()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.voo_id IS NOT DISTINCT FROM NEW.voo_id
+       AND OLD.prim_classe = NEW.prim_classe
+       AND OLD.preco = NEW.preco THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE estatisticas_voos
+        SET passageiros_1c = passageiros_1c - (OLD.prim_classe)::INTEGER,
+            passageiros_2c = passageiros_2c - (NOT OLD.prim_classe)::INTEGER,
+            vendas_1c = vendas_1c - CASE WHEN OLD.prim_classe THEN OLD.preco ELSE 0 END,
+            vendas_2c = vendas_2c - CASE WHEN OLD.prim_classe THEN 0 ELSE OLD.preco END
+        WHERE voo_id = OLD.voo_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE estatisticas_voos
+        SET passageiros_1c = passageiros_1c + (NEW.prim_classe)::INTEGER,
+            passageiros_2c = passageiros_2c + (NOT NEW.prim_classe)::INTEGER,
+            vendas_1c = vendas_1c + CASE WHEN NEW.prim_classe THEN NEW.preco ELSE 0 END,
+            vendas_2c = vendas_2c + CASE WHEN NEW.prim_classe THEN 0 ELSE NEW.preco END
+        WHERE voo_id = NEW.voo_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estatisticas_bilhete
+AFTER INSERT OR DELETE OR UPDATE OF voo_id, prim_classe, preco ON bilhete
+FOR EACH ROW
+EXECUTE FUNCTION trg_estatisticas_bilhete();
+
+CREATE OR REPLACE FUNCTION trg_estatisticas_bilhete_truncate()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    UPDATE estatisticas_voos
+    SET passageiros_1c = 0, passageiros_2c = 0, vendas_1c = 0, vendas_2c = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_estatisticas_bilhete_truncate
+AFTER TRUNCATE ON bilhete
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_estatisticas_bilhete_truncate();
+
+/*
+Cubos de agregados para a API de análise (app/analytics.py).
+
+cubo_vendas agrega estatisticas_voos por rota (país e cidade de partida e de
+chegada) e dia; cubo_frota conta os voos de cada avião por rota e mês. Cada
+alteração de estatisticas_voos acrescenta o dia do voo a cubo_pendente (só uma
+inserção, sem bloquear linhas partilhadas entre vendas concorrentes) e
+atualizar_cubos() recalcula apenas os dias e meses pendentes. As consultas de
+análise leem umas centenas de linhas do cubo em vez de percorrerem todos os voos.
+*/
+CREATE TABLE cubo_vendas (
+	dia DATE,
+	pais_partida VARCHAR(255),
+	cidade_partida VARCHAR(255),
+	pais_chegada VARCHAR(255),
+	cidade_chegada VARCHAR(255),
+	voos INTEGER NOT NULL,
+	passageiros_1c BIGINT NOT NULL,
+	passageiros_2c BIGINT NOT NULL,
+	assentos_1c BIGINT NOT NULL,
+	assentos_2c BIGINT NOT NULL,
+	vendas_1c NUMERIC NOT NULL,
+	vendas_2c NUMERIC NOT NULL,
+	PRIMARY KEY (dia, pais_partida, cidade_partida, pais_chegada, cidade_chegada)
+);
+
+CREATE TABLE cubo_frota (
+	mes DATE,
+	pais_partida VARCHAR(255),
+	cidade_partida VARCHAR(255),
+	pais_chegada VARCHAR(255),
+	cidade_chegada VARCHAR(255),
+	no_serie VARCHAR(80),
+	voos INTEGER NOT NULL,
+	PRIMARY KEY (mes, pais_partida, cidade_partida, pais_chegada, cidade_chegada, no_serie)
+);
+
+CREATE TABLE cubo_pendente (
+	id BIGSERIAL PRIMARY KEY,
+	dia DATE NOT NULL
+);
+
+-- Voos de um dia ou mês (usado por atualizar_cubos).
+CREATE INDEX idx_estatisticas_hora_partida ON estatisticas_voos (hora_partida);
+
+CREATE OR REPLACE FUNCTION trg_cubo_pendente()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO cubo_pendente (dia) VALUES (OLD.hora_partida::DATE);
+    END IF;
+    IF TG_OP = 'INSERT'
+       OR (TG_OP = 'UPDATE' AND NEW.hora_partida::DATE IS DISTINCT FROM OLD.hora_partida::DATE) THEN
+        INSERT INTO cubo_pendente (dia) VALUES (NEW.hora_partida::DATE);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_cubo_pendente
+AFTER INSERT OR UPDATE OR DELETE ON estatisticas_voos
+FOR EACH ROW
+EXECUTE FUNCTION trg_cubo_pendente();
+
+CREATE OR REPLACE FUNCTION trg_cubo_pendente_truncate()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    TRUNCATE cubo_vendas, cubo_frota, cubo_pendente;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_cubo_pendente_truncate
+AFTER TRUNCATE ON estatisticas_voos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_cubo_pendente_truncate();
+
+/*
+Recalcula os cubos nos dias pendentes (em todos se p_tudo) e devolve o número
+de dias recalculados. Só apaga as entradas de cubo_pendente já confirmadas, e
+cada comando lê os dados confirmados até esse momento, pelo que uma venda que
+confirme a meio fica pendente para a próxima atualização. Se outra atualização
+estiver a decorrer, não faz nada e devolve 0.
+*/
+CREATE OR REPLACE FUNCTION atualizar_cubos(p_tudo BOOLEAN DEFAULT FALSE)
+RETURNS INTEGER AS
+$$
+DECLARE
+    v_dias DATE[];
+    v_meses DATE[];
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('atualizar_cubos')) THEN
+        RETURN 0;
+    END IF;
+
+    IF p_tudo THEN
+        DELETE FROM cubo_pendente;
+        DELETE FROM cubo_vendas;
+        DELETE FROM cubo_frota;
+        SELECT array_agg(DISTINCT hora_partida::DATE) INTO v_dias
+        FROM estatisticas_voos
+        WHERE hora_partida IS NOT NULL;
+    ELSE
+        WITH apagados AS (
+            DELETE FROM cubo_pendente RETURNING dia
+        )
+        SELECT array_agg(DISTINCT dia) INTO v_dias FROM apagados;
+    END IF;
+
+    IF v_dias IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    SELECT array_agg(DISTINCT date_trunc('month', d)::DATE) INTO v_meses
+    FROM unnest(v_dias) AS d;
+
+    DELETE FROM cubo_vendas WHERE dia = ANY(v_dias);
+    INSERT INTO cubo_vendas
+    SELECT
+        d.dia,
+        e.pais_partida, e.cidade_partida, e.pais_chegada, e.cidade_chegada,
+        COUNT(*),
+        SUM(e.passageiros_1c), SUM(e.passageiros_2c),
+        SUM(e.assentos_1c), SUM(e.assentos_2c),
+        SUM(e.vendas_1c), SUM(e.vendas_2c)
+    FROM unnest(v_dias) AS d(dia)
+    JOIN estatisticas_voos e
+      ON e.hora_partida >= d.dia AND e.hora_partida < d.dia + 1
+    GROUP BY d.dia, e.pais_partida, e.cidade_partida, e.pais_chegada, e.cidade_chegada;
+
+    DELETE FROM cubo_frota WHERE mes = ANY(v_meses);
+    INSERT INTO cubo_frota
+    SELECT
+        m.mes,
+        e.pais_partida, e.cidade_partida, e.pais_chegada, e.cidade_chegada,
+        e.no_serie,
+        COUNT(*)
+    FROM unnest(v_meses) AS m(mes)
+    JOIN estatisticas_voos e
+      ON e.hora_partida >= m.mes AND e.hora_partida < m.mes + INTERVAL '1 month'
+    WHERE e.no_serie IS NOT NULL
+    GROUP BY m.mes, e.pais_partida, e.cidade_partida, e.pais_chegada, e.cidade_chegada, e.no_serie;
+
+    RETURN array_length(v_dias, 1);
+END;
+$$ LANGUAGE plpgsql;
+
+/*
+Versões dos dados servidos pelas caches da aplicação, usadas nos ETag de / e de
+/voos/<partida> (app/cache.py). A chave é ('aeroporto', '') para a tabela
+aeroporto e ('voo', <partida>) para os voos de cada aeroporto de partida. A
+versão é o instante da última alteração, estritamente crescente por chave, e
+como é lida no mesmo comando que os dados corresponde sempre a eles. Uma chave
+sem linha nunca mudou desde a carga inicial (data/gerador.py marca todas).
+*/
+CREATE TABLE versao_dados (
+	tabela VARCHAR(20) NOT NULL,
+	chave VARCHAR(80) NOT NULL,
+	alterado_em TIMESTAMPTZ NOT NULL,
+	PRIMARY KEY (tabela, chave)
 );
 
+CREATE OR REPLACE FUNCTION marcar_versao(p_tabela TEXT, p_chaves TEXT[])
+RETURNS VOID AS
+$$
+    -- por ordem de chave, para duas transações não se bloquearem mutuamente
+    INSERT INTO versao_dados (tabela, chave, alterado_em)
+    SELECT DISTINCT p_tabela, c, clock_timestamp()
+    FROM unnest(p_chaves) AS c
+    ORDER BY 2
+    ON CONFLICT (tabela, chave) DO UPDATE
+    SET alterado_em = GREATEST(versao_dados.alterado_em + INTERVAL '1 microsecond', EXCLUDED.alterado_em);
+$$ LANGUAGE sql;
+
+/*
+Notificações de alteração para as caches da aplicação (app/cache.py).
+Cada worker escuta estes canais com LISTEN e invalida a cache correspondente.
+*/
+CREATE OR REPLACE FUNCTION trg_notificar_aeroporto()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    PERFORM marcar_versao('aeroporto', ARRAY['']);
+    PERFORM pg_notify('aeroporto_alterado', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_notificar_aeroporto
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON aeroporto
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_notificar_aeroporto();
+
+CREATE OR REPLACE FUNCTION trg_notificar_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    -- O payload é o aeroporto de partida afetado (notificações iguais na mesma transação são agrupadas).
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('voo_alterado', OLD.partida);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('voo_alterado', NEW.partida);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_notificar_voo
+AFTER INSERT OR UPDATE OR DELETE ON voo
+FOR EACH ROW
+EXECUTE FUNCTION trg_notificar_voo();
+
+-- A versão dos voos de cada aeroporto de partida afetado, uma vez por comando.
+CREATE OR REPLACE FUNCTION trg_versao_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM marcar_versao('voo', ARRAY(SELECT partida FROM novos));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM marcar_versao('voo', ARRAY(SELECT partida FROM antigos));
+    ELSE
+        PERFORM marcar_versao('voo', ARRAY(SELECT partida FROM novos UNION SELECT partida FROM antigos));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_versao_voo_insert
+AFTER INSERT ON voo
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_versao_voo();
+
+CREATE TRIGGER trg_versao_voo_update
+AFTER UPDATE ON voo
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_versao_voo();
+
+CREATE TRIGGER trg_versao_voo_delete
+AFTER DELETE ON voo
+REFERENCING OLD TABLE AS antigos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_versao_voo();
+
+CREATE OR REPLACE FUNCTION trg_notificar_voo_truncate()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    PERFORM marcar_versao('voo', ARRAY(SELECT codigo FROM aeroporto));
+    -- Sem payload: todos os aeroportos.
+    PERFORM pg_notify('voo_alterado', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_notificar_voo_truncate
+AFTER TRUNCATE ON voo
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_notificar_voo_truncate();
+
+/*
+Partições por mês de partida.
+
+voo e bilhete têm uma partição por mês de hora_partida (voo_AAAA_MM e
+bilhete_AAAA_MM). As consultas da aplicação filtram por hora_partida > NOW()
+(ou LOCALTIMESTAMP), e o bilhete por voo_id e hora_partida, pelo que o Postgres
+só lê as partições dos meses por partir: a exclusão é feita no arranque de cada
+execução, também nos prepared statements. Os triggers de voo contam os bilhetes
+só por voo_id (todas as partições), porque quando um voo muda de mês os seus
+bilhetes mudam de partição depois deles.
+
+criar_particoes() cria as partições em falta. Só é chamada por este ficheiro
+(os 12 meses seguintes), pela carga do gerador.py e por "flask particoes", que
+deve correr periodicamente (por exemplo num cron mensal) para haver sempre
+partições para os próximos meses; a aplicação nunca as cria. Não há partição
+DEFAULT: inserir ou mudar um voo (ou bilhete) para um mês sem partição falha
+com "no partition of relation ... found for row" (check_violation) e o comando
+é desfeito. arquivar_particoes() passa as partições de meses já terminados para
+o esquema arquivo.
+*/
+CREATE OR REPLACE FUNCTION criar_particoes(p_desde TIMESTAMP, p_ate TIMESTAMP)
+RETURNS INTEGER AS
+$$
+DECLARE
+    v_mes TIMESTAMP;
+    v_sufixo TEXT;
+    v_criadas INTEGER := 0;
+BEGIN
+    -- um "flask particoes" e uma carga (ou arquivar_particoes) podem correr ao mesmo tempo
+    PERFORM pg_advisory_xact_lock(hashtext('particoes'));
+    FOR v_mes IN SELECT generate_series(date_trunc('month', p_desde), p_ate, INTERVAL '1 month') LOOP
+        v_sufixo := to_char(v_mes, 'YYYY_MM');
+        -- já existe, ou o mês já foi arquivado
+        CONTINUE WHEN to_regclass('voo_' || v_sufixo) IS NOT NULL
+            OR to_regclass('arquivo.voo_' || v_sufixo) IS NOT NULL;
+        EXECUTE format('CREATE TABLE %I PARTITION OF voo FOR VALUES FROM (%L) TO (%L)',
+            'voo_' || v_sufixo, v_mes, v_mes + INTERVAL '1 month');
+        EXECUTE format('CREATE TABLE %I PARTITION OF bilhete FOR VALUES FROM (%L) TO (%L)',
+            'bilhete_' || v_sufixo, v_mes, v_mes + INTERVAL '1 month');
+        v_criadas := v_criadas + 1;
+    END LOOP;
+    RETURN v_criadas;
+END;
+$$ LANGUAGE plpgsql;
+
+/*
+Arquiva os meses cujos voos partiram todos antes de p_antes e devolve quantos.
+As partições são desligadas de bilhete e de voo e ligadas a arquivo.bilhete e
+arquivo.voo; as linhas desses voos em lotacao_voo, assento_livre e chave_voo são
+apagadas e as de estatisticas_voos ficam, tal como os cubos. Cada DETACH bloqueia voo e
+bilhete por instantes (DETACH CONCURRENTLY não pode correr numa função), e o
+ATTACH lê a partição para validar o intervalo: para correr fora das horas de ponta.
+*/
+CREATE OR REPLACE FUNCTION arquivar_particoes(p_antes TIMESTAMP)
+RETURNS INTEGER AS
+$$
+DECLARE
+    r RECORD;
+    v_chave TEXT;
+    v_arquivadas INTEGER := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('particoes'));
+    FOR r IN
+        SELECT c.relname AS voo, 'bilhete_' || substr(c.relname, 5) AS bilhete,
+            to_timestamp(substr(c.relname, 5), 'YYYY_MM')::TIMESTAMP AS mes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'voo'::regclass
+          AND c.relname ~ '^voo_[0-9]{4}_[0-9]{2}$'
+        ORDER BY 3
+    LOOP
+        EXIT WHEN r.mes + INTERVAL '1 month' > p_antes;
+
+        EXECUTE format('DELETE FROM lotacao_voo l USING %I v WHERE l.voo_id = v.id', r.voo);
+        EXECUTE format('DELETE FROM assento_livre l USING %I v WHERE l.voo_id = v.id', r.voo);
+        EXECUTE format('DELETE FROM chave_voo c USING %I v WHERE c.id = v.id', r.voo);
+
+        -- o bilhete primeiro, e sem a chave estrangeira para voo, que deixa de ter estes voos
+        EXECUTE format('ALTER TABLE bilhete DETACH PARTITION %I', r.bilhete);
+        FOR v_chave IN
+            SELECT conname FROM pg_constraint
+            WHERE conrelid = r.bilhete::regclass AND confrelid = 'voo'::regclass
+        LOOP
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', r.bilhete, v_chave);
+        END LOOP;
+        EXECUTE format('ALTER TABLE voo DETACH PARTITION %I', r.voo);
+
+        EXECUTE format('ALTER TABLE %I SET SCHEMA arquivo', r.voo);
+        EXECUTE format('ALTER TABLE %I SET SCHEMA arquivo', r.bilhete);
+        EXECUTE format('ALTER TABLE arquivo.voo ATTACH PARTITION arquivo.%I FOR VALUES FROM (%L) TO (%L)',
+            r.voo, r.mes, r.mes + INTERVAL '1 month');
+        EXECUTE format('ALTER TABLE arquivo.bilhete ATTACH PARTITION arquivo.%I FOR VALUES FROM (%L) TO (%L)',
+            r.bilhete, r.mes, r.mes + INTERVAL '1 month');
+        v_arquivadas := v_arquivadas + 1;
+    END LOOP;
+    RETURN v_arquivadas;
+END;
+$$ LANGUAGE plpgsql;
+
+/*
+Chaves de voo que não incluem a chave de partição: o id e os UNIQUE
+(no_serie, hora_chegada) e (hora_chegada, partida, chegada). Uma tabela sem
+partições tem as restrições verdadeiras, seguras entre transações concorrentes;
+o trigger trg_chave_voo copia-lhe as linhas de voo, e trg_apagar_voo e
+arquivar_particoes apagam-nas. As cargas com os triggers desligados
+(data/gerador.py) preenchem-na no fim, o que verifica as chaves dos voos carregados.
+*/
+CREATE TABLE chave_voo (
+	id INTEGER PRIMARY KEY,
+	no_serie VARCHAR(80),
+	hora_chegada TIMESTAMP,
+	partida CHAR(3),
+	chegada CHAR(3),
+	UNIQUE (no_serie, hora_chegada),
+	UNIQUE (hora_chegada, partida, chegada)
+);
+
+CREATE OR REPLACE FUNCTION trg_chave_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        DELETE FROM chave_voo WHERE id IN (SELECT id FROM antigos);
+    END IF;
+    INSERT INTO chave_voo (id, no_serie, hora_chegada, partida, chegada)
+    SELECT id, no_serie, hora_chegada, partida, chegada FROM novos;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_chave_voo_insert
+AFTER INSERT ON voo
+REFERENCING NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_chave_voo();
+
+CREATE TRIGGER trg_chave_voo_update
+AFTER UPDATE ON voo
+REFERENCING OLD TABLE AS antigos NEW TABLE AS novos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_chave_voo();
+
+-- As linhas das tabelas derivadas dos voos apagados (antes, ON DELETE CASCADE para voo).
+CREATE OR REPLACE FUNCTION trg_apagar_voo()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    DELETE FROM lotacao_voo WHERE voo_id IN (SELECT id FROM antigos);
+    DELETE FROM assento_livre WHERE voo_id IN (SELECT id FROM antigos);
+    DELETE FROM estatisticas_voos WHERE voo_id IN (SELECT id FROM antigos);
+    DELETE FROM chave_voo WHERE id IN (SELECT id FROM antigos);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Um voo que muda de partição não conta: num UPDATE só correm os triggers FOR EACH STATEMENT de UPDATE.
+CREATE TRIGGER trg_apagar_voo
+AFTER DELETE ON voo
+REFERENCING OLD TABLE AS antigos
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_apagar_voo();
+
+CREATE OR REPLACE FUNCTION trg_apagar_voo_truncate()
+RETURNS TRIGGER AS
+$$
+BEGIN
+    TRUNCATE lotacao_voo, assento_livre, chave_voo;
+    DELETE FROM estatisticas_voos e
+    WHERE NOT EXISTS (SELECT 1 FROM arquivo.voo a WHERE a.id = e.voo_id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_apagar_voo_truncate
+AFTER TRUNCATE ON voo
+FOR EACH STATEMENT
+EXECUTE FUNCTION trg_apagar_voo_truncate();
+
+/*
+Índices para as consultas da aplicação (app/consultas.py) e dos triggers.
+
+bilhete(voo_id, lugar) já tem índice pelo UNIQUE, tal como voo(no_serie, ...)
+e assento(lugar, no_serie) pelas chaves. O bench/planos.py corre EXPLAIN sobre
+cada consulta e falha se alguma passar a fazer Seq Scan numa tabela grande.
+*/
+-- Quadro de partidas: voos de um aeroporto por hora de partida.
+CREATE INDEX idx_voo_partida ON voo (partida, hora_partida);
+-- Próximos voos entre dois aeroportos.
+CREATE INDEX idx_voo_rota ON voo (partida, chegada, hora_partida);
+-- Bilhetes vendidos por voo e classe (lotação, RI-2, estatísticas).
+CREATE INDEX idx_bilhete_voo_classe ON bilhete (voo_id, prim_classe);
+-- Check-in por reserva e a chave estrangeira para venda.
+CREATE INDEX idx_bilhete_reserva ON bilhete (codigo_reserva);
+
+-- Partições do mês atual e dos 12 seguintes; data/gerador.py cria as dos dados que gera.
+SELECT criar_particoes(LOCALTIMESTAMP, LOCALTIMESTAMP + INTERVAL '12 months');
+
+
+
+
+
 
 
 